@@ -1,21 +1,34 @@
-import json
-import os
-from scripts.gui import create_gui
+import argparse
+from scripts.config import CONFIG_FILE, data_file_for, index_path_for, load_config, save_config
 
-CONFIG_FILE = 'data/config.json'
-
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
-    else:
-        raise FileNotFoundError("Config file not found. Please ensure 'config.json' exists.")
-    return config
-
-def save_config(config):
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
+def parse_args():
+    parser = argparse.ArgumentParser(description="SD-Image-Organizer")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes used to organize images (default: config value, or one per CPU)")
+    parser.add_argument('--watch', action='store_true',
+                        help="Run headless: watch the input directory and organize new images as they are written")
+    parser.add_argument('--poll', action='store_true',
+                        help="With --watch, poll the directory instead of using filesystem events")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="With --watch, serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    return parser.parse_args()
 
 if __name__ == "__main__":
+    args = parse_args()
     config = load_config()
-    create_gui(config, save_config)
+    if args.workers is not None:
+        config['workers'] = args.workers
+
+    if args.watch:
+        # Headless, so Tk is never imported
+        from scripts.watcher import watch_images
+        # The same index, journal and rules as `python -m scripts watch`
+        watch_images(config['base_dir'], config['output_dir'], config['node_defaults'], index_path=index_path_for(CONFIG_FILE),
+                     journal_path=data_file_for(CONFIG_FILE, 'watch_journal.jsonl'),
+                     rules_file=data_file_for(CONFIG_FILE, 'rules.json'),
+                     whole_words=config.get('whole_words', False), use_polling=args.poll,
+                     placement=config.get('placement', 'move'), metrics_port=args.metrics_port,
+                     ignore=config.get('scan_ignore', ()))
+    else:
+        from scripts.gui import create_gui
+        create_gui(config, save_config)
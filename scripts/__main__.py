@@ -0,0 +1,9 @@
+import sys
+import time
+
+# Taken before anything else is imported, for --timings
+START_TIME = time.perf_counter()
+
+if __name__ == '__main__':
+    from scripts.cli import main
+    sys.exit(main(start_time=START_TIME))
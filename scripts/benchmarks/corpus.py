@@ -0,0 +1,42 @@
+import sys
+import argparse
+from typing import Dict
+from scripts.tests.corpus import KINDS, write_corpus
+
+# Writes a synthetic corpus (see scripts.tests.corpus) to disk, to reuse across benchmark runs.
+# Usage: python -m scripts.benchmarks.corpus DIR [--count N] [--mix comfyui=6,a1111=3,large=1,none=1]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    # "comfyui=6,a1111=3,large=1" -> relative weights
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError("Unknown image kind " + kind + "; use " + ', '.join(KINDS))
+        mix[kind] = float(weight) if weight else 1.0
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m scripts.benchmarks.corpus', description="Write a synthetic image corpus")
+    parser.add_argument('directory')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--mix', default='comfyui=6,a1111=3,large=1,none=1', help="Kinds of image and their weights (default: %(default)s)")
+    parser.add_argument('--size', type=int, default=256, help="Image width and height in pixels (default: %(default)s)")
+    parser.add_argument('--workflow-kb', type=int, default=500, help="Workflow size of 'large' images (default: %(default)s)")
+    parser.add_argument('--per-dir', type=int, default=250, help="Images per subfolder, 0 for none (default: %(default)s)")
+    parser.add_argument('--noise', action='store_true', help="Random pixels, so files are as big as real renders")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    paths = write_corpus(args.directory, args.count, args.size, args.seed, mix, args.workflow_kb, args.per_dir or None, args.noise)
+    print(f"{len(paths)} images written to {args.directory}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import sys
+import time
+import random
+import resource
+from scripts.dedupe import DEFAULT_THRESHOLD, HASH_BITS, MultiIndexHash, group_hashes
+
+# Near-duplicate grouping on synthetic hashes: clusters of a few hashes a couple of bits apart,
+# like a ComfyUI batch. Multi-index hashing against comparing all pairs (only run on the
+# smaller sizes). Peak memory is that of the whole process, hashes included.
+# Usage: python -m scripts.benchmarks.dedupe [largest size] [threshold]
+
+SIZES = (10000, 100000, 1000000)
+ALL_PAIRS_LIMIT = 10000
+
+
+def make_hashes(count, rng):
+    hashes = []
+    while len(hashes) < count:
+        base = rng.getrandbits(HASH_BITS)
+        hashes.append(base)
+        for _ in range(rng.randrange(4)):
+            variant = base
+            for bit in rng.sample(range(HASH_BITS), rng.randint(0, 3)):
+                variant ^= 1 << bit
+            hashes.append(variant)
+    return hashes[:count]
+
+
+def all_pairs(hashes, threshold):
+    return sum(1 for i in range(len(hashes)) for j in range(i + 1, len(hashes))
+               if (hashes[i] ^ hashes[j]).bit_count() <= threshold)
+
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else SIZES[-1]
+    threshold = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_THRESHOLD
+    rng = random.Random(1)
+    print(f"threshold {threshold} bits")
+    print(f"{'hashes':>8} {'chunks':>7} {'groups':>8} {'grouping s':>11} {'peak MB':>8} {'all pairs s':>12}")
+    for size in [size for size in SIZES if size <= largest]:
+        hashes = make_hashes(size, rng)
+        start = time.perf_counter()
+        groups = group_hashes(hashes, threshold)
+        elapsed = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        brute = '-'
+        if size <= ALL_PAIRS_LIMIT:
+            start = time.perf_counter()
+            pairs = all_pairs(hashes, threshold)
+            brute = f"{time.perf_counter() - start:.1f}"
+            found = sum(1 for _ in MultiIndexHash(hashes, threshold).pairs())
+            assert found == pairs, (found, pairs)
+        chunks = MultiIndexHash._pick_chunk_count(size, threshold)
+        print(f"{size:>8} {chunks:>7} {len(groups):>8} {elapsed:>11.1f} {peak:>8.0f} {brute:>12}")
+
+
+if __name__ == '__main__':
+    main()
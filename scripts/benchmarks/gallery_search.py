@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import random
+import tempfile
+from scripts.gallery_search import SearchFilters, count, paths_for, search
+from scripts.metadata_extractor import ImageRecord
+from scripts.metadata_index import MetadataIndex
+
+# Gallery queries against a synthetic index: time to the first screen of results, to the full
+# match list the grid scrolls through, and to the paths of one screen.
+# Usage: python -m scripts.benchmarks.gallery_search [images]
+
+WORDS = ('portrait', 'castle', 'forest', 'red dress', 'armor', 'night', 'city street', 'rain', 'smile', 'sunset',
+         'cinematic', 'highly detailed', 'bokeh', 'snow', 'tavern', 'library', 'dragon', 'masterpiece', 'beach', 'ruins')
+NAMES = ('alice smith', 'bob jones', 'carol white', 'dave brown', 'eve black', 'frank green')
+MODELS = tuple(f"model_{i:02d}_v{i % 3 + 1}.safetensors" for i in range(20))
+LORAS = tuple(f"style_lora_{i:02d}" for i in range(50))
+SAMPLERS = ('euler', 'euler_ancestral', 'dpmpp_2m', 'dpmpp_2m_sde', 'dpmpp_3m_sde', 'ddim', 'uni_pc', 'lcm')
+SCREEN = 60
+
+QUERIES = (
+    ("everything", SearchFilters()),
+    ("text 'castle'", SearchFilters(text='castle')),
+    ("text 'red dress night'", SearchFilters(text='red dress night')),
+    ("prompt 'alice smith'", SearchFilters(prompt='alice smith')),
+    ("prompt 'zz' (LIKE)", SearchFilters(prompt='zz')),
+    ("model 'model_07'", SearchFilters(model='model_07')),
+    ("lora 'lora_13'", SearchFilters(lora='lora_13')),
+    ("sampler + cfg 6-8", SearchFilters(sampler='dpmpp_2m', cfg_min=6, cfg_max=8)),
+    ("seed range (0.1%)", SearchFilters(seed_min=1000000, seed_max=5000000)),
+    ("category", SearchFilters(category='characters/alice smith')),
+    ("text + model + sampler", SearchFilters(text='forest', model='v2', sampler='euler')),
+)
+
+
+def make_records(count_, rng):
+    for i in range(count_):
+        name = rng.choice(NAMES)
+        prompt = ', '.join([f"a photo of {name}"] + rng.sample(WORDS, 6))
+        record = ImageRecord(generator='ComfyUI', prompts=[prompt], models=[rng.choice(MODELS)],
+                             loras=rng.sample(LORAS, rng.randint(0, 3)), sampler=rng.choice(SAMPLERS),
+                             seed=rng.randrange(2 ** 32), steps=30, cfg=rng.randrange(6, 25) / 2, width=1024, height=1024)
+        yield (f"/gallery/{i // 1000}/ComfyUI_{i:06d}_.png", 1000 + i, i, f"{i:032x}", '{}', record), ('characters', name)
+
+
+def build_index(db_path, images):
+    rng = random.Random(1)
+    start = time.perf_counter()
+    with MetadataIndex(db_path) as index:
+        batch = []
+        for entry, category in make_records(images, rng):
+            batch.append((entry, category))
+            if len(batch) == 1000 or entry[2] == images - 1:
+                index.put_many(entry for entry, _ in batch)
+                for entry, category in batch:
+                    index.set_category(entry[0], '/'.join(category))
+                batch = []
+    return time.perf_counter() - start
+
+
+def timed(function, *args, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    images = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'index.sqlite')
+        print(f"Building an index of {images} images... {build_index(db_path, images):.1f}s, "
+              f"{os.path.getsize(db_path) / 1024 / 1024:.0f} MB")
+
+        with MetadataIndex(db_path, readonly=True) as index:
+            print(f"{'query':<26} {'matches':>8} {'first screen ms':>16} {'all rowids ms':>14} {'count ms':>9} {'paths ms':>9}")
+            for name, filters in QUERIES:
+                first, first_ms = timed(search, index, filters, SCREEN)
+                rowids, all_ms = timed(search, index, filters)
+                matches, count_ms = timed(count, index, filters)
+                _, paths_ms = timed(paths_for, index, first)
+                print(f"{name:<26} {matches:>8} {first_ms:>16.1f} {all_ms:>14.1f} {count_ms:>9.1f} {paths_ms:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from datetime import datetime, timezone
+from scripts.config import APP_DIR
+from scripts.benchmarks.corpus import parse_mix
+from scripts.tests.corpus import kind_of, write_corpus
+from scripts.tests.helpers import write_rules
+
+# End-to-end benchmark: generates a synthetic corpus (ComfyUI, A1111, large workflows, no
+# metadata), then measures images/sec, latency per stage (walk, read chunks, parse, match, move),
+# peak memory and I/O syscalls for organize_images and MetadataParser.extract_metadata. Every
+# scenario runs in its own process so peak memory is its own. Results go to a JSON file; pass an
+# earlier one as --baseline to see what changed.
+# Usage: python -m scripts.benchmarks.harness [--count 2000] [--workers 1,4] [--baseline old.json]
+
+SCENARIOS = ('stages', 'extract_metadata', 'organize')
+
+# Metrics compared against a baseline: (path in a scenario's results, higher is better)
+KEY_METRICS = [
+    ('images_per_sec', True),
+    ('peak_rss_mb', False),
+    ('read_syscalls_per_image', False),
+    ('stages.walk.p50_ms', False),
+    ('stages.read_chunks.p50_ms', False),
+    ('stages.parse.p50_ms', False),
+    ('stages.parse.p99_ms', False),
+    ('stages.match.p50_ms', False),
+    ('stages.move.p50_ms', False),
+    ('kinds.comfyui.p50_ms', False),
+    ('kinds.a1111.p50_ms', False),
+    ('kinds.large.p50_ms', False),
+    ('kinds.none.p50_ms', False)
+]
+
+
+def latency_summary(samples):
+    # Seconds in, milliseconds out
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 4)
+
+    return {
+        'count': len(ordered),
+        'total_s': round(sum(ordered), 4),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 4),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': round(ordered[-1] * 1000, 4)
+    }
+
+
+def io_counters():
+    # Read/write syscalls and bytes of this process and the children it has waited for.
+    # Linux only; strace-free, so it runs anywhere without privileges.
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except OSError:
+        return None
+
+
+def peak_rss_mb():
+    # (this process, largest child) peak resident memory
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def context_switches():
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return sum(u.ru_nvcsw + u.ru_nivcsw for u in usage)
+
+
+def run_stages(input_dir, work_dir, workers):
+    # One image at a time through each stage of organizing, in one process
+    from scripts.png_chunks import read_png_text
+    from scripts.metadata_extractor import DEFAULT_NODE_DEFAULTS, build_record, parse_png_text
+    from scripts.move_plan import MovePlan, apply_plan
+    from scripts.organizer import iter_png_files
+    from scripts.rules import RuleSet, read_rules
+    from scripts.workflow_query import compile_query
+
+    rules = RuleSet(read_rules(write_rules(work_dir)))
+    node_filters = compile_query(DEFAULT_NODE_DEFAULTS).node_filters
+    times = {stage: [] for stage in ('walk', 'read_chunks', 'parse', 'match', 'move')}
+    plan = MovePlan()
+
+    start = time.perf_counter()
+    last = start
+    paths = []
+    for path in iter_png_files(input_dir):
+        now = time.perf_counter()
+        times['walk'].append(now - last)
+        paths.append(path)
+        last = now
+
+    for path in paths:
+        t0 = time.perf_counter()
+        png = read_png_text(path)
+        t1 = time.perf_counter()
+        prompt_info = parse_png_text(png, node_filters) if png and png.text else None
+        record = build_record(prompt_info, png.width, png.height, DEFAULT_NODE_DEFAULTS)
+        t2 = time.perf_counter()
+        decision = rules.decide(record, path) if record.has_metadata else None
+        t3 = time.perf_counter()
+        times['read_chunks'].append(t1 - t0)
+        times['parse'].append(t2 - t1)
+        times['match'].append(t3 - t2)
+        if decision:
+            for directory, mode in decision[1]:
+                plan.add(path, os.path.join(work_dir, 'out', directory), mode)
+
+    moved_at = [time.perf_counter()]
+    apply_plan(plan, os.path.join(work_dir, 'journal.jsonl'), lambda source, dest: moved_at.append(time.perf_counter()))
+    times['move'] = [b - a for a, b in zip(moved_at, moved_at[1:])]
+    elapsed = time.perf_counter() - start
+    return {'images': len(paths), 'moved': len(plan), 'elapsed_s': elapsed,
+            'stages': {stage: latency_summary(samples) for stage, samples in times.items()}}
+
+
+def run_extract_metadata(input_dir, work_dir, workers):
+    # What the GUI does for every image it shows
+    from scripts.metadata_parser import MetadataParser
+    from scripts.organizer import iter_png_files
+
+    parser = MetadataParser()
+    by_kind = {}
+    start = time.perf_counter()
+    for path in iter_png_files(input_dir):
+        t0 = time.perf_counter()
+        parser.extract_metadata(path)
+        by_kind.setdefault(kind_of(path), []).append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    return {'images': sum(len(samples) for samples in by_kind.values()), 'elapsed_s': elapsed,
+            'kinds': {kind: latency_summary(samples) for kind, samples in by_kind.items()}}
+
+
+def run_organize(input_dir, work_dir, workers):
+    from scripts.organizer import organize_images
+    from scripts.metadata_extractor import DEFAULT_NODE_DEFAULTS
+
+    images = count_images(input_dir)
+    start = time.perf_counter()
+    plan = organize_images(input_dir, os.path.join(work_dir, 'out'), DEFAULT_NODE_DEFAULTS, workers=workers,
+                           index_path=os.path.join(work_dir, 'index.sqlite'), journal_path=os.path.join(work_dir, 'journal.jsonl'),
+                           rules_file=write_rules(work_dir))
+    elapsed = time.perf_counter() - start
+    return {'images': images, 'moved': len(plan) if plan else 0, 'elapsed_s': elapsed, 'workers': workers}
+
+
+RUNNERS = {
+    'stages': run_stages,
+    'extract_metadata': run_extract_metadata,
+    'organize': run_organize
+}
+
+# Scenarios that move images, so they get a copy of the corpus
+MOVES_IMAGES = {'stages', 'organize'}
+
+
+def count_images(directory):
+    return sum(1 for _, _, files in os.walk(directory) for file in files if file.lower().endswith('.png'))
+
+
+def run_scenario(name, corpus_dir, work_dir, workers, result_file):
+    # Runs in the child process. The corpus is copied before the counters start.
+    input_dir = corpus_dir
+    if name in MOVES_IMAGES:
+        input_dir = os.path.join(work_dir, 'in')
+        shutil.copytree(corpus_dir, input_dir)
+    # Per-file log lines, such as those for the images without metadata the corpus has on purpose
+    logging.disable(logging.ERROR)
+    io_before = io_counters()
+    switches_before = context_switches()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = RUNNERS[name](input_dir, work_dir, workers)
+    io_after = io_counters()
+    switches = context_switches()
+    rss, children_rss = peak_rss_mb()
+
+    images = result['images'] or 1
+    result['images_per_sec'] = round(result['images'] / result['elapsed_s'], 2)
+    result['elapsed_s'] = round(result['elapsed_s'], 4)
+    result['peak_rss_mb'] = round(rss, 1) if rss is not None else None
+    result['peak_worker_rss_mb'] = round(children_rss, 1) if children_rss else None
+    result['context_switches'] = switches - switches_before if switches is not None else None
+    if io_before and io_after:
+        io = {key: io_after[key] - io_before[key] for key in ('syscr', 'syscw', 'rchar', 'wchar')}
+        result['io'] = io
+        result['read_syscalls_per_image'] = round(io['syscr'] / images, 2)
+        result['write_syscalls_per_image'] = round(io['syscw'] / images, 2)
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+def spawn(name, corpus_dir, workers, tmp):
+    work_dir = tempfile.mkdtemp(prefix=name + '-', dir=tmp)
+    result_file = os.path.join(work_dir, 'result.json')
+    subprocess.run([sys.executable, '-m', 'scripts.benchmarks.harness', '--scenario', name, '--corpus', corpus_dir,
+                    '--work', work_dir, '--result', result_file, '--workers', str(workers)], cwd=APP_DIR, check=True)
+    with open(result_file, encoding='utf-8') as f:
+        result = json.load(f)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def lookup(result, path):
+    for key in path.split('.'):
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def print_results(results, baseline=None):
+    print(f"{'scenario':<20} {'images/s':>9} {'peak MB':>8} {'reads/img':>10} {'writes/img':>11}")
+    for name, result in results['scenarios'].items():
+        print(f"{name:<20} {result['images_per_sec']:>9.1f} {result['peak_rss_mb'] or 0:>8.1f} "
+              f"{result.get('read_syscalls_per_image', 0):>10.1f} {result.get('write_syscalls_per_image', 0):>11.1f}")
+    stages = results['scenarios'].get('stages', {}).get('stages', {})
+    kinds = results['scenarios'].get('extract_metadata', {}).get('kinds', {})
+    for title, latencies in (('stage', stages), ('extract_metadata', kinds)):
+        if latencies:
+            print(f"\n{title:<20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+            for name, summary in latencies.items():
+                if summary['count']:
+                    print(f"{name:<20} {summary['p50_ms']:>9.3f} {summary['p95_ms']:>9.3f} {summary['p99_ms']:>9.3f} {summary['max_ms']:>9.3f}")
+
+    if not baseline:
+        return
+    print(f"\nChanges since {baseline['meta'].get('commit') or 'the baseline'} (+ is better)")
+    for name, result in results['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if not old:
+            continue
+        for path, higher_is_better in KEY_METRICS:
+            before, after = lookup(old, path), lookup(result, path)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            print(f"{name + ' ' + path:<48} {before:>10.3f} -> {after:>10.3f} {change if higher_is_better else -change:>+8.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m scripts.benchmarks.harness', description="Benchmark organizing and metadata extraction")
+    parser.add_argument('--count', type=int, default=2000, help="Images in the generated corpus (default: %(default)s)")
+    parser.add_argument('--mix', default='comfyui=6,a1111=3,large=1,none=1', help="Kinds of image and their weights (default: %(default)s)")
+    parser.add_argument('--size', type=int, default=256, help="Image width and height in pixels (default: %(default)s)")
+    parser.add_argument('--workflow-kb', type=int, default=500, help="Workflow size of 'large' images (default: %(default)s)")
+    parser.add_argument('--per-dir', type=int, default=250, help="Images per input subfolder (default: %(default)s)")
+    parser.add_argument('--corpus', help="Use the images in this folder, or generate the corpus there to keep it")
+    parser.add_argument('--workers', default=f"1,{os.cpu_count() or 1}", help="Worker counts for organize (default: %(default)s)")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Scenarios to run (default: %(default)s)")
+    parser.add_argument('--output', default='benchmark_results.json', help="Results file (default: %(default)s)")
+    parser.add_argument('--baseline', help="Earlier results file to compare against")
+    # Internal: one scenario in a child process
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--work', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        run_scenario(args.scenario, args.corpus, args.work, int(args.workers), args.result)
+        return
+
+    try:
+        mix = parse_mix(args.mix)
+        workers = [int(count) for count in args.workers.split(',')]
+    except ValueError as e:
+        parser.error(str(e))
+    scenarios = [name.strip() for name in args.scenarios.split(',')]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error("Unknown scenario " + name + "; use " + ', '.join(SCENARIOS))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = os.path.abspath(args.corpus) if args.corpus else os.path.join(tmp, 'corpus')
+        generated = count_images(corpus_dir) == 0
+        if generated:
+            print(f"Generating {args.count} images in {corpus_dir}")
+            write_corpus(corpus_dir, args.count, args.size, mix=mix, workflow_kb=args.workflow_kb, per_dir=args.per_dir)
+        images = count_images(corpus_dir)
+        corpus_bytes = sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(corpus_dir) for file in files)
+        # Every scenario reads from the OS file cache, not the disk
+        for root, _, files in os.walk(corpus_dir):
+            for file in files:
+                with open(os.path.join(root, file), 'rb') as f:
+                    while f.read(1024 * 1024):
+                        pass
+
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count()
+            },
+            'corpus': {
+                'images': images,
+                'megabytes': round(corpus_bytes / 1024 / 1024, 1),
+                'directory': args.corpus,
+                'mix': mix if generated else None,
+                'workflow_kb': args.workflow_kb if generated else None
+            },
+            'scenarios': {}
+        }
+        for name in scenarios:
+            for count in (workers if name == 'organize' else [1]):
+                label = f"organize-{count}" if name == 'organize' else name
+                print(f"Running {label}...")
+                results['scenarios'][label] = spawn(name, corpus_dir, count, tmp)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print()
+    print_results(results, baseline)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
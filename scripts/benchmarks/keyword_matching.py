@@ -0,0 +1,72 @@
+import sys
+import time
+import random
+from scripts.keyword_matcher import CategoryMatcher
+
+# Keyword matching cost as the wildcard files grow: the old per-keyword loops vs. the compiled matcher.
+# Usage: python -m scripts.benchmarks.keyword_matching [texts per run]
+
+KEYWORD_COUNTS = [10, 100, 1000, 10000, 50000]
+
+WORDS = ["portrait", "of", "a", "woman", "standing", "in", "the", "rain", "cinematic", "lighting",
+         "highly", "detailed", "masterpiece", "best", "quality", "smiling", "city", "at", "night"]
+
+
+def random_name(rng: random.Random) -> str:
+    return ' '.join(''.join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))).title()
+                    for _ in range(2))
+
+
+def make_texts(rng: random.Random, keywords, count):
+    texts = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(40)]
+        if rng.random() < 0.5:
+            words.insert(rng.randrange(len(words)), rng.choice(keywords))
+        texts.append(' '.join(words))
+    return texts
+
+
+def legacy_match(node_texts, prompts, character_keywords, location_keywords):
+    # organize_images before: lowercase every keyword and text per widget, per category
+    for keywords, category in ((character_keywords, 'characters'), (location_keywords, 'locations')):
+        for text in node_texts:
+            for keyword in keywords:
+                if keyword.lower() in text.lower():
+                    return category, keyword
+    for keywords, category in ((character_keywords, 'characters'), (location_keywords, 'locations')):
+        for keyword in keywords:
+            if any(keyword in prompt for prompt in prompts):
+                return category, keyword
+    return None
+
+
+def main():
+    text_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(0)
+    print(f"{'keywords':>9} {'build ms':>10} {'legacy us/img':>14} {'compiled us/img':>16} {'speedup':>8}")
+    for count in KEYWORD_COUNTS:
+        keywords = list({random_name(rng) for _ in range(count)})
+        characters, locations = keywords[:len(keywords) // 2], keywords[len(keywords) // 2:]
+        texts = make_texts(rng, keywords, text_count)
+
+        start = time.perf_counter()
+        matcher = CategoryMatcher([('characters', characters), ('locations', locations)])
+        build = time.perf_counter() - start
+
+        # Keep the legacy run short for large keyword counts; it is measured per image anyway
+        legacy_texts = texts[:max(5, text_count * 100 // count)]
+        start = time.perf_counter()
+        legacy = [legacy_match([text], [text], characters, locations) for text in legacy_texts]
+        legacy_time = (time.perf_counter() - start) / len(legacy_texts)
+
+        start = time.perf_counter()
+        compiled = [matcher.match_nodes([text]) or matcher.match_prompts([text]) for text in texts]
+        compiled_time = (time.perf_counter() - start) / len(texts)
+
+        assert compiled[:len(legacy)] == legacy
+        print(f"{count:>9} {build * 1000:>10.1f} {legacy_time * 1e6:>14.1f} {compiled_time * 1e6:>16.1f} {legacy_time / compiled_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
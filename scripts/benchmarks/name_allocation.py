@@ -0,0 +1,112 @@
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+import contextlib
+from scripts.move_plan import MovePlan, apply_plan
+
+# Cost of moving a file into a folder that already holds many copies of the same name
+# (ComfyUI_00001_.png, ComfyUI_00001_(1).png, ...): the old exists() probing against the
+# name allocator, per move and in stat calls.
+# Usage: python -m scripts.benchmarks.name_allocation [moves per folder size]
+
+FOLDER_SIZES = (100, 1000, 10000, 30000)
+NAME = 'ComfyUI_00001_.png'
+
+
+class CountingExists:
+    def __init__(self):
+        self.calls = 0
+        self.exists = os.path.exists
+
+    def __call__(self, path):
+        self.calls += 1
+        return self.exists(path)
+
+
+def increment_filename(filepath):
+    # How organizing used to find a free name: one exists() per name already taken
+    base, ext = os.path.splitext(filepath)
+    counter = 1
+    new_filepath = base + "(" + str(counter) + ")" + ext
+    while os.path.exists(new_filepath):
+        counter += 1
+        new_filepath = base + "(" + str(counter) + ")" + ext
+    return new_filepath
+
+
+def fill_folder(directory, size):
+    os.makedirs(directory)
+    base, ext = os.path.splitext(NAME)
+    open(os.path.join(directory, NAME), 'w').close()
+    for i in range(1, size):
+        open(os.path.join(directory, base + "(" + str(i) + ")" + ext), 'w').close()
+
+
+def make_sources(directory, count):
+    paths = []
+    for i in range(count):
+        source_dir = os.path.join(directory, str(i))
+        os.makedirs(source_dir)
+        path = os.path.join(source_dir, NAME)
+        open(path, 'w').close()
+        paths.append(path)
+    return paths
+
+
+def probing(sources, target_dir):
+    # The old move_file_to_category
+    counter = CountingExists()
+    os.path.exists = counter
+    try:
+        start = time.perf_counter()
+        for source in sources:
+            dest = os.path.join(target_dir, os.path.basename(source))
+            if os.path.exists(dest):
+                dest = increment_filename(dest)
+            shutil.move(source, dest)
+        return time.perf_counter() - start, counter.calls
+    finally:
+        os.path.exists = counter.exists
+
+
+def allocated(sources, target_dir, journal_path):
+    counter = CountingExists()
+    os.path.exists = counter
+    try:
+        start = time.perf_counter()
+        plan = MovePlan()
+        plan.add(sources[0], target_dir)
+        listed = time.perf_counter()
+        for source in sources[1:]:
+            plan.add(source, target_dir)
+        apply_plan(plan, journal_path)
+        end = time.perf_counter()
+        return listed - start, end - listed, counter.calls
+    finally:
+        os.path.exists = counter.exists
+
+
+def main():
+    moves = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print(f"{moves} moves into a folder already holding N copies of {NAME}")
+    print(f"{'N':>7} {'probing us/move':>16} {'exists/move':>12} {'allocator us/move':>18} {'exists/move':>12} {'listing ms':>11}")
+    for size in FOLDER_SIZES:
+        with tempfile.TemporaryDirectory() as tmp:
+            old_dir, new_dir = os.path.join(tmp, 'old'), os.path.join(tmp, 'new')
+            fill_folder(old_dir, size)
+            fill_folder(new_dir, size)
+            old_sources = make_sources(os.path.join(tmp, 'old_src'), moves)
+            new_sources = make_sources(os.path.join(tmp, 'new_src'), moves)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                old_time, old_calls = probing(old_sources, old_dir)
+                listing, new_time, new_calls = allocated(new_sources, new_dir, os.path.join(tmp, 'journal.jsonl'))
+            print(f"{size:>7} {old_time / moves * 1e6:>16.1f} {old_calls / moves:>12.1f} "
+                  f"{new_time / (moves - 1) * 1e6:>18.1f} {new_calls / moves:>12.2f} {listing * 1000:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
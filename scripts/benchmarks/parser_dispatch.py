@@ -0,0 +1,77 @@
+import sys
+import time
+from scripts import metadata_extractor, metrics
+from scripts.tests.corpus import a1111_pnginfo, comfyui_pnginfo
+from scripts.metadata_extractor import get_parser_manager, parse_png_text
+from scripts.png_chunks import PngText
+
+# Parser attempts and time per image, trying every sd_parsers parser in turn (before) vs. sniffing
+# the text chunk keys and guessing from the folder. Folders hold one kind of image each; "both"
+# holds ComfyUI saves that also carry A1111 parameters but an API-only workflow, which the
+# ComfyUI parser rejects.
+# Usage: python -m scripts.benchmarks.parser_dispatch [images per folder]
+
+
+def png_text(info, extra=None):
+    text = {}
+    for _, data, _ in info.chunks if info else ():
+        key, _, value = data.partition(b'\0')
+        text[key.decode('latin-1')] = value.decode('latin-1')
+    text.update(extra or {})
+    return PngText(512, 512, text)
+
+
+def make_folders(count):
+    text = "a photo of Alice Smith, highly detailed"
+    both = {**png_text(a1111_pnginfo(text, 1)).text, **png_text(comfyui_pnginfo(text, 1, extra_nodes=0)).text, 'workflow': '{}'}
+    return {
+        'comfyui': [png_text(comfyui_pnginfo(text, i, extra_nodes=0)) for i in range(count)],
+        'a1111': [png_text(a1111_pnginfo(text, i)) for i in range(count)],
+        'both': [PngText(512, 512, dict(both)) for _ in range(count)],
+        'none': [png_text(None, {'Software': 'GIMP'}) for _ in range(count)]
+    }
+
+
+def try_every_parser(png):
+    # parse_png_text before: every parser in ParserManager order
+    from sd_parsers.exceptions import ParserError
+
+    attempts = 0
+    for parser in get_parser_manager().managed_parsers:
+        attempts += 1
+        try:
+            prompt_info = parser.read_parameters(png, True)
+            if prompt_info is None:
+                continue
+            prompt_info.parse()
+        except ParserError:
+            continue
+        return prompt_info, attempts
+    return None, attempts
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    folders = make_folders(count)
+    print(f"{'folder':<9} {'attempts before':>16} {'attempts now':>13} {'us before':>10} {'us now':>8} {'hit rate':>9}")
+    for folder, images in folders.items():
+        start = time.perf_counter()
+        attempts_before = sum(try_every_parser(png)[1] for png in images)
+        before = time.perf_counter() - start
+
+        metadata_extractor._dispatch = None
+        registry = metrics.current()
+        registry.reset()
+        start = time.perf_counter()
+        for png in images:
+            parse_png_text(png, folder=folder)
+        now = time.perf_counter() - start
+        counters = registry.counters
+        parsed = counters.get('parser_hits', 0) + counters.get('parser_misses', 0)
+        hit_rate = f"{counters.get('parser_hits', 0) / parsed:.1%}" if parsed else "-"
+        print(f"{folder:<9} {attempts_before / count:>16.2f} {counters.get('parse_attempts', 0) / count:>13.2f} "
+              f"{before / count * 1e6:>10.1f} {now / count * 1e6:>8.1f} {hit_rate:>9}")
+
+
+if __name__ == "__main__":
+    main()
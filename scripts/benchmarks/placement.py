@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+from scripts.placement import PLACERS, strategy_for
+
+# Cost of each placement mode: time per image and the disk space the placed images take up.
+# Pass a directory on another volume (a network share, /dev/shm) to also measure placing across
+# volumes, where only copy, symlink and auto (which falls back to copy) can work.
+# Usage: python -m scripts.benchmarks.placement [images] [directory on another volume]
+
+IMAGE_BYTES = 2 * 1024 * 1024
+MODES = ('move', 'copy', 'hardlink', 'reflink', 'symlink', 'auto')
+
+
+def free_bytes(path):
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+def make_images(directory, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"ComfyUI_{i:05d}_.png")
+        with open(path, 'wb') as f:
+            f.write(os.urandom(IMAGE_BYTES))
+        paths.append(path)
+    return paths
+
+
+def place_all(mode, paths, target):
+    os.makedirs(target)
+    free = free_bytes(target)
+    start = time.perf_counter()
+    try:
+        for path in paths:
+            PLACERS[mode](path, os.path.join(target, os.path.basename(path)))
+    except OSError as e:
+        return None, None, e.strerror
+    elapsed = time.perf_counter() - start
+    os.sync()
+    return elapsed / len(paths), max(0, free - free_bytes(target)), None
+
+
+def run(label, source_root, target_root, count):
+    print(f"{label}: auto picks {strategy_for(source_root, target_root) or 'nothing'}")
+    print(f"{'mode':<10} {'ms/image':>9} {'MB used':>9}")
+    for mode in MODES:
+        source = os.path.join(source_root, 'source-' + mode)
+        target = os.path.join(target_root, 'target-' + mode)
+        os.makedirs(source)
+        paths = make_images(source, count)
+        try:
+            per_image, used, error = place_all(mode, paths, target)
+        finally:
+            shutil.rmtree(source)
+            shutil.rmtree(target, ignore_errors=True)
+        if error:
+            print(f"{mode:<10} {'unsupported: ' + error:>20}")
+        else:
+            print(f"{mode:<10} {per_image * 1000:>9.2f} {used / 1024 / 1024:>9.1f}")
+    print()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(f"{count} images of {IMAGE_BYTES // 1024 // 1024} MB ({count * IMAGE_BYTES // 1024 // 1024} MB)\n")
+    with tempfile.TemporaryDirectory() as tmp:
+        run("Same volume", tmp, tmp, count)
+        if len(sys.argv) > 2:
+            with tempfile.TemporaryDirectory(dir=sys.argv[2]) as other:
+                run("Across volumes", tmp, other, count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import io
+import os
+import sys
+import time
+import tempfile
+from PIL import Image
+from scripts import metadata_extractor
+from scripts.png_chunks import READ_BUFFER_SIZE, TRAILING_BUFFER_SIZE, read_png_text_from_file
+from scripts.metadata_extractor import parse_png_text
+from scripts.tests.corpus import comfyui_pnginfo
+
+# PIL + sd_parsers vs. the text chunk reader: time, read calls and bytes read per image,
+# for images with and without metadata.
+# Usage: python -m scripts.benchmarks.png_chunks [image count] [image size]
+
+
+class CountingFile(io.FileIO):
+    reads = 0
+    bytes_read = 0
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        CountingFile.reads += 1
+        CountingFile.bytes_read += count or 0
+        return count
+
+
+def pil_path(path):
+    with Image.open(io.BufferedReader(CountingFile(path))) as img:
+        return metadata_extractor.parser_manager.parse(img)
+
+
+def chunk_path(path):
+    # Mirrors metadata_extractor.read_prompt_info
+    with io.BufferedReader(CountingFile(path), READ_BUFFER_SIZE) as f:
+        png = read_png_text_from_file(f)
+    if not png.text:
+        with io.BufferedReader(CountingFile(path), TRAILING_BUFFER_SIZE) as f:
+            png = read_png_text_from_file(f, include_trailing=True)
+    return parse_png_text(png) if png.text else None
+
+
+def write_images(directory, count, size, with_metadata):
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"{'meta' if with_metadata else 'plain'}_{i:05d}.png")
+        # Noise compresses badly, like real renders, so the image data dominates the file
+        img = Image.frombytes("RGB", (size, size), os.urandom(size * size * 3))
+        pnginfo = comfyui_pnginfo("a photo of Alice Smith", i) if with_metadata else None
+        img.save(path, pnginfo=pnginfo, compress_level=1)
+        paths.append(path)
+    return paths
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, with_metadata in (("ComfyUI metadata", True), ("no metadata", False)):
+            paths = write_images(tmp, count, size, with_metadata)
+            print(f"{label} ({os.path.getsize(paths[0])} bytes per file)")
+            for name, fn in (("PIL + sd_parsers", pil_path), ("text chunk reader", chunk_path)):
+                CountingFile.reads = CountingFile.bytes_read = 0
+                start = time.perf_counter()
+                for path in paths:
+                    assert (fn(path) is not None) == with_metadata
+                elapsed = time.perf_counter() - start
+                print(f"  {name:<18} ms/image: {elapsed * 1000 / count:8.3f}   reads/image: {CountingFile.reads / count:6.1f}"
+                      f"   KB read/image: {CountingFile.bytes_read / 1024 / count:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import contextlib
+from scripts import metrics
+from scripts.tests.corpus import write_corpus
+from scripts.tests.helpers import write_rules
+from scripts.benchmarks.slow_fs import SlowFilesystem
+from scripts.metadata_extractor import DEFAULT_NODE_DEFAULTS
+from scripts.organizer import organize_images
+
+# Organizing a folder on a simulated network share: every stat, open, read and move on it costs a
+# round trip of 0 to 10 ms (see slow_fs). Compares io_depth 1, where each worker reads its files
+# one after another, with reading ahead, for a first run (index misses) and images/sec, and how
+# much of each file's time the workers spent waiting rather than on the CPU.
+# Usage: python -m scripts.benchmarks.read_ahead [images] [workers]
+
+LATENCIES_MS = (0, 2, 10)
+IO_DEPTHS = (1, 8, 32)
+
+
+def run(corpus_dir, work_dir, workers, latency_ms, io_depth):
+    share = os.path.join(work_dir, 'share')
+    input_dir = os.path.join(share, 'in')
+    shutil.rmtree(work_dir, ignore_errors=True)
+    shutil.copytree(corpus_dir, input_dir)
+    # The index and the journal stay local, as they would next to the config
+    with SlowFilesystem(share, latency_ms / 1000), contextlib.redirect_stdout(open(os.devnull, 'w')):
+        start = time.perf_counter()
+        plan = organize_images(input_dir, os.path.join(share, 'out'), DEFAULT_NODE_DEFAULTS, workers=workers,
+                               index_path=os.path.join(work_dir, 'index.sqlite'), journal_path=os.path.join(work_dir, 'journal.jsonl'),
+                               rules_file=write_rules(work_dir), io_depth=io_depth)
+        elapsed = time.perf_counter() - start
+    stages = metrics.current().to_dict()['stages']
+    file_s = stages['file']['total_s']
+    waited = min(stages['io_wait']['total_s'], file_s)
+    return len(plan.moves), elapsed, waited / file_s if file_s else 0.0
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    # Per-file log lines, such as "No metadata" for the plain images
+    logging.disable(logging.ERROR)
+    tmp = tempfile.mkdtemp(prefix='sd_organizer_read_ahead_')
+    try:
+        corpus_dir = os.path.join(tmp, 'corpus')
+        write_corpus(corpus_dir, count, mix={'comfyui': 6, 'a1111': 3, 'none': 1}, per_dir=100)
+        print(f"{count} images, {workers} workers")
+        print(f"{'latency':>8} {'io_depth':>9} {'moved':>6} {'images/s':>9} {'speedup':>8} {'waiting':>8}")
+        for latency_ms in LATENCIES_MS:
+            baseline = None
+            for io_depth in IO_DEPTHS:
+                moved, elapsed, waiting = run(corpus_dir, os.path.join(tmp, 'work'), workers, latency_ms, io_depth)
+                baseline = baseline or elapsed
+                print(f"{latency_ms:>6} ms {io_depth:>9} {moved:>6} {count / elapsed:>9.1f} {baseline / elapsed:>7.1f}x {waiting:>8.0%}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
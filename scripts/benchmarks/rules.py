@@ -0,0 +1,79 @@
+import sys
+import time
+import random
+from scripts.keyword_matcher import CategoryMatcher
+from scripts.metadata_extractor import ImageRecord
+from scripts.rules import RuleSet
+from scripts.benchmarks.keyword_matching import make_texts, random_name
+
+# Rule evaluation cost as the rules file grows: checking the rules one by one, each scanning the
+# texts with its own keyword matcher, vs. the compiled RuleSet that scans them once for all rules.
+# Usage: python -m scripts.benchmarks.rules [images per run]
+
+RULE_COUNTS = [2, 10, 50, 200]
+KEYWORDS_PER_RULE = 50
+MODELS = ('sdxl_base', 'juggernaut_xl', 'dreamshaper_8', 'realistic_vision')
+
+
+def make_specs(rng, count):
+    specs = []
+    for i in range(count):
+        spec = {'name': f"rule{i}", 'keywords': [random_name(rng) for _ in range(KEYWORDS_PER_RULE)], 'to': f"rule{i}/{{keyword}}"}
+        if i % 3 == 1:
+            spec['model'] = rng.choice(MODELS) + '*'
+        if i % 3 == 2:
+            spec['width'] = {'min': 1024}
+        specs.append(spec)
+    # A catch-all at the end, like a "misc" folder
+    specs.append({'name': 'misc', 'model': '*', 'to': 'misc/{model}'})
+    return specs
+
+
+def one_by_one(rules, matchers, record):
+    # The straightforward engine: every rule scans the texts for its own keywords
+    for rule, matcher in zip(rules.rules, matchers):
+        keyword = None
+        if matcher:
+            found = matcher.match_nodes(record.node_texts) or matcher.match_prompts(record.prompts)
+            if not found:
+                continue
+            keyword = found[1]
+        if all(check(record, None) for check in rule.checks):
+            return rule.name + '/' + keyword if keyword else rule.name
+    return None
+
+
+def main():
+    image_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    rng = random.Random(0)
+    print(f"{'rules':>6} {'keywords':>9} {'compile ms':>11} {'one by one us/img':>18} {'compiled us/img':>16} {'speedup':>8}")
+    for count in RULE_COUNTS:
+        specs = make_specs(rng, count)
+        keywords = [keyword for spec in specs for keyword in spec.get('keywords', [])]
+        # Text-only matches for the ShowText value, so images fall through to the later rules too
+        records = [ImageRecord(generator='ComfyUI', node_texts=[text], prompts=[text], models=[rng.choice(MODELS) + '.safetensors'],
+                               width=rng.choice((768, 1024)), height=1024)
+                   for text in make_texts(rng, keywords, image_count)]
+
+        start = time.perf_counter()
+        rules = RuleSet(specs)
+        compile_time = time.perf_counter() - start
+        # Same priority order as the RuleSet
+        keywords_by_name = {spec['name']: spec.get('keywords') for spec in specs}
+        matchers = [CategoryMatcher([(rule.name, keywords_by_name[rule.name])]) if keywords_by_name[rule.name] else None
+                    for rule in rules.rules]
+
+        start = time.perf_counter()
+        expected = [one_by_one(rules, matchers, record) for record in records]
+        baseline = (time.perf_counter() - start) / len(records)
+
+        start = time.perf_counter()
+        decided = [rules.decide(record) for record in records]
+        compiled = (time.perf_counter() - start) / len(records)
+
+        assert [decision[0] if decision else None for decision in decided] == expected
+        print(f"{count:>6} {len(keywords):>9} {compile_time * 1000:>11.1f} {baseline * 1e6:>18.1f} {compiled * 1e6:>16.1f} {baseline / compiled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import tempfile
+from scripts.metadata_index import MetadataIndex
+from scripts.scanner import CATEGORY_DIRS, DirectoryScanner, scan_key
+
+# Finding the PNGs in a large tree: the old os.walk loop vs. the scandir scanner, and the
+# scanner with recorded directory mtimes once nothing (or one folder) has changed. Includes an
+# organized output folder inside the input, which os.walk went through every time.
+# Usage: python -m scripts.benchmarks.scanning [folders] [files per folder]
+
+
+def old_walk(base_path, skip_dirs=CATEGORY_DIRS):
+    for root, dirs, files in os.walk(base_path):
+        for category in skip_dirs:
+            if category in dirs:
+                dirs.remove(category)
+        for file in files:
+            if file.lower().endswith('.png'):
+                yield os.path.join(root, file)
+
+
+def make_tree(base_path, folders, per_folder):
+    # Dated ComfyUI output folders, with sidecar files, plus an organized output folder
+    for i in range(folders):
+        directory = os.path.join(base_path, f"2024-{i // 28 + 1:02d}-{i % 28 + 1:02d}")
+        os.makedirs(directory)
+        for j in range(per_folder):
+            open(os.path.join(directory, f"ComfyUI_{j:05d}_.png"), 'wb').close()
+            if j % 10 == 0:
+                open(os.path.join(directory, f"ComfyUI_{j:05d}_.json"), 'wb').close()
+    sorted_dir = os.path.join(base_path, 'sorted', 'misc')
+    os.makedirs(sorted_dir)
+    for j in range(folders * per_folder // 2):
+        open(os.path.join(sorted_dir, f"ComfyUI_{j:05d}_.png"), 'wb').close()
+    # Old enough that the scanner records them
+    old = time.time() - 60
+    for root, dirs, _ in os.walk(base_path):
+        for name in dirs:
+            os.utime(os.path.join(root, name), (old, old))
+    os.utime(base_path, (old, old))
+
+
+def timed(label, scan):
+    start = time.perf_counter()
+    count = sum(1 for _ in scan)
+    print(f"{label:<44} {count:>9} {(time.perf_counter() - start) * 1000:>10.1f}")
+    return count
+
+
+def main():
+    folders = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    per_folder = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    with tempfile.TemporaryDirectory() as tmp:
+        base_path = os.path.join(tmp, 'in')
+        make_tree(base_path, folders, per_folder)
+        output_dir = os.path.join(base_path, 'sorted')
+        print(f"{folders} folders of {per_folder} images, plus {folders * per_folder // 2} organized ones in in/sorted\n")
+        print(f"{'scan':<44} {'files':>9} {'ms':>10}")
+        sum(1 for _ in old_walk(base_path))  # Warm the directory cache
+        timed("os.walk (before)", old_walk(base_path))
+        timed("scandir, same folders", DirectoryScanner(base_path))
+        timed("scandir, output folder excluded", DirectoryScanner(base_path, exclude_dirs=(output_dir,)))
+
+        index = MetadataIndex(os.path.join(tmp, 'index.sqlite'))
+        key = scan_key('benchmark')
+
+        def scanner():
+            return DirectoryScanner(base_path, exclude_dirs=(output_dir,), index=index, key=key)
+
+        first = scanner()
+        timed("first indexed scan (records folders)", first)
+        first.save()
+        index.commit()
+        timed("incremental, nothing changed", scanner())
+        changed = os.path.join(base_path, '2024-01-01')
+        open(os.path.join(changed, 'ComfyUI_new_.png'), 'wb').close()
+        timed("incremental, one folder changed", scanner())
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import sqlite3
+import tempfile
+import subprocess
+from scripts.config import APP_DIR, DEFAULT_CONFIG
+from scripts.benchmarks.harness import count_images
+from scripts.tests.corpus import write_corpus
+from scripts.tests.helpers import files_under, wait_for_shard, write_rules
+
+# Sharded organizing on one machine: several `organize --queue` worker processes sharing one
+# queue file, against a single process on the same corpus; then again with one worker killed
+# partway through and restarted under the same worker id, as a worker on another host would be
+# (its shard waits out the lease). Checks that every image ended up where the single run put it,
+# and that the merged index covers them all.
+# Usage: python -m scripts.benchmarks.sharded [images] [workers] [lease seconds]
+
+PER_DIR = 100
+
+
+def write_config(work_dir):
+    input_dir = os.path.join(work_dir, 'in')
+    config = dict(DEFAULT_CONFIG, base_dir=input_dir, output_dir=os.path.join(work_dir, 'out'), workers=1)
+    config_file = os.path.join(work_dir, 'config.json')
+    with open(config_file, 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+    return config_file
+
+
+def start(config_file, rules_file, *args):
+    return subprocess.Popen([sys.executable, '-m', 'scripts', '--config', config_file, 'organize', '--rules', rules_file, *args],
+                            cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def index_rows(work_dir):
+    conn = sqlite3.connect(os.path.join(work_dir, 'metadata_index.sqlite'))
+    try:
+        return conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def output_files(work_dir):
+    return files_under(os.path.join(work_dir, 'out'))
+
+
+def run(corpus_dir, work_dir, workers, lease, kill=False):
+    shutil.rmtree(work_dir, ignore_errors=True)
+    shutil.copytree(corpus_dir, os.path.join(work_dir, 'in'))
+    config_file = write_config(work_dir)
+    rules_file = write_rules(work_dir)
+    start_time = time.perf_counter()
+    if workers == 1:
+        start(config_file, rules_file).wait()
+    else:
+        queue = ['--queue', os.path.join(work_dir, 'queue.sqlite'), '--lease', str(lease)]
+        processes = [start(config_file, rules_file, *queue, '--worker-id', f"w{n}") for n in range(workers)]
+        if kill:
+            wait_for_shard(queue[1], 'w0')
+            # The way a host goes down: no chance to give the shard back
+            processes[0].send_signal(signal.SIGKILL)
+            processes[0].wait()
+            processes[0] = start(config_file, rules_file, *queue, '--worker-id', 'w0')
+        for process in processes:
+            process.wait()
+    return time.perf_counter() - start_time
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    lease = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+    tmp = tempfile.mkdtemp(prefix='sd_organizer_sharded_')
+    try:
+        corpus_dir = os.path.join(tmp, 'corpus')
+        write_corpus(corpus_dir, count, mix={'comfyui': 6, 'a1111': 3, 'none': 1}, per_dir=PER_DIR)
+        single_dir = os.path.join(tmp, 'single')
+        runs = [('single', single_dir, run(corpus_dir, single_dir, 1, lease))]
+        for name, kill in (('sharded', False), ('killed', True)):
+            work_dir = os.path.join(tmp, name)
+            runs.append((name, work_dir, run(corpus_dir, work_dir, workers, lease, kill)))
+        # Images without metadata and matches stay where they are
+        print(f"{count} images in {count // PER_DIR} folders, {workers} workers, {lease:g} s lease")
+        print(f"{'run':>8} {'seconds':>8} {'images/s':>9} {'left':>5} {'moved':>6} {'indexed':>8} {'same output':>12}")
+        for name, work_dir, elapsed in runs:
+            same = output_files(work_dir) == output_files(single_dir)
+            print(f"{name:>8} {elapsed:>8.2f} {count / elapsed:>9.1f} {count_images(os.path.join(work_dir, 'in')):>5} "
+                  f"{len(output_files(work_dir)):>6} {index_rows(work_dir):>8} {'yes' if same else 'NO':>12}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
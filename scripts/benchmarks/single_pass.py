@@ -0,0 +1,90 @@
+import sys
+import time
+import tempfile
+from PIL import Image
+from sd_parsers import PromptInfo
+from scripts import metadata_extractor
+from scripts.metadata_extractor import (DEFAULT_NODE_DEFAULTS, convert_keys_to_strings, extract_record,
+                                        find_particular_keywords, find_value_in_dict, find_values_in_dict,
+                                        format_metadata, get_model_names, get_workflow_node_data)
+from scripts.organizer import categorize_record
+from scripts.rules import RuleSet, default_rules
+from scripts.tests.corpus import write_corpus
+
+# Compares the old extraction flow (GUI preview + organizer fallback) with the single-pass record.
+# Usage: python -m scripts.benchmarks.single_pass [image count]
+
+CHARACTERS = ["Alice Smith", "Bob Jones", "Martin Van Buren"]
+LOCATIONS = ["Forest", "Castle"]
+RULES = RuleSet(default_rules([('characters', CHARACTERS), ('locations', LOCATIONS)]))
+
+parse_calls = 0
+_parse = PromptInfo.parse
+
+
+def counting_parse(self):
+    global parse_calls
+    parse_calls += 1
+    return _parse(self)
+
+
+def legacy_gui(path):
+    # MetadataParser.extract_metadata before: parse(img), then extract_metadata_type2 parsed again
+    img = Image.open(path)
+    prompt_info = metadata_extractor.parser_manager.parse(img)
+    format_metadata(prompt_info)
+    for key in ('cfg', 'steps', 'sampler_name', 'scheduler', 'denoise', 'clip', 'seed'):
+        find_value_in_dict(prompt_info.parameters, key)
+    find_values_in_dict(prompt_info.parameters, 'vae_name')
+    get_model_names(prompt_info.parameters)
+    prompt_info = metadata_extractor.parser_manager.parse(path)
+    metadata_str_keys = convert_keys_to_strings({"prompt": prompt_info.parameters, "workflow": prompt_info.metadata})
+    get_workflow_node_data(metadata_str_keys)
+
+
+def legacy_organizer(path):
+    # organize_images before: extract_metadata and the ShowText search per category,
+    # then the positive prompt fallback parsed the file again
+    prompt_info = metadata_extractor.parser_manager.parse(path)
+    metadata_str_keys = convert_keys_to_strings({"prompt": prompt_info.parameters, "workflow": prompt_info.metadata})
+    find_particular_keywords(metadata_str_keys, CHARACTERS)
+    find_particular_keywords(metadata_str_keys, LOCATIONS)
+    prompt_info = metadata_extractor.parser_manager.parse(path)
+    [prompt.value for prompt in prompt_info.prompts]
+
+
+def single_pass_gui(path):
+    extract_record(path, DEFAULT_NODE_DEFAULTS, formatted=True)
+
+
+def single_pass_organizer(path):
+    record = extract_record(path, DEFAULT_NODE_DEFAULTS)
+    categorize_record(record, RULES, path)
+
+
+def run(name, fn, paths):
+    global parse_calls
+    parse_calls = 0
+    start = time.perf_counter()
+    for path in paths:
+        fn(path)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} parse calls/image: {parse_calls / len(paths):.1f}   ms/image: {elapsed * 1000 / len(paths):.3f}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    PromptInfo.parse = counting_parse
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_corpus(tmp, count)
+        for path in paths:
+            # Warm the OS file cache so both flows read from memory
+            extract_record(path)
+        run("legacy gui", legacy_gui, paths)
+        run("single-pass gui", single_pass_gui, paths)
+        run("legacy organizer", legacy_organizer, paths)
+        run("single-pass organizer", single_pass_organizer, paths)
+
+
+if __name__ == "__main__":
+    main()
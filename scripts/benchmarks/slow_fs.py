@@ -0,0 +1,114 @@
+import io
+import os
+import time
+import builtins
+import threading
+from typing import Any, Callable, Dict
+
+# A network share stand-in for benchmarks and tests: every file system call on a path under
+# `root` waits `latency` seconds first, the way each stat, open, read, link or rename is a round
+# trip to an SMB or NFS server. Sleeping releases the GIL like a blocked syscall does, so
+# threads overlap their waits as they would on a share. Worker processes forked while it is
+# installed inherit it (the default on Linux).
+#     with SlowFilesystem(input_dir, latency=0.002) as share:
+#         organize_images(...)
+#     print(share.calls)
+
+# os functions delayed when their first argument is under the root
+DELAYED_CALLS = ('stat', 'lstat', 'scandir', 'listdir', 'mkdir', 'open', 'link', 'symlink', 'unlink', 'remove',
+                 'rename', 'replace', 'utime')
+
+_lock = threading.Lock()
+
+
+def _under(path: Any, root: str) -> bool:
+    if isinstance(path, int):
+        return False
+    try:
+        path = os.path.abspath(os.fsdecode(path))
+    except TypeError:
+        return False
+    return path == root or path.startswith(root + os.sep)
+
+
+class SlowRaw(io.RawIOBase):
+    # An unbuffered file whose reads each wait, like a read request sent over the network;
+    # seeking moves a local offset and costs nothing
+    def __init__(self, raw: io.FileIO, delay: Callable[[], None]):
+        super().__init__()
+        self.raw = raw
+        self.delay = delay
+
+    @property
+    def name(self):
+        return self.raw.name
+
+    def readinto(self, buffer) -> int:
+        self.delay()
+        return self.raw.readinto(buffer)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self.raw.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.raw.tell()
+
+    def fileno(self) -> int:
+        return self.raw.fileno()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+class SlowFilesystem:
+    def __init__(self, root: str, latency: float):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        # Delayed calls so far, i.e. round trips to the share
+        self.calls = 0
+        self.originals: Dict[str, Callable] = {}
+
+    def delay(self):
+        with _lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+    def _wrap(self, function: Callable) -> Callable:
+        def delayed(path, *args, **kwargs):
+            if _under(path, self.root):
+                self.delay()
+            return function(path, *args, **kwargs)
+        return delayed
+
+    def _open(self, file, mode='r', buffering=-1, *args, **kwargs):
+        original = self.originals['open']
+        if not _under(file, self.root):
+            return original(file, mode, buffering, *args, **kwargs)
+        self.delay()
+        if mode.replace('b', '') != 'r' or 'b' not in mode:
+            return original(file, mode, buffering, *args, **kwargs)
+        raw = SlowRaw(original(file, 'rb', buffering=0), self.delay)
+        if buffering == 0:
+            return raw
+        return io.BufferedReader(raw, buffering if buffering > 0 else io.DEFAULT_BUFFER_SIZE)
+
+    def __enter__(self) -> 'SlowFilesystem':
+        self.originals['open'] = builtins.open
+        builtins.open = self._open
+        for name in DELAYED_CALLS:
+            self.originals['os.' + name] = getattr(os, name)
+            setattr(os, name, self._wrap(getattr(os, name)))
+        return self
+
+    def __exit__(self, *exc):
+        builtins.open = self.originals.pop('open')
+        for name in DELAYED_CALLS:
+            setattr(os, name, self.originals.pop('os.' + name))
+        return False
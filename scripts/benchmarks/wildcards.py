@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from scripts import wildcards
+from scripts.benchmarks.keyword_matching import random_name
+from scripts.keyword_matcher import CategoryMatcher
+
+# Getting a compiled matcher for wildcard files of 1k to 50k entries: compiling it (before, in
+# every worker process of every run), loading it from data/matcher_cache, and the in-process
+# copy. Then watch mode: how long after a wildcard file is saved the new keywords are in use,
+# and the longest pause the watch loop sees meanwhile.
+# Usage: python -m scripts.benchmarks.wildcards [repeats]
+
+KEYWORD_COUNTS = [1000, 10000, 50000]
+
+
+def make_categories(rng, count):
+    # Half the entries with an alias, one in twenty an exclusion
+    characters = []
+    for i in range(count):
+        name = random_name(rng)
+        characters.append(f"{name} | {name.split()[0]} {i}" if i % 2 else name)
+        if i % 20 == 0:
+            characters.append("!" + random_name(rng))
+    return [('characters', characters), ('locations', [random_name(rng) for _ in range(count // 10)])]
+
+
+def median_ms(action, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        action()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def load_from_disk(categories, cache_dir):
+    wildcards._compiled.clear()
+    wildcards.compile_matcher(categories, cache_dir=cache_dir)
+
+
+def reload_latency(rng, wildcards_dir, count, cache_dir):
+    # Mirrors the watch loop: poll between batches, swap in what the reloader compiled
+    from scripts.watcher import RulesReloader
+
+    def write(categories):
+        for name, lines in categories:
+            with open(os.path.join(wildcards_dir, name + '.txt'), 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines))
+
+    write(make_categories(rng, count))
+    reloader = RulesReloader(None, wildcards_dir, 'move', False, interval=0.05, matcher_cache=cache_dir)
+    categories = make_categories(rng, count)
+    write(categories)
+    saved = time.perf_counter()
+    longest_pause = 0.0
+    while True:
+        start = time.perf_counter()
+        reloaded = reloader.poll()
+        longest_pause = max(longest_pause, time.perf_counter() - start)
+        if reloaded:
+            break
+        time.sleep(0.01)
+    latency = time.perf_counter() - saved
+    if [rule['keywords'] for rule in reloaded[0]] != [lines for _, lines in categories]:
+        raise SystemExit("Reloaded the wrong rules")
+    return latency * 1000, longest_pause * 1000
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    rng = random.Random(1)
+    cache_dir = tempfile.mkdtemp(prefix='sd_organizer_matchers_')
+    try:
+        print(f"{'entries':>8} {'compile ms':>11} {'cached ms':>10} {'in-process ms':>14}")
+        for count in KEYWORD_COUNTS:
+            categories = make_categories(rng, count)
+            compile_ms = median_ms(lambda: CategoryMatcher(categories), repeats)
+            wildcards._compiled.clear()
+            wildcards.compile_matcher(categories, cache_dir=cache_dir)
+            cached_ms = median_ms(lambda: load_from_disk(categories, cache_dir), repeats)
+            memory_ms = median_ms(lambda: wildcards.compile_matcher(categories, cache_dir=cache_dir), repeats)
+            print(f"{count:>8} {compile_ms:>11.1f} {cached_ms:>10.1f} {memory_ms:>14.3f}")
+
+        print()
+        print(f"{'entries':>8} {'reload ms':>10} {'longest pause ms':>17}")
+        for count in KEYWORD_COUNTS:
+            wildcards_dir = tempfile.mkdtemp(prefix='sd_organizer_wildcards_')
+            try:
+                latency, pause = reload_latency(rng, wildcards_dir, count, cache_dir)
+            finally:
+                shutil.rmtree(wildcards_dir, ignore_errors=True)
+            print(f"{count:>8} {latency:>10.1f} {pause:>17.2f}")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
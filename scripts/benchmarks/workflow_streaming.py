@@ -0,0 +1,72 @@
+import sys
+import time
+import tracemalloc
+from scripts.tests.corpus import FILLER_NODE_BYTES, comfyui_pnginfo
+from scripts.metadata_extractor import (DEFAULT_NODE_DEFAULTS, build_record, convert_keys_to_strings,
+                                        find_particular_keywords, parse_png_text)
+from scripts.png_chunks import PngText
+from scripts.workflow_query import compile_query
+
+# Reading a ComfyUI image's metadata for a record as its embedded workflow grows from 10 KB to
+# 5 MB: the old flow (sd_parsers, convert_keys_to_strings, find_particular_keywords), the full
+# parse used for the GUI dump, and the streamed workflow used when organizing.
+# Usage: python -m scripts.benchmarks.workflow_streaming [repeats]
+
+SIZES_KB = (10, 100, 1000, 5000)
+
+CHARACTERS = ["Alice Smith", "Bob Jones", "Martin Van Buren"]
+
+
+def png_text(workflow_kb):
+    info = comfyui_pnginfo("a photo of Alice Smith, highly detailed", 1, extra_nodes=workflow_kb * 1024 // FILLER_NODE_BYTES)
+    text = {}
+    for _, data, _ in info.chunks:
+        key, _, value = data.partition(b'\0')
+        text[key.decode('latin-1')] = value.decode('latin-1')
+    return PngText(1024, 1024, text)
+
+
+def old_flow(png):
+    prompt_info = parse_png_text(png)
+    metadata_str_keys = convert_keys_to_strings({"prompt": prompt_info.parameters, "workflow": prompt_info.metadata})
+    return find_particular_keywords(metadata_str_keys, CHARACTERS)
+
+
+def full_parse(png):
+    return build_record(parse_png_text(png), png.width, png.height, DEFAULT_NODE_DEFAULTS)
+
+
+def streamed(png):
+    node_filters = compile_query(DEFAULT_NODE_DEFAULTS).node_filters
+    return build_record(parse_png_text(png, node_filters), png.width, png.height, DEFAULT_NODE_DEFAULTS)
+
+
+def measure(flow, png, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        flow(png)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    flow(png)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return sorted(times)[len(times) // 2], peak
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    flows = [("old flow", old_flow), ("full parse", full_parse), ("streamed", streamed)]
+    print(f"{'workflow':>9} {'flow':<12} {'ms/image':>10} {'peak MB':>9}")
+    for workflow_kb in SIZES_KB:
+        png = png_text(workflow_kb)
+        if full_parse(png) != streamed(png):
+            raise SystemExit("Streamed record differs from the full parse")
+        size = f"{len(png.text['workflow']) / 1024:.0f} KB"
+        for label, flow in flows:
+            seconds, peak = measure(flow, png, repeats)
+            print(f"{size:>9} {label:<12} {seconds * 1000:>10.2f} {peak / 1024 / 1024:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+from scripts.config import CONFIG_FILE, DEFAULT_CONFIG, data_file_for, index_path_for, load_config
+
+# scripts.placement.MODES, without importing it (and logging) just to build the parser
+PLACEMENTS = ('move', 'copy', 'hardlink', 'reflink', 'symlink', 'auto')
+
+# Headless command line interface: python -m scripts <command>
+# Tk is never imported, and PIL/sd_parsers only once a command actually parses an image.
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m scripts', description="Organize Stable Diffusion images without the GUI.")
+    parser.add_argument('--config', default=CONFIG_FILE, help="Config file (default: %(default)s, relative to the working directory or the install)")
+    parser.add_argument('--timings', action='store_true', help="Report startup and command time on stderr")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="Profile the command into FILE with cProfile, or pyinstrument for a .html FILE; "
+                             "only the main process is profiled, so use --workers 1 to include parsing")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    organize = commands.add_parser('organize', help="Move images into category folders")
+    organize.add_argument('--input', help="Input images directory (default: base_dir from the config)")
+    organize.add_argument('--output', help="Output images directory (default: output_dir from the config)")
+    organize.add_argument('--workers', type=int, help="Worker processes (default: config value, or one per CPU)")
+    organize.add_argument('--whole-words', action='store_true', default=None, help="Only match complete words")
+    organize.add_argument('--no-index', action='store_true', help="Don't read or update the metadata index")
+    organize.add_argument('--dry-run', action='store_true', help="Print where each image would go without moving anything")
+    organize.add_argument('--resume', action='store_true', help="Only finish the moves of an interrupted run")
+    organize.add_argument('--rollback', action='store_true', help="Move the files of an interrupted run back where they were")
+    organize.add_argument('--placement', choices=PLACEMENTS,
+                          help="How images are put into their folders (default: config value, 'move'); anything but move leaves the originals")
+    organize.add_argument('--rules', help="Rules file (default: rules.json next to the config; without one, the wildcard categories)")
+    organize.add_argument('--ignore', action='append', default=[], metavar='GLOB',
+                          help="Skip files and folders matching GLOB (repeatable; added to scan_ignore from the config)")
+    organize.add_argument('--rescan', action='store_true', help="List every folder, even those unchanged since the last run")
+    organize.add_argument('--io-depth', type=int, help="Files each worker reads ahead and moves made at once (default: config value, 1); "
+                                                       "raise it for network shares")
+    organize.add_argument('--queue', metavar='FILE',
+                          help="Organize as one of several workers sharing FILE, a work queue on storage they all reach (see README)")
+    organize.add_argument('--worker-id', help="With --queue, this worker's name; keep it when restarting a worker (default: host-pid)")
+    organize.add_argument('--lease', type=float, metavar='SECONDS',
+                          help="With --queue, how long a shard stays with a worker that stopped renewing it (default: 60)")
+    organize.add_argument('--stats', action='store_true', help="Print a run summary on stderr: time per stage, counts and errors")
+    organize.add_argument('--stats-json', metavar='FILE', help="Write the run summary with latency histograms to FILE as JSON")
+
+    inspect = commands.add_parser('inspect', help="Print the generation metadata of images")
+    inspect.add_argument('files', nargs='+')
+    inspect.add_argument('--json', action='store_true', help="Print one JSON object per image")
+    inspect.add_argument('--full', action='store_true', help="Include the full formatted metadata dump")
+
+    index = commands.add_parser('index', help="Add a directory tree to the metadata index without moving anything")
+    index.add_argument('directory', nargs='?', help="Directory to index (default: base_dir from the config)")
+    index.add_argument('--workers', type=int, help="Worker processes (default: config value, or one per CPU)")
+    index.add_argument('--prune', action='store_true', help="Also drop entries for files that no longer exist")
+    index.add_argument('--rules', help="Rules file the categories are recorded from (default: rules.json next to the config)")
+    index.add_argument('--ignore', action='append', default=[], metavar='GLOB', help="Skip files and folders matching GLOB (repeatable)")
+    index.add_argument('--rescan', action='store_true', help="List every folder, even those unchanged since they were last indexed")
+    index.add_argument('--io-depth', type=int, help="Files each worker reads ahead (default: config value, 1)")
+
+    export = commands.add_parser('export', help="Write the metadata of every image in a directory tree to JSONL, CSV or Parquet")
+    export.add_argument('file', help="Output file; the format follows the extension (.jsonl, .csv, .parquet)")
+    export.add_argument('--input', help="Directory to export, organized folders included (default: base_dir from the config)")
+    export.add_argument('--format', choices=('jsonl', 'csv', 'parquet'), help="Output format, if the extension doesn't say")
+    export.add_argument('--workers', type=int, help="Worker processes (default: config value, or one per CPU)")
+    export.add_argument('--include-empty', action='store_true', help="Also export images without generation metadata")
+    export.add_argument('--no-index', action='store_true', help="Don't read or update the metadata index")
+
+    dedupe = commands.add_parser('dedupe', help="Find duplicate and near-duplicate images")
+    dedupe.add_argument('directory', nargs='?', help="Directory to check, organized folders included (default: base_dir from the config)")
+    dedupe.add_argument('--threshold', type=int, default=4, help="Bits two image hashes may differ in (default: %(default)s, 0 for identical only)")
+    dedupe.add_argument('--move', action='store_true', help="Move all but the oldest image of each group into duplicates/")
+    dedupe.add_argument('--output', dest='output_dir', help="Folder that holds duplicates/ (default: output_dir from the config)")
+    dedupe.add_argument('--dry-run', action='store_true', help="With --move, print the moves instead")
+    dedupe.add_argument('--workers', type=int, help="Worker processes (default: config value, or one per CPU)")
+    dedupe.add_argument('--no-index', action='store_true', help="Don't read or store image hashes in the metadata index")
+
+    watch = commands.add_parser('watch', help="Organize new images as they are written")
+    watch.add_argument('--input', help="Directory to watch (default: base_dir from the config)")
+    watch.add_argument('--output', help="Output images directory (default: output_dir from the config)")
+    watch.add_argument('--poll', action='store_true', help="Poll instead of using filesystem events")
+    watch.add_argument('--no-index', action='store_true', help="Don't read or update the metadata index")
+    watch.add_argument('--placement', choices=PLACEMENTS, help="How images are put into their folders (default: config value, 'move')")
+    watch.add_argument('--rules', help="Rules file (default: rules.json next to the config)")
+    watch.add_argument('--ignore', action='append', default=[], metavar='GLOB', help="Skip files and folders matching GLOB (repeatable)")
+    watch.add_argument('--metrics-port', type=int, help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    return parser
+
+
+def rules_file_for(args):
+    # --rules, or rules.json next to the config file
+    return args.rules or data_file_for(args.config, 'rules.json')
+
+
+def matcher_cache_for(args):
+    # Compiled keyword matchers are cached next to the config file
+    from scripts.wildcards import cache_dir_for
+    return cache_dir_for(args.config)
+
+
+def ignore_for(args, config):
+    return list(config['scan_ignore']) + args.ignore
+
+
+def cmd_organize(args, config, index_path):
+    from scripts import metrics
+    from scripts.metadata_index import MetadataIndex
+    from scripts.move_plan import JOURNAL_FILE, resume_moves, rollback_moves
+    from scripts.organizer import organize_images
+
+    if args.queue and (args.dry_run or args.rescan or args.resume or args.rollback):
+        # A worker restarted with its --worker-id finishes its own interrupted moves
+        print("--queue cannot be combined with --dry-run, --rescan, --resume or --rollback", file=sys.stderr)
+        return 1
+    journal_path = data_file_for(args.config, os.path.basename(JOURNAL_FILE))
+    if args.resume or args.rollback:
+        if not os.path.exists(journal_path):
+            print("No interrupted organize run to " + ("resume" if args.resume else "roll back"))
+            return 0
+        index = None if args.no_index else MetadataIndex(index_path)
+        try:
+            if args.resume:
+                print(f"{resume_moves(journal_path, index.move if index else None)} files moved")
+            else:
+                print(f"{rollback_moves(journal_path, index.move if index else None)} files restored")
+        finally:
+            if index:
+                index.close()
+        return 0
+
+    whole_words = config['whole_words'] if args.whole_words is None else args.whole_words
+    workers = args.workers if args.workers is not None else config['workers']
+    if args.queue:
+        from scripts.sharded import organize_sharded
+        from scripts.work_queue import DEFAULT_LEASE_SECONDS
+        try:
+            failed = organize_sharded(args.input, args.output, config['node_defaults'], queue_path=args.queue,
+                                      worker_id=args.worker_id, lease_seconds=args.lease or DEFAULT_LEASE_SECONDS,
+                                      workers=workers, index_path=None if args.no_index else index_path,
+                                      whole_words=whole_words, rules_file=rules_file_for(args),
+                                      placement=args.placement or config['placement'], ignore=ignore_for(args, config),
+                                      io_depth=args.io_depth or config['io_depth'], matcher_cache=matcher_cache_for(args))
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+        if args.stats:
+            print(metrics.current().summary(), file=sys.stderr)
+        if args.stats_json:
+            metrics.write_json(metrics.current(), args.stats_json)
+        return 1 if failed else 0
+
+    try:
+        organize_images(args.input, args.output, config['node_defaults'], workers=workers,
+                        index_path=None if args.no_index else index_path, whole_words=whole_words,
+                        journal_path=journal_path, dry_run=args.dry_run, rules_file=rules_file_for(args),
+                        placement=args.placement or config['placement'], ignore=ignore_for(args, config), rescan=args.rescan,
+                        io_depth=args.io_depth or config['io_depth'], matcher_cache=matcher_cache_for(args))
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    if args.stats:
+        print(metrics.current().summary(), file=sys.stderr)
+    if args.stats_json:
+        metrics.write_json(metrics.current(), args.stats_json)
+    return 0
+
+
+def cmd_inspect(args, config, index_path):
+    from scripts.metadata_extractor import extract_record
+
+    status = 0
+    for file_path in args.files:
+        try:
+            record = extract_record(file_path, config['node_defaults'], formatted=args.full)
+        except ValueError as e:
+            print(file_path + ": " + str(e), file=sys.stderr)
+            status = 1
+            continue
+
+        if args.json:
+            data = record.to_dict()
+            if args.full:
+                data['formatted_metadata'] = record.formatted_metadata
+            print(json.dumps({'path': file_path, **data}, default=str))
+            continue
+
+        print(file_path)
+        if not record.has_metadata:
+            print("  No metadata found.")
+            continue
+        fields = [
+            ('Generator', record.generator),
+            ('Model', ', '.join(record.models)),
+            ('Positive Prompt', record.positive_prompt),
+            ('Negative Prompt', record.negative_prompt),
+            ('Sampler', record.sampler),
+            ('Seed', record.seed),
+            ('Steps', record.steps),
+            ('Cfg', record.cfg),
+            ('Scheduler', record.scheduler),
+            ('Denoise', record.denoise),
+            ('Vae', ', '.join(record.vaes)),
+            ('Size', f"{record.width}x{record.height}")
+        ]
+        for label, value in fields:
+            print(f"  {label}: {value}")
+        if args.full:
+            print(record.formatted_metadata)
+    return status
+
+
+def cmd_index(args, config, index_path):
+    from scripts.metadata_index import MetadataIndex
+    from scripts.organizer import index_images
+
+    workers = args.workers if args.workers is not None else config['workers']
+    try:
+        seen, written, errors = index_images(args.directory, config['node_defaults'], workers=workers, index_path=index_path,
+                                             whole_words=config['whole_words'], rules_file=rules_file_for(args),
+                                             ignore=ignore_for(args, config), rescan=args.rescan,
+                                             io_depth=args.io_depth or config['io_depth'], matcher_cache=matcher_cache_for(args))
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"{seen} images, {written} index entries written, {seen - written - errors} unchanged, {errors} errors")
+    if args.prune:
+        with MetadataIndex(index_path) as index:
+            print(f"{index.prune()} stale entries removed")
+    return 1 if errors else 0
+
+
+def cmd_export(args, config, index_path):
+    from scripts.exporter import export_records
+
+    workers = args.workers if args.workers is not None else config['workers']
+    try:
+        seen, written, errors = export_records(args.input, args.file, config['node_defaults'], output_format=args.format,
+                                               workers=workers, index_path=None if args.no_index else index_path,
+                                               include_empty=args.include_empty)
+    except (ValueError, RuntimeError) as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"{written} of {seen} images exported to {args.file}, {errors} errors")
+    return 1 if errors else 0
+
+
+def cmd_dedupe(args, config, index_path):
+    from scripts.dedupe import DEDUPE_JOURNAL_FILE, dedupe_images
+
+    output_dir = args.output_dir or config['output_dir']
+    if args.move and not output_dir:
+        print("no --output directory given and 'output_dir' is not set in the config", file=sys.stderr)
+        return 2
+    workers = args.workers if args.workers is not None else config['workers']
+    dedupe_images(args.directory, output_dir, threshold=args.threshold, workers=workers,
+                  index_path=None if args.no_index else index_path,
+                  journal_path=data_file_for(args.config, os.path.basename(DEDUPE_JOURNAL_FILE)),
+                  move=args.move, dry_run=args.dry_run)
+    return 0
+
+
+def cmd_watch(args, config, index_path):
+    from scripts.move_plan import WATCH_JOURNAL_FILE
+    from scripts.watcher import watch_images
+
+    try:
+        watch_images(args.input, args.output, config['node_defaults'], index_path=None if args.no_index else index_path,
+                     whole_words=config['whole_words'], use_polling=args.poll,
+                     journal_path=data_file_for(args.config, os.path.basename(WATCH_JOURNAL_FILE)),
+                     rules_file=rules_file_for(args), placement=args.placement or config['placement'],
+                     metrics_port=args.metrics_port, ignore=ignore_for(args, config), matcher_cache=matcher_cache_for(args))
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    return 0
+
+
+COMMANDS = {
+    'organize': cmd_organize,
+    'inspect': cmd_inspect,
+    'index': cmd_index,
+    'export': cmd_export,
+    'dedupe': cmd_dedupe,
+    'watch': cmd_watch
+}
+
+
+def main(argv=None, start_time=None):
+    start_time = start_time if start_time is not None else time.perf_counter()
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config)
+    except FileNotFoundError:
+        # Headless workers may have no config at all; everything can come from the command line
+        if args.config != CONFIG_FILE:
+            parser.error("config file not found: " + args.config)
+        config = copy.deepcopy(DEFAULT_CONFIG)
+
+    # Fill directory arguments from the config
+    for arg, key in (('input', 'base_dir'), ('output', 'output_dir'), ('directory', 'base_dir')):
+        if hasattr(args, arg) and not getattr(args, arg):
+            if not config[key]:
+                parser.error(f"no {arg} directory given and '{key}' is not set in the config")
+            setattr(args, arg, config[key])
+
+    command_start = time.perf_counter()
+    try:
+        if args.profile:
+            from scripts.metrics import Profiler
+            with Profiler(args.profile):
+                status = COMMANDS[args.command](args, config, index_path_for(args.config))
+        else:
+            status = COMMANDS[args.command](args, config, index_path_for(args.config))
+    except KeyboardInterrupt:
+        status = 130
+    if args.timings:
+        end = time.perf_counter()
+        print(f"startup: {(command_start - start_time) * 1000:.1f} ms, {args.command}: {(end - command_start) * 1000:.1f} ms, "
+              f"total: {(end - start_time) * 1000:.1f} ms", file=sys.stderr)
+    return status
@@ -0,0 +1,55 @@
+import os
+import json
+
+# Checkout root; config and wildcard paths fall back to it when they aren't found
+# relative to the working directory
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG_FILE = 'data/config.json'
+WILDCARDS_DIR = 'wildcards'
+
+DEFAULT_CONFIG = {
+    "base_dir": "",
+    "output_dir": "",
+    "workers": 0,
+    "whole_words": False,
+    "placement": "move",
+    # Files each worker reads ahead, and moves made at once; 8 to 32 for folders on a network share
+    "io_depth": 1,
+    # File and folder name globs never organized or indexed, e.g. ["*_preview.png", "tmp"]
+    "scan_ignore": [],
+    "node_defaults": {
+        "node_type": "ShowText|pysssss",
+        "node_key": "Node name for S&R",
+        "node_name": "ShowText|pysssss"
+    }
+}
+
+def resolve_app_path(path):
+    if os.path.isabs(path) or os.path.exists(path):
+        return path
+    app_path = os.path.join(APP_DIR, path)
+    return app_path if os.path.exists(app_path) else path
+
+def load_config(config_file=CONFIG_FILE):
+    config_file = resolve_app_path(config_file)
+    if os.path.exists(config_file):
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+    else:
+        raise FileNotFoundError("Config file not found. Please ensure 'config.json' exists.")
+    # Fill in settings added after the config file was written
+    for key, value in DEFAULT_CONFIG.items():
+        config.setdefault(key, value)
+    return config
+
+def save_config(config, config_file=CONFIG_FILE):
+    with open(resolve_app_path(config_file), 'w') as f:
+        json.dump(config, f, indent=4)
+
+def data_file_for(config_file, file_name):
+    # The metadata index and the move journals live next to the config file
+    return os.path.join(os.path.dirname(resolve_app_path(config_file)), file_name)
+
+def index_path_for(config_file=CONFIG_FILE):
+    return data_file_for(config_file, 'metadata_index.sqlite')
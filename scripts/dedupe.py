@@ -0,0 +1,294 @@
+import os
+import logging
+from itertools import combinations, groupby
+from math import comb
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from scripts.config import CONFIG_FILE, data_file_for
+from scripts.metadata_index import INDEX_FILE, MetadataIndex
+from scripts.move_plan import MovePlan, apply_plan, resume_moves
+from scripts.organizer import iter_png_files
+from scripts.pipeline import run_pipeline
+
+# Duplicate and near-duplicate detection. Every image gets a 64 bit difference hash (dHash);
+# images whose hashes differ in at most `threshold` bits are grouped. Hashes are kept in the
+# metadata index, so only new or changed files are decoded on the next run.
+
+DUPLICATES_DIR = 'duplicates'
+DEDUPE_JOURNAL_FILE = data_file_for(CONFIG_FILE, 'dedupe_journal.jsonl')
+
+HASH_BITS = 64
+
+# Bits two hashes may differ in and still count as the same picture. 0 only finds images that
+# look identical at 9x8; around 10 starts grouping different seeds of one prompt.
+DEFAULT_THRESHOLD = 4
+
+# (path, size, mtime_ns)
+ImageFile = Tuple[str, int, int]
+
+# Per-process state of the hashing workers: the index stored hashes are read from
+_hash_state: Dict[str, Any] = {}
+
+
+def init_hash_worker(index_path: Optional[str] = None):
+    _hash_state['index'] = MetadataIndex(index_path, readonly=True) if index_path else None
+
+
+def close_hash_worker():
+    if _hash_state.get('index'):
+        _hash_state['index'].close()
+    _hash_state.clear()
+
+
+def dhash(file_path: str) -> int:
+    from PIL import Image
+
+    with Image.open(file_path) as img:
+        # JPEGs decode at 1/8 scale; PNGs have no reduced decode, but the BOX resize straight
+        # to 9x8 is a single pass over the pixels
+        img.draft('RGB', (HASH_BITS, HASH_BITS))
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        small = img.resize((9, 8), Image.BOX).convert('L')
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def to_signed(value: int) -> int:
+    # SQLite integers are signed 64 bit
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value: int) -> int:
+    return value & ((1 << HASH_BITS) - 1)
+
+
+def hash_batch(file_paths: List[str]) -> List[Tuple[str, int, int, Optional[int], bool, Optional[str]]]:
+    # (path, size, mtime_ns, hash, newly computed, error)
+    results = []
+    for file_path in file_paths:
+        try:
+            st = os.stat(file_path)
+            index = _hash_state['index']
+            stored = index.get_dhash(file_path, st.st_size, st.st_mtime_ns) if index else None
+            if stored is not None:
+                results.append((file_path, st.st_size, st.st_mtime_ns, to_unsigned(stored), False, None))
+            else:
+                results.append((file_path, st.st_size, st.st_mtime_ns, dhash(file_path), True, None))
+        except Exception as e:
+            results.append((file_path, 0, 0, None, False, str(e)))
+    return results
+
+
+def _flips(width: int, radius: int) -> List[int]:
+    # Masks that flip between 1 and `radius` of the low `width` bits
+    return [sum(1 << bit for bit in bits) for distance in range(1, radius + 1) for bits in combinations(range(width), distance)]
+
+
+class MultiIndexHash:
+    # Multi-index hashing: the hash is cut into m chunks, and by pigeonhole two hashes within
+    # `radius` bits are within radius // m bits of each other in at least one chunk. So instead
+    # of comparing all pairs, each chunk buckets the hashes by their value there, and only
+    # hashes in the same or a neighbouring bucket are compared. Chunks are processed one at a
+    # time, so only one bucket table is in memory.
+
+    def __init__(self, hashes: Sequence[int], radius: int):
+        self.hashes = hashes
+        self.radius = radius
+        chunk_count = self._pick_chunk_count(len(hashes), radius)
+        step, extra = divmod(HASH_BITS, chunk_count)
+        self.chunks = []
+        shift = 0
+        for i in range(chunk_count):
+            width = step + (1 if i < extra else 0)
+            self.chunks.append((shift, width))
+            shift += width
+        self.sub_radius = radius // chunk_count
+
+    @staticmethod
+    def _pick_chunk_count(count: int, radius: int) -> int:
+        # Fewer chunks mean more neighbouring buckets to probe, more chunks mean fuller buckets;
+        # pick the cheapest of the two for this many hashes
+        def cost(chunk_count):
+            width = HASH_BITS // chunk_count
+            ball = sum(comb(width, d) for d in range(radius // chunk_count + 1))
+            return chunk_count * ball * (1 + count / 2 ** width)
+        return min(range(1, min(radius + 1, HASH_BITS // 4) + 1), key=cost)
+
+    def pairs(self) -> Iterator[Tuple[int, int, int]]:
+        # (i, j, distance) for every pair of hashes within radius, each pair once
+        hashes, radius, sub_radius = self.hashes, self.radius, self.sub_radius
+        for chunk, (shift, width) in enumerate(self.chunks):
+            earlier = self.chunks[:chunk]
+            mask = (1 << width) - 1
+
+            def compare(i, j):
+                distance = (hashes[i] ^ hashes[j]).bit_count()
+                # Reported by the first chunk the pair is close in
+                if distance <= radius and not any(
+                        (((hashes[i] ^ hashes[j]) >> s) & ((1 << w) - 1)).bit_count() <= sub_radius for s, w in earlier):
+                    return distance
+                return None
+
+            # Chunk value -> hash index, or a list of them
+            buckets: Dict[int, Any] = {}
+            for i, h in enumerate(hashes):
+                key = (h >> shift) & mask
+                bucket = buckets.get(key)
+                if bucket is None:
+                    buckets[key] = i
+                elif type(bucket) is list:
+                    bucket.append(i)
+                else:
+                    buckets[key] = [bucket, i]
+
+            flips = _flips(width, sub_radius)
+            for key, bucket in buckets.items():
+                ids = bucket if type(bucket) is list else (bucket,)
+                for a in range(len(ids)):
+                    for b in range(a + 1, len(ids)):
+                        distance = compare(ids[a], ids[b])
+                        if distance is not None:
+                            yield ids[a], ids[b], distance
+                for flip in flips:
+                    other_key = key ^ flip
+                    if other_key > key and other_key in buckets:
+                        other = buckets[other_key]
+                        for j in (other if type(other) is list else (other,)):
+                            for i in ids:
+                                distance = compare(i, j)
+                                if distance is not None:
+                                    yield i, j, distance
+            del buckets
+
+
+def group_hashes(hashes: Sequence[int], threshold: int = DEFAULT_THRESHOLD) -> List[List[int]]:
+    # Indexes of hashes grouped with every hash within threshold bits of one of the group
+    # (single linkage). Singletons are left out.
+
+    # Identical hashes are grouped first; only distinct values go through the index
+    first_of: Dict[int, int] = {}
+    unique: List[int] = []
+    members: List[Any] = []
+    for i, h in enumerate(hashes):
+        u = first_of.setdefault(h, len(unique))
+        if u == len(unique):
+            unique.append(h)
+            members.append(i)
+        elif type(members[u]) is list:
+            members[u].append(i)
+        else:
+            members[u] = [members[u], i]
+    del first_of
+
+    parent = list(range(len(unique)))
+
+    def find(u):
+        while parent[u] != u:
+            parent[u] = parent[parent[u]]
+            u = parent[u]
+        return u
+
+    if threshold > 0:
+        for u, v, _ in MultiIndexHash(unique, threshold).pairs():
+            root_u, root_v = find(u), find(v)
+            if root_u != root_v:
+                parent[root_v] = root_u
+
+    # Walk the distinct values sorted by group, rather than building a list per group
+    roots = [find(u) for u in range(len(unique))]
+    groups = []
+    for _, run in groupby(sorted(range(len(unique)), key=roots.__getitem__), key=roots.__getitem__):
+        group = []
+        for u in run:
+            group.extend(members[u] if type(members[u]) is list else (members[u],))
+        if len(group) > 1:
+            groups.append(sorted(group))
+    return groups
+
+
+def find_duplicates(base_path: str, threshold: int = DEFAULT_THRESHOLD, workers: Optional[int] = None,
+                    index_path: Optional[str] = None, index: Optional[MetadataIndex] = None) -> List[List[ImageFile]]:
+    # Groups of near-identical images, oldest first; the first of each group is the one to keep.
+    # Workers read stored hashes from index_path; new ones are written through index.
+    files: List[ImageFile] = []
+    hashes: List[int] = []
+    computed = []
+    results = run_pipeline(
+        iter_png_files(base_path, skip_dirs=(DUPLICATES_DIR,)),
+        hash_batch,
+        workers=workers,
+        initializer=init_hash_worker,
+        initargs=(index_path,),
+        finalizer=close_hash_worker
+    )
+    for file_path, size, mtime_ns, value, is_new, error in results:
+        if error:
+            logging.error("Error hashing file " + file_path + ": " + error)
+            continue
+        files.append((file_path, size, mtime_ns))
+        hashes.append(value)
+        if index and is_new:
+            computed.append((file_path, size, mtime_ns, to_signed(value)))
+            if len(computed) >= 1000:
+                index.put_dhashes(computed)
+                computed = []
+    if index and computed:
+        index.put_dhashes(computed)
+
+    groups = [[files[i] for i in group] for group in group_hashes(hashes, threshold)]
+    for group in groups:
+        group.sort(key=lambda f: (f[2], f[0]))
+    return groups
+
+
+def plan_duplicates(groups: List[List[ImageFile]], output_dir: str) -> MovePlan:
+    # Everything but the kept image moves to duplicates/<name of the kept image>
+    plan = MovePlan()
+    for kept, *duplicates in groups:
+        target_dir = os.path.join(output_dir, DUPLICATES_DIR, os.path.splitext(os.path.basename(kept[0]))[0].lower())
+        for file_path, _, _ in duplicates:
+            plan.add(file_path, target_dir)
+    return plan
+
+
+def print_groups(groups: List[List[ImageFile]]):
+    for kept, *duplicates in groups:
+        print("Keep " + kept[0])
+        for file_path, _, _ in duplicates:
+            print("  duplicate " + file_path)
+    print(f"{len(groups)} groups, {sum(len(group) - 1 for group in groups)} duplicates")
+
+
+def dedupe_images(base_path: str, output_dir: str, threshold: int = DEFAULT_THRESHOLD, workers: Optional[int] = None,
+                  index_path: Optional[str] = INDEX_FILE, journal_path: str = DEDUPE_JOURNAL_FILE,
+                  move: bool = False, dry_run: bool = False) -> List[List[ImageFile]]:
+    # Prints the groups, or with move, moves the duplicates into the duplicates category
+    # (dry_run prints those moves instead)
+    if dry_run:
+        # Read the index if there is one, but write nothing
+        index = None
+        if index_path and not os.path.exists(index_path):
+            index_path = None
+    else:
+        index = MetadataIndex(index_path) if index_path else None
+
+    try:
+        if move and not dry_run and os.path.exists(journal_path):
+            logging.warning("Finishing the interrupted dedupe run in " + journal_path)
+            resume_moves(journal_path, index.move if index else None)
+
+        groups = find_duplicates(base_path, threshold, workers, index_path, index)
+        if not move:
+            print_groups(groups)
+        elif dry_run:
+            plan_duplicates(groups, output_dir).print()
+        else:
+            apply_plan(plan_duplicates(groups, output_dir), journal_path, index.move if index else None)
+        return groups
+    finally:
+        if index:
+            index.close()
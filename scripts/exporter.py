@@ -0,0 +1,189 @@
+import os
+import csv
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from scripts.metadata_extractor import ImageRecord
+from scripts.metadata_index import INDEX_FILE, IndexEntry, MetadataIndex, lookup_or_extract
+from scripts.organizer import iter_png_files
+from scripts.pipeline import run_pipeline
+
+# Bulk export of the fields the GUI shows, for analysis in pandas/duckdb. Records stream out
+# of the worker pool and are written CHUNK_ROWS at a time, so memory use doesn't grow with the
+# number of images. Images already in the metadata index are not parsed again.
+
+FORMATS = ('jsonl', 'csv', 'parquet')
+
+# Rows buffered per write; one Parquet row group each
+CHUNK_ROWS = 4096
+
+# Column order of every format
+COLUMNS = ('path', 'generator', 'models', 'loras', 'vaes', 'positive_prompt', 'negative_prompt', 'sampler', 'seed',
+           'steps', 'cfg', 'scheduler', 'denoise', 'clip_skip', 'width', 'height')
+
+LIST_COLUMNS = ('models', 'loras', 'vaes')
+INT_COLUMNS = ('seed', 'steps', 'clip_skip', 'width', 'height')
+FLOAT_COLUMNS = ('cfg', 'denoise')
+
+# Per-process state of the export workers, set once by init_export_worker
+_export_state: Dict[str, Any] = {}
+
+
+def init_export_worker(node_defaults: Dict[str, str], index_path: Optional[str] = None):
+    _export_state['node_defaults'] = node_defaults
+    _export_state['index'] = MetadataIndex(index_path, readonly=True) if index_path else None
+
+
+def close_export_worker():
+    if _export_state.get('index'):
+        _export_state['index'].close()
+    _export_state.clear()
+
+
+def _typed(value: Any, kind: type) -> Any:
+    # ComfyUI inputs wired to another node hold a link like ["4", 0] instead of a value
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def export_row(file_path: str, record: ImageRecord) -> Dict[str, Any]:
+    row = {
+        'path': os.path.abspath(file_path),
+        'generator': record.generator,
+        'models': [str(model) for model in record.models],
+        'loras': [str(lora) for lora in record.loras],
+        'vaes': [str(vae) for vae in record.vaes],
+        'positive_prompt': record.positive_prompt,
+        'negative_prompt': record.negative_prompt,
+        'sampler': record.sampler,
+        'scheduler': record.scheduler
+    }
+    for column in INT_COLUMNS:
+        row[column] = _typed(getattr(record, column), int)
+    for column in FLOAT_COLUMNS:
+        row[column] = _typed(getattr(record, column), float)
+    return {column: row[column] for column in COLUMNS}
+
+
+class JsonlWriter:
+    def __init__(self, output_path: str):
+        self.file = open(output_path, 'w', encoding='utf-8')
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self.file.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class CsvWriter:
+    def __init__(self, output_path: str):
+        self.file = open(output_path, 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows: List[Dict[str, Any]]):
+        # Lists are joined the way the GUI shows them
+        self.writer.writerows(
+            [', '.join(row[column]) if column in LIST_COLUMNS else row[column] for column in COLUMNS]
+            for row in rows
+        )
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    def __init__(self, output_path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+        types = {column: pa.list_(pa.string()) for column in LIST_COLUMNS}
+        types.update({column: pa.int64() for column in INT_COLUMNS})
+        types.update({column: pa.float64() for column in FLOAT_COLUMNS})
+        self.pa = pa
+        self.schema = pa.schema([(column, types.get(column, pa.string())) for column in COLUMNS])
+        self.writer = pq.ParquetWriter(output_path, self.schema, compression='zstd')
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {
+    'jsonl': JsonlWriter,
+    'csv': CsvWriter,
+    'parquet': ParquetWriter
+}
+
+
+def format_for(output_path: str) -> str:
+    ext = os.path.splitext(output_path)[1].lower().lstrip('.')
+    if ext in ('json', 'ndjson'):
+        ext = 'jsonl'
+    if ext not in FORMATS:
+        raise ValueError("Cannot tell the export format from " + output_path + "; use one of " + ', '.join(FORMATS))
+    return ext
+
+
+def export_batch(file_paths: List[str]) -> List[Tuple[str, Optional[Dict[str, Any]], Optional[IndexEntry], Optional[str]]]:
+    # Rows are built in the workers; the generator column is None for images without metadata
+    results = []
+    for file_path in file_paths:
+        try:
+            record, entry = lookup_or_extract(_export_state['index'], file_path, _export_state['node_defaults'])
+            results.append((file_path, export_row(file_path, record), entry, None))
+        except Exception as e:
+            results.append((file_path, None, None, str(e)))
+    return results
+
+
+def export_records(base_path: str, output_path: str, node_defaults: Dict[str, str], output_format: Optional[str] = None,
+                   workers: Optional[int] = None, index_path: Optional[str] = INDEX_FILE,
+                   include_empty: bool = False) -> Tuple[int, int, int]:
+    # Exports every PNG under base_path, organized folders included. Images without generation
+    # metadata are skipped unless include_empty is set. Returns (files seen, rows written, errors).
+    writer = WRITERS[output_format or format_for(output_path)](output_path)
+    index = MetadataIndex(index_path) if index_path else None
+    seen = written = errors = 0
+    chunk = []
+    try:
+        results = run_pipeline(
+            iter_png_files(base_path, skip_dirs=()),
+            export_batch,
+            workers=workers,
+            initializer=init_export_worker,
+            initargs=(node_defaults, index_path),
+            finalizer=close_export_worker
+        )
+        for file_path, row, entry, error in results:
+            seen += 1
+            if index and entry:
+                index.put(entry)
+            if error:
+                errors += 1
+                logging.error("Error exporting file " + file_path + ": " + error)
+                continue
+            if row['generator'] is None and not include_empty:
+                continue
+            chunk.append(row)
+            if len(chunk) >= CHUNK_ROWS:
+                writer.write(chunk)
+                written += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write(chunk)
+            written += len(chunk)
+    finally:
+        writer.close()
+        if index:
+            index.close()
+    return seen, written, errors
@@ -0,0 +1,292 @@
+import os
+import math
+import time
+import queue
+import logging
+import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import messagebox, ttk
+from PIL import ImageTk
+from scripts.gallery_search import SearchFilters, choices, paths_for, search
+from scripts.metadata_index import INDEX_FILE, MetadataIndex
+from scripts.preview_cache import THUMBNAIL_SIZE, PreviewCache
+
+# Gallery window over the metadata index. The grid is virtual: the search returns rowids only,
+# paths are looked up a screen at a time, and thumbnails are only decoded for the visible
+# rows plus PREFETCH_ROWS above and below. Anything scrolled away before its turn is skipped.
+
+CELL_SIZE = max(THUMBNAIL_SIZE) + 8
+
+# Rows loaded beyond the visible ones, so slow scrolling finds them ready
+PREFETCH_ROWS = 2
+
+# How often the Tk loop picks up finished searches and thumbnails, in milliseconds
+GALLERY_POLL_MS = 30
+
+# Matches shown before the full result list has been read
+FIRST_RESULTS = 500
+
+# Threads decoding thumbnails
+THUMBNAIL_THREADS = 2
+
+
+def parse_number(text, kind):
+    text = text.strip()
+    return kind(text) if text else None
+
+
+def read_filters(fields):
+    return SearchFilters(
+        text=fields['text'].get(),
+        prompt=fields['prompt'].get(),
+        model=fields['model'].get(),
+        lora=fields['lora'].get(),
+        sampler=fields['sampler'].get(),
+        category=fields['category'].get(),
+        seed_min=parse_number(fields['seed_min'].get(), int),
+        seed_max=parse_number(fields['seed_max'].get(), int),
+        cfg_min=parse_number(fields['cfg_min'].get(), float),
+        cfg_max=parse_number(fields['cfg_max'].get(), float)
+    )
+
+
+def run_search(gallery, generation, filters):
+    # On the search thread, with its own connection. The first screen is sent on its own so
+    # the grid fills straight away; the full list, which the scrollbar needs, follows.
+    start = time.perf_counter()
+    try:
+        with MetadataIndex(gallery['index_path'], readonly=True) as index:
+            rowids = search(index, filters, FIRST_RESULTS)
+            complete = len(rowids) < FIRST_RESULTS
+            gallery['results'].put((generation, rowids, complete, time.perf_counter() - start, None))
+            if not complete and generation == gallery['generation']:
+                rowids = search(index, filters)
+                gallery['results'].put((generation, rowids, True, time.perf_counter() - start, None))
+    except Exception as e:
+        logging.error("Gallery search failed: " + str(e))
+        gallery['results'].put((generation, None, True, 0.0, e))
+
+
+def start_search(gallery):
+    try:
+        filters = read_filters(gallery['fields'])
+    except ValueError as e:
+        gallery['status'].config(text="Invalid number: " + str(e))
+        return
+    gallery['generation'] += 1
+    gallery['status'].config(text="Searching...")
+    gallery['search_executor'].submit(run_search, gallery, gallery['generation'], filters)
+
+
+def show_results(gallery, generation, rowids, complete, elapsed):
+    gallery['status'].config(text=f"{len(rowids)}{'' if complete else '+'} images ({elapsed * 1000:.0f} ms)")
+    if generation != gallery['shown_generation']:
+        # A new search; the full list of the one on screen only extends the grid
+        gallery['shown_generation'] = generation
+        clear_grid(gallery)
+        gallery['canvas'].yview_moveto(0)
+    gallery['rowids'] = rowids
+    layout_grid(gallery)
+
+
+def clear_grid(gallery):
+    gallery['canvas'].delete('all')
+    gallery['items'].clear()
+    gallery['paths'].clear()
+    gallery['wanted'] = frozenset()
+
+
+def layout_grid(gallery):
+    canvas = gallery['canvas']
+    gallery['columns'] = max(1, canvas.winfo_width() // CELL_SIZE)
+    rows = math.ceil(len(gallery['rowids']) / gallery['columns'])
+    canvas.config(scrollregion=(0, 0, gallery['columns'] * CELL_SIZE, rows * CELL_SIZE))
+    refresh_grid(gallery)
+
+
+def refresh_grid(gallery):
+    # Called after every scroll and resize: keeps canvas items for the visible window only
+    canvas, columns, rowids = gallery['canvas'], gallery['columns'], gallery['rowids']
+    top = canvas.canvasy(0)
+    first_row = max(0, int(top // CELL_SIZE) - PREFETCH_ROWS)
+    last_row = int((top + canvas.winfo_height()) // CELL_SIZE) + PREFETCH_ROWS
+    start = first_row * columns
+    window = rowids[start:(last_row + 1) * columns]
+    wanted = frozenset(window)
+    gallery['wanted'] = wanted
+
+    items, paths = gallery['items'], gallery['paths']
+    for rowid in [rowid for rowid in items if rowid not in wanted]:
+        item = items.pop(rowid)[0]
+        if item is not None:
+            canvas.delete(item)
+    for rowid in [rowid for rowid in paths if rowid not in wanted]:
+        del paths[rowid]
+    paths.update(paths_for(gallery['index'], [rowid for rowid in window if rowid not in paths]))
+
+    for position, rowid in enumerate(window, start):
+        x = position % columns * CELL_SIZE + CELL_SIZE // 2
+        y = position // columns * CELL_SIZE + CELL_SIZE // 2
+        if rowid in items:
+            # [canvas item, PhotoImage, x, y]; the first two stay None until the thumbnail arrives
+            items[rowid][2:] = x, y
+            if items[rowid][0] is not None:
+                canvas.coords(items[rowid][0], x, y)
+        elif rowid in paths:
+            items[rowid] = [None, None, x, y]
+            gallery['thumbnail_executor'].submit(load_thumbnail, gallery, gallery['generation'], rowid, paths[rowid])
+
+
+def load_thumbnail(gallery, generation, rowid, file_path):
+    # On a thumbnail thread. Requests for cells that have left the window are dropped unread.
+    if generation != gallery['generation'] or rowid not in gallery['wanted']:
+        return
+    try:
+        thumbnail = gallery['cache'].thumbnail(file_path)
+    except Exception as e:
+        logging.warning("Cannot load thumbnail for " + file_path + ": " + str(e))
+        return
+    gallery['loaded'].put((generation, rowid, thumbnail))
+
+
+def poll_gallery(gallery):
+    if gallery['closed']:
+        return
+    while True:
+        try:
+            generation, rowids, complete, elapsed, error = gallery['results'].get_nowait()
+        except queue.Empty:
+            break
+        if error:
+            gallery['status'].config(text="Search failed: " + str(error))
+        elif generation == gallery['generation']:
+            show_results(gallery, generation, rowids, complete, elapsed)
+
+    canvas, items = gallery['canvas'], gallery['items']
+    while True:
+        try:
+            generation, rowid, thumbnail = gallery['loaded'].get_nowait()
+        except queue.Empty:
+            break
+        item = items.get(rowid)
+        if generation != gallery['generation'] or item is None or item[1] is not None:
+            continue
+        # PhotoImage has to be created on the Tk thread, and kept alive while it is shown
+        item[1] = ImageTk.PhotoImage(thumbnail)
+        item[0] = canvas.create_image(item[2], item[3], image=item[1])
+    gallery['window'].after(GALLERY_POLL_MS, poll_gallery, gallery)
+
+
+def scroll_grid(gallery, *args):
+    gallery['canvas'].yview(*args)
+    refresh_grid(gallery)
+
+
+def on_mouse_wheel(event, gallery):
+    # Windows and macOS report a delta, X11 sends buttons 4 and 5
+    if event.num == 4 or event.delta > 0:
+        scroll_grid(gallery, 'scroll', -1, 'units')
+    elif event.num == 5 or event.delta < 0:
+        scroll_grid(gallery, 'scroll', 1, 'units')
+
+
+def on_grid_click(event, gallery):
+    canvas = gallery['canvas']
+    column = int(canvas.canvasx(event.x) // CELL_SIZE)
+    position = int(canvas.canvasy(event.y) // CELL_SIZE) * gallery['columns'] + column
+    if column < gallery['columns'] and position < len(gallery['rowids']):
+        file_path = gallery['paths'].get(gallery['rowids'][position])
+        if file_path:
+            gallery['on_select'](file_path)
+
+
+def open_gallery(root, on_select, cache=None, index_path=INDEX_FILE):
+    # on_select receives the path of a clicked image
+    if not os.path.exists(index_path):
+        messagebox.showinfo("Gallery", "No metadata index yet. Organize or index a folder first.")
+        return
+
+    window = tk.Toplevel(root)
+    window.title("Gallery")
+    window.geometry(f"{CELL_SIZE * 5 + 40}x{CELL_SIZE * 4 + 160}")
+
+    filters_frame = tk.Frame(window, padx=10, pady=5)
+    filters_frame.pack(fill="x")
+    fields = {}
+
+    def add_field(label_text, key, row, column, widget_type=tk.Entry, **options):
+        tk.Label(filters_frame, text=label_text).grid(row=row, column=column * 2, sticky=tk.W, padx=(0, 5))
+        fields[key] = widget_type(filters_frame, **options)
+        fields[key].grid(row=row, column=column * 2 + 1, sticky=tk.W + tk.E, pady=2)
+        fields[key].bind('<Return>', lambda event: start_search(gallery))
+
+    add_field("Search", 'text', 0, 0, width=30)
+    add_field("Prompt", 'prompt', 0, 1, width=30)
+    add_field("Model", 'model', 1, 0)
+    add_field("LoRA", 'lora', 1, 1)
+    add_field("Sampler", 'sampler', 2, 0, ttk.Combobox)
+    add_field("Category", 'category', 2, 1, ttk.Combobox)
+    add_field("Seed from", 'seed_min', 3, 0)
+    add_field("Seed to", 'seed_max', 3, 1)
+    add_field("CFG from", 'cfg_min', 4, 0)
+    add_field("CFG to", 'cfg_max', 4, 1)
+    filters_frame.grid_columnconfigure(1, weight=1)
+    filters_frame.grid_columnconfigure(3, weight=1)
+
+    tk.Button(filters_frame, text="Search", command=lambda: start_search(gallery)).grid(row=5, column=0, columnspan=4, pady=5)
+    status = tk.Label(window, text="", anchor=tk.W, padx=10)
+    status.pack(fill="x")
+
+    grid_frame = tk.Frame(window)
+    grid_frame.pack(fill="both", expand=True)
+    canvas = tk.Canvas(grid_frame, highlightthickness=0, yscrollincrement=CELL_SIZE // 4)
+    scrollbar = tk.Scrollbar(grid_frame, orient=tk.VERTICAL, command=lambda *args: scroll_grid(gallery, *args))
+    canvas.config(yscrollcommand=scrollbar.set)
+    scrollbar.pack(side=tk.RIGHT, fill="y")
+    canvas.pack(side=tk.LEFT, fill="both", expand=True)
+
+    gallery = {
+        'window': window,
+        'canvas': canvas,
+        'status': status,
+        'fields': fields,
+        'on_select': on_select,
+        'cache': cache or PreviewCache(),
+        'index_path': index_path,
+        # Path lookups for the visible screen, on the Tk thread
+        'index': MetadataIndex(index_path, readonly=True),
+        'search_executor': ThreadPoolExecutor(max_workers=1),
+        'thumbnail_executor': ThreadPoolExecutor(max_workers=THUMBNAIL_THREADS),
+        'results': queue.Queue(),
+        'loaded': queue.Queue(),
+        'generation': 0,
+        'rowids': [],
+        'shown_generation': 0,
+        'columns': 1,
+        'items': {},
+        'paths': {},
+        'wanted': frozenset(),
+        'closed': False
+    }
+
+    fields['sampler'].config(values=[''] + choices(gallery['index'], 'sampler'))
+    categories = choices(gallery['index'], 'category')
+    fields['category'].config(values=[''] + sorted({category.split('/')[0] for category in categories}) + categories)
+
+    canvas.bind('<Configure>', lambda event: layout_grid(gallery))
+    canvas.bind('<Button-1>', lambda event: on_grid_click(event, gallery))
+    for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+        canvas.bind(sequence, lambda event: on_mouse_wheel(event, gallery))
+
+    def on_close():
+        gallery['closed'] = True
+        gallery['generation'] += 1
+        gallery['search_executor'].shutdown(wait=False, cancel_futures=True)
+        gallery['thumbnail_executor'].shutdown(wait=False, cancel_futures=True)
+        gallery['index'].close()
+        window.destroy()
+
+    window.protocol("WM_DELETE_WINDOW", on_close)
+    poll_gallery(gallery)
+    start_search(gallery)
+    return window
@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from scripts.metadata_index import MetadataIndex
+
+# Queries behind the gallery browser. Every filter is answered from an index: the trigram
+# full text table for substrings, B-tree indexes for the rest. Results are rowids, newest
+# indexed first, so the gallery can hold a 500k match list and look paths up per screen.
+
+# Shorter text than this has no trigram and falls back to a LIKE scan
+TRIGRAM = 3
+
+# Values that can be picked from a list in the gallery
+CHOICE_COLUMNS = ('sampler', 'category', 'model')
+
+
+@dataclass(slots=True)
+class SearchFilters:
+    # Words found anywhere in the prompt, model or LoRA names
+    text: str = ''
+    # Substrings of one field
+    prompt: str = ''
+    model: str = ''
+    lora: str = ''
+    # Exact values
+    sampler: str = ''
+    # "characters" or "characters/Alice Smith"
+    category: str = ''
+    seed_min: Optional[int] = None
+    seed_max: Optional[int] = None
+    cfg_min: Optional[float] = None
+    cfg_max: Optional[float] = None
+
+
+def _phrase(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _like(text: str) -> str:
+    return '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def build_query(filters: SearchFilters) -> Tuple[str, List[Any]]:
+    # Returns the FROM and WHERE clauses and their parameters; both select rowids of images
+    matches, conditions, params = [], [], []
+
+    def substring(columns: Sequence[str], text: str):
+        if len(text) >= TRIGRAM:
+            matches.append(('{' + ' '.join(columns) + '} : ' if len(columns) > 1 else columns[0] + ' : ') + _phrase(text))
+        else:
+            conditions.append('(' + ' OR '.join(f"{column} LIKE ? ESCAPE '\\'" for column in columns) + ')')
+            params.extend(_like(text) for _ in columns)
+
+    for word in filters.text.split():
+        substring(('prompt', 'models', 'loras'), word)
+    for column, text in (('prompt', filters.prompt), ('models', filters.model), ('loras', filters.lora)):
+        if text.strip():
+            substring((column,), text.strip())
+
+    if filters.sampler:
+        conditions.append("sampler = ?")
+        params.append(filters.sampler)
+    if filters.category:
+        # A category also matches every name filed under it
+        conditions.append("(category = ? OR (category > ? AND category < ?))")
+        params.extend((filters.category, filters.category + '/', filters.category + '0'))
+    for column, low, high in (('seed', filters.seed_min, filters.seed_max), ('cfg', filters.cfg_min, filters.cfg_max)):
+        if low is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(low)
+        if high is not None:
+            conditions.append(f"{column} <= ?")
+            params.append(high)
+    if matches and not conditions:
+        # Text alone is answered by the full text table, which walks its matches newest first
+        # and stops at the LIMIT
+        return " FROM images_fts WHERE images_fts MATCH ?", [' AND '.join(matches)]
+    if matches:
+        # As a subquery the match runs once, up front, rather than being probed for each row
+        # another index turns up
+        conditions.insert(0, "rowid IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)")
+        params.insert(0, ' AND '.join(matches))
+    return " FROM images" + (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+
+def search(index: MetadataIndex, filters: SearchFilters, limit: Optional[int] = None) -> List[int]:
+    query, params = build_query(filters)
+    sql = "SELECT rowid" + query + " ORDER BY rowid DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [rowid for (rowid,) in index.conn.execute(sql, params)]
+
+
+def count(index: MetadataIndex, filters: SearchFilters) -> int:
+    query, params = build_query(filters)
+    return index.conn.execute("SELECT count(*)" + query, params).fetchone()[0]
+
+
+def paths_for(index: MetadataIndex, rowids: Sequence[int]) -> Dict[int, str]:
+    # One screen of the gallery at a time
+    if not rowids:
+        return {}
+    placeholders = ', '.join('?' * len(rowids))
+    return dict(index.conn.execute(f"SELECT rowid, path FROM images WHERE rowid IN ({placeholders})", list(rowids)))
+
+
+def choices(index: MetadataIndex, column: str) -> List[str]:
+    # Distinct values straight off the column's index
+    if column not in CHOICE_COLUMNS:
+        raise ValueError("Not a choice column: " + column)
+    return [value for (value,) in index.conn.execute(f"SELECT DISTINCT {column} FROM images WHERE {column} IS NOT NULL ORDER BY {column}")]
@@ -1,11 +1,25 @@
+import queue
+import threading
 import tkinter as tk
-from tkinter import filedialog, messagebox, scrolledtext
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import filedialog, messagebox, scrolledtext, ttk
 from tkinterdnd2 import TkinterDnD, DND_FILES
-from PIL import Image, ImageTk
+from collections import deque
+from PIL import ImageTk
+from scripts.config import CONFIG_FILE, data_file_for, index_path_for
+from scripts.gallery import open_gallery
 from scripts.metadata_parser import MetadataParser
 from scripts.organizer import organize_images
+from scripts.preview_cache import PreviewCache
+from scripts.progress import CANCELLED, MOVING, ProgressEvent
 import logging
 
+# How often the Tk loop drains progress events from the organize job, in milliseconds
+PROGRESS_POLL_MS = 100
+
+# How often the Tk loop checks for finished previews while files are queued, in milliseconds
+PREVIEW_POLL_MS = 30
+
 
 def display_info(metadata, text_widgets):
     # Clear all text widgets
@@ -28,49 +42,133 @@ def display_info(metadata, text_widgets):
                 append_text(text_widgets[key], value)
 
 
-def parse_image(file_path, text_widgets, image_label):
-    try:
-        # Load and display the image
-        img = Image.open(file_path)
-        img.thumbnail((200, 200))
-        img = ImageTk.PhotoImage(img)
-        image_label.config(image=img)
-        image_label.image = img
-
-        # Parse the file using MetadataParser
-        parser = MetadataParser()
-        prompt_info, formatted_metadata, cfg_scale, steps, width, height, positive_prompt, negative_prompt, clip_skip, vaes, models, sampler_name, scheduler, denoise = parser.extract_metadata(file_path)
-
-        metadata = {
-            'model': ', '.join(models),
-            'positive_prompt': positive_prompt,
-            'negative_prompt': negative_prompt,
-            'sampler': sampler_name,
-            'seed': str(parser.find_value_in_dict(prompt_info.parameters, 'seed')),
-            'steps': str(steps),
-            'cfg': str(cfg_scale),
-            'scheduler': scheduler,
-            'denoise': str(denoise),
-            'vae': ', '.join(vaes),
-            'additional_metadata': formatted_metadata
-        }
-
-        display_info(metadata, text_widgets)
-
-    except Exception as e:
-        logging.exception("Error reading file: " + file_path)
-        messagebox.showerror("Error", "Error reading file: " + file_path + "\n" + str(e))
-
-
-def on_file_drop(event, text_widgets, image_label):
-    file_path = event.data.strip('{}')
-    parse_image(file_path, text_widgets, image_label)
+def record_metadata(record):
+    return {
+        'model': ', '.join(record.models),
+        'positive_prompt': record.positive_prompt,
+        'negative_prompt': record.negative_prompt,
+        'sampler': record.sampler or '',
+        'seed': str(record.seed),
+        'steps': str(record.steps),
+        'cfg': str(record.cfg),
+        'scheduler': record.scheduler or '',
+        'denoise': str(record.denoise),
+        'vae': ', '.join(record.vaes),
+        'additional_metadata': record.formatted_metadata if record.has_metadata else "No metadata found."
+    }
 
 
-def open_file_dialog(text_widgets, image_label):
-    file_path = filedialog.askopenfilename(filetypes=[("PNG files", "*.png")])
-    if file_path:
-        parse_image(file_path, text_widgets, image_label)
+def queue_previews(file_paths, preview):
+    # Files are read one after another on the preview thread and shown in the order they were dropped
+    for file_path in file_paths:
+        future = preview['executor'].submit(preview['cache'].get, file_path, preview['parser'].extract_record)
+        preview['pending'].append((file_path, future))
+    if len(preview['pending']) == len(file_paths):
+        poll_previews(preview)
+
+
+def poll_previews(preview):
+    pending = preview['pending']
+    while pending and pending[0][1].done():
+        file_path, future = pending.popleft()
+        try:
+            thumbnail, record = future.result()
+        except Exception as e:
+            logging.error("Error reading file: " + file_path + ": " + str(e))
+            messagebox.showerror("Error", "Error reading file: " + file_path + "\n" + str(e))
+            continue
+        # PhotoImage has to be created on the Tk thread
+        img = ImageTk.PhotoImage(thumbnail)
+        preview['image_label'].config(image=img)
+        preview['image_label'].image = img
+        display_info(record_metadata(record), preview['text_widgets'])
+
+    preview['queue_label'].config(text=f"Loading {len(pending)} file(s)..." if pending else "")
+    if pending:
+        preview['image_label'].after(PREVIEW_POLL_MS, poll_previews, preview)
+
+
+def on_file_drop(event, preview):
+    # Several files arrive as a Tcl list; names with spaces are wrapped in braces
+    queue_previews(event.widget.tk.splitlist(event.data), preview)
+
+
+def open_file_dialog(preview):
+    file_paths = filedialog.askopenfilenames(filetypes=[("PNG files", "*.png"), ("Images", "*.png *.jpg *.jpeg *.webp")])
+    if file_paths:
+        queue_previews(file_paths, preview)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}" if seconds >= 3600 else f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def show_progress(event: ProgressEvent, controls):
+    if event.phase == MOVING or (event.finished and event.to_move):
+        done, total, verb = event.moved, event.to_move, "Moved"
+    else:
+        done, total, verb = event.parsed + event.failed, event.scanned, "Read"
+    controls['progress_bar'].config(maximum=max(total, 1), value=done)
+
+    status = f"{verb} {done}/{total}{'' if event.scan_complete else '+'} files"
+    if event.failed:
+        status += f", {event.failed} failed"
+    status += f", {event.rate:.0f} files/s"
+    if event.eta is not None:
+        status += ", " + format_duration(event.eta) + " left"
+    if event.finished:
+        status = ("Cancelled: " if event.phase == CANCELLED else "Done: ") + f"{event.moved} files moved, {event.failed} failed in " + format_duration(event.elapsed)
+    controls['status'].config(text=status)
+
+
+def start_organize(root, config, input_dir, output_dir, executor, controls):
+    # The run happens on a background thread; the Tk loop only ever touches widgets
+    events = queue.Queue()
+    cancel = threading.Event()
+    controls['cancel'] = cancel
+    controls['btn_organize'].config(state=tk.DISABLED)
+    controls['btn_cancel'].config(state=tk.NORMAL)
+    controls['status'].config(text="Scanning " + input_dir + "...")
+    # The same index, journal and rules as `python -m scripts organize`, so either can resume the other's run
+    future = executor.submit(organize_images, input_dir, output_dir, config['node_defaults'], workers=config.get('workers'),
+                             index_path=index_path_for(CONFIG_FILE), journal_path=data_file_for(CONFIG_FILE, 'organize_journal.jsonl'),
+                             rules_file=data_file_for(CONFIG_FILE, 'rules.json'), whole_words=config.get('whole_words', False), progress=events.put, cancel=cancel,
+                             placement=config.get('placement', 'move'), ignore=config.get('scan_ignore', ()),
+                             io_depth=config.get('io_depth', 1))
+    root.after(PROGRESS_POLL_MS, poll_organize, root, events, future, controls)
+
+
+def poll_organize(root, events, future, controls):
+    # Only the latest snapshot is worth drawing
+    event = None
+    while True:
+        try:
+            event = events.get_nowait()
+        except queue.Empty:
+            break
+    if event:
+        show_progress(event, controls)
+
+    if not future.done():
+        root.after(PROGRESS_POLL_MS, poll_organize, root, events, future, controls)
+        return
+
+    controls['cancel'] = None
+    controls['btn_organize'].config(state=tk.NORMAL)
+    controls['btn_cancel'].config(state=tk.DISABLED)
+    error = future.exception()
+    if error:
+        logging.error("Error organizing images: " + str(error))
+        controls['status'].config(text="Failed: " + str(error))
+        messagebox.showerror("Error", "Error organizing images:\n" + str(error))
+
+
+def cancel_organize(controls):
+    if controls.get('cancel'):
+        controls['cancel'].set()
+        controls['btn_cancel'].config(state=tk.DISABLED)
+        controls['status'].config(text="Cancelling...")
 
 
 def create_gui(config, save_config):
@@ -87,9 +185,14 @@ def create_gui(config, save_config):
     image_input_frame = tk.LabelFrame(frame, text="Image Input", padx=10, pady=10)
     image_input_frame.pack(fill="x", pady=10)
 
-    # Open image button
-    btn_open = tk.Button(image_input_frame, text="Open Image", command=lambda: open_file_dialog(text_widgets, image_label))
-    btn_open.grid(row=0, column=0, columnspan=3, pady=10)
+    # Open image and gallery buttons
+    open_buttons_frame = tk.Frame(image_input_frame)
+    open_buttons_frame.grid(row=0, column=0, columnspan=3, pady=10)
+    btn_open = tk.Button(open_buttons_frame, text="Open Image", command=lambda: open_file_dialog(preview))
+    btn_open.pack(side=tk.LEFT, padx=5)
+    # Clicking an image in the gallery previews it here
+    btn_gallery = tk.Button(open_buttons_frame, text="Gallery", command=lambda: open_gallery(root, lambda file_path: queue_previews([file_path], preview), preview['cache']))
+    btn_gallery.pack(side=tk.LEFT, padx=5)
 
     # Image display
     image_label = tk.Label(image_input_frame)
@@ -99,6 +202,9 @@ def create_gui(config, save_config):
     drop_area = tk.Label(image_input_frame, text="Drag Drop Image Here", relief="ridge", width=50, height=5)
     drop_area.grid(row=1, column=1, columnspan=2, pady=10)
 
+    queue_label = tk.Label(image_input_frame, text="")
+    queue_label.grid(row=2, column=1, columnspan=2)
+
     image_input_frame.grid_columnconfigure(0, weight=1)
     image_input_frame.grid_columnconfigure(1, weight=1)
     image_input_frame.grid_columnconfigure(2, weight=1)
@@ -130,6 +236,17 @@ def create_gui(config, save_config):
 
     metadata_frame.grid_columnconfigure(1, weight=1)
 
+    # Dropped and opened images are read on their own thread with one parser for the whole session
+    preview = {
+        'executor': ThreadPoolExecutor(max_workers=1),
+        'cache': PreviewCache(),
+        'parser': MetadataParser(config['node_defaults']),
+        'pending': deque(),
+        'text_widgets': text_widgets,
+        'image_label': image_label,
+        'queue_label': queue_label
+    }
+
     # Organize Section
     organize_frame = tk.LabelFrame(frame, text="Organize Images", padx=10, pady=10)
     organize_frame.pack(fill="x", pady=10)
@@ -148,25 +265,46 @@ def create_gui(config, save_config):
     output_dir_entry.insert(0, config['output_dir'])
     output_dir_entry.grid(row=2, column=1, pady=5, sticky=tk.W + tk.E)
 
-    btn_save_paths = tk.Button(organize_frame, text="Save Paths", command=lambda: save_paths(input_dir_entry, output_dir_entry, save_config))
+    btn_save_paths = tk.Button(organize_frame, text="Save Paths", command=lambda: save_paths(config, input_dir_entry, output_dir_entry, save_config))
     btn_save_paths.grid(row=3, column=0, columnspan=2, pady=5)
 
-    btn_organize = tk.Button(organize_frame, text="Organize", command=lambda: organize_images(input_dir_entry.get(), output_dir_entry.get(), config['node_defaults']))
-    btn_organize.grid(row=4, column=0, columnspan=2, pady=10)
+    # Organizing runs on this executor so the window stays responsive; one run at a time
+    executor = ThreadPoolExecutor(max_workers=1)
+    controls = {}
+
+    buttons_frame = tk.Frame(organize_frame)
+    buttons_frame.grid(row=4, column=0, columnspan=2, pady=10)
+    controls['btn_organize'] = tk.Button(buttons_frame, text="Organize", command=lambda: start_organize(root, config, input_dir_entry.get(), output_dir_entry.get(), executor, controls))
+    controls['btn_organize'].pack(side=tk.LEFT, padx=5)
+    controls['btn_cancel'] = tk.Button(buttons_frame, text="Cancel", state=tk.DISABLED, command=lambda: cancel_organize(controls))
+    controls['btn_cancel'].pack(side=tk.LEFT, padx=5)
+
+    controls['progress_bar'] = ttk.Progressbar(organize_frame, mode='determinate')
+    controls['progress_bar'].grid(row=5, column=0, columnspan=2, pady=5, sticky=tk.W + tk.E)
+    controls['status'] = tk.Label(organize_frame, text="", anchor=tk.W)
+    controls['status'].grid(row=6, column=0, columnspan=2, sticky=tk.W + tk.E)
 
     organize_frame.grid_columnconfigure(1, weight=1)
 
+    def on_close():
+        # Let a running organize stop after its current file before the window goes away
+        cancel_organize(controls)
+        root.destroy()
+        preview['executor'].shutdown(wait=False, cancel_futures=True)
+        executor.shutdown(wait=True)
+
+    root.protocol("WM_DELETE_WINDOW", on_close)
+
     # Enable drag and drop
     root.drop_target_register(DND_FILES)
-    root.dnd_bind('<<Drop>>', lambda event: on_file_drop(event, text_widgets, image_label))
+    root.dnd_bind('<<Drop>>', lambda event: on_file_drop(event, preview))
 
     root.mainloop()
 
 
-def save_paths(input_dir_entry, output_dir_entry, save_config):
-    config = {
-        'base_dir': input_dir_entry.get(),
-        'output_dir': output_dir_entry.get()
-    }
+def save_paths(config, input_dir_entry, output_dir_entry, save_config):
+    # Update the loaded config in place so other settings (node_defaults, workers) are kept
+    config['base_dir'] = input_dir_entry.get()
+    config['output_dir'] = output_dir_entry.get()
     save_config(config)
     messagebox.showinfo("Info", "Paths saved successfully!")
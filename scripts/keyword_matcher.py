@@ -0,0 +1,276 @@
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+# Aho-Corasick automaton over the wildcard keywords. Building costs O(total keyword length)
+# once per run, after which each text is scanned in a single pass regardless of how many
+# keywords there are.
+
+# Wildcard entries list the folder name first and other spellings after it; "!" lines are
+# exclusions, "#" lines comments (see wildcards)
+ALIAS_SEPARATOR = '|'
+EXCLUSION_PREFIX = '!'
+COMMENT_PREFIX = '#'
+
+# Below this many distinct keywords, str.find on the pre-folded keywords beats walking the
+# automaton in Python (see scripts/benchmarks/keyword_matching.py)
+AUTOMATON_MIN_KEYWORDS = 200
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == '_'
+
+
+def parse_entries(lines: Iterable[str]) -> Tuple[List[List[str]], List[str]]:
+    # Wildcard lines -> the spellings of each entry, folder name first, and the exclusions
+    entries = []
+    exclusions = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith(COMMENT_PREFIX):
+            continue
+        if line.startswith(EXCLUSION_PREFIX):
+            phrase = line[len(EXCLUSION_PREFIX):].strip()
+            if phrase:
+                exclusions.append(phrase)
+            continue
+        spellings = [spelling.strip() for spelling in line.split(ALIAS_SEPARATOR)]
+        spellings = [spelling for spelling in spellings if spelling]
+        if spellings:
+            entries.append(spellings)
+    return entries, exclusions
+
+
+class KeywordMatcher:
+    def __init__(self, keywords: Iterable[str], ignore_case: bool = True, whole_words: bool = False):
+        self.keywords = list(keywords)
+        self.ignore_case = ignore_case
+        self.whole_words = whole_words
+
+        # State 0 is the root. goto[state] maps a character to the next state,
+        # out[state] lists the patterns that end at that state (including via fail links).
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[Tuple[int, ...]] = [()]
+        # Pattern id -> pattern length and the keyword indices sharing that pattern
+        self.patterns: List[str] = []
+        self.pattern_lengths: List[int] = []
+        self.pattern_keywords: List[List[int]] = []
+
+        patterns: Dict[str, int] = {}
+        for index, keyword in enumerate(self.keywords):
+            pattern = self._fold(keyword)
+            if not pattern:
+                continue
+            if pattern in patterns:
+                self.pattern_keywords[patterns[pattern]].append(index)
+                continue
+            patterns[pattern] = len(self.patterns)
+            self.patterns.append(pattern)
+            self.pattern_lengths.append(len(pattern))
+            self.pattern_keywords.append([index])
+
+        self.use_automaton = len(self.patterns) >= AUTOMATON_MIN_KEYWORDS
+        if self.use_automaton:
+            for pattern_id, pattern in enumerate(self.patterns):
+                self._add_pattern(pattern, pattern_id)
+            self._build_fail_links()
+
+    def dump(self) -> tuple:
+        # Plain lists, dicts and tuples, so a compiled matcher can be cached with marshal
+        return (self.keywords, self.ignore_case, self.whole_words, self.goto, self.fail, self.out,
+                self.patterns, self.pattern_lengths, self.pattern_keywords, self.use_automaton)
+
+    @classmethod
+    def load(cls, state: tuple) -> 'KeywordMatcher':
+        matcher = cls.__new__(cls)
+        (matcher.keywords, matcher.ignore_case, matcher.whole_words, matcher.goto, matcher.fail, matcher.out,
+         matcher.patterns, matcher.pattern_lengths, matcher.pattern_keywords, matcher.use_automaton) = state
+        return matcher
+
+    def _fold(self, text: str) -> str:
+        return text.lower() if self.ignore_case else text
+
+    def _add_pattern(self, pattern: str, pattern_id: int):
+        state = 0
+        for ch in pattern:
+            next_state = self.goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][ch] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            state = next_state
+        self.out[state] = self.out[state] + (pattern_id,)
+
+    def _build_fail_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(ch, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                if self.out[self.fail[next_state]]:
+                    self.out[next_state] = self.out[next_state] + self.out[self.fail[next_state]]
+
+    def _is_whole_word(self, text: str, start: int, end: int) -> bool:
+        return not ((start > 0 and _is_word_char(text[start - 1])) or
+                    (end < len(text) and _is_word_char(text[end])))
+
+    def _iter_find(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        for pattern_id, pattern in enumerate(self.patterns):
+            start = text.find(pattern)
+            while start != -1:
+                end = start + len(pattern)
+                if not self.whole_words or self._is_whole_word(text, start, end):
+                    yield start, end, pattern_id
+                start = text.find(pattern, start + 1)
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        # Yields (start, end, pattern_id) for every occurrence, overlapping ones included
+        text = self._fold(text)
+        if not self.use_automaton:
+            yield from self._iter_find(text)
+            return
+
+        goto, fail, out, lengths = self.goto, self.fail, self.out, self.pattern_lengths
+        whole_words = self.whole_words
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                end = i + 1
+                for pattern_id in out[state]:
+                    start = end - lengths[pattern_id]
+                    if whole_words and not self._is_whole_word(text, start, end):
+                        continue
+                    yield start, end, pattern_id
+
+    def matched_indices(self, text: str) -> Set[int]:
+        # Indices (into self.keywords) of every keyword found in text
+        if not self.use_automaton and not self.whole_words:
+            # Presence is all that matters here, so skip enumerating every occurrence
+            text = self._fold(text)
+            return {index for pattern, indices in zip(self.patterns, self.pattern_keywords) if pattern in text for index in indices}
+        found = set()
+        for _, _, pattern_id in self.iter_matches(text):
+            found.update(self.pattern_keywords[pattern_id])
+        return found
+
+    def first_keyword(self, texts: Iterable[str]) -> Optional[str]:
+        # Same precedence as the old loops: the first text with a match wins, and within it
+        # the keyword listed first in the wildcard file
+        for text in texts:
+            found = self.matched_indices(text)
+            if found:
+                return self.keywords[min(found)]
+        return None
+
+    def find_all(self, text: str) -> List[str]:
+        return [self.keywords[index] for index in sorted(self.matched_indices(text))]
+
+
+class CategoryMatcher:
+    # One automaton per matching mode for all categories together, so every text is scanned
+    # once no matter how many categories there are. Categories keep their priority order.
+    # Categories are (name, wildcard lines); a match reports its entry's folder name, whichever
+    # spelling was found.
+    def __init__(self, categories: Sequence[Tuple[str, List[str]]], whole_words: bool = False):
+        self.categories = [name for name, _ in categories]
+        keywords = []
+        exclusions = []
+        # Per keyword: its category and the folder name of its entry
+        self.keyword_category: List[int] = []
+        self.names: List[str] = []
+        self.exclusion_category: List[int] = []
+        for category_index, (_, lines) in enumerate(categories):
+            entries, category_exclusions = parse_entries(lines)
+            for spellings in entries:
+                keywords.extend(spellings)
+                self.names.extend([spellings[0]] * len(spellings))
+                self.keyword_category.extend([category_index] * len(spellings))
+            exclusions.extend(category_exclusions)
+            self.exclusion_category.extend([category_index] * len(category_exclusions))
+
+        # ShowText values are matched case-insensitively, the prompt fallback case-sensitively
+        self.node_matcher = KeywordMatcher(keywords, ignore_case=True, whole_words=whole_words)
+        self.prompt_matcher = KeywordMatcher(keywords, ignore_case=False, whole_words=whole_words)
+        self.node_exclusions = KeywordMatcher(exclusions, ignore_case=True, whole_words=whole_words) if exclusions else None
+        self.prompt_exclusions = KeywordMatcher(exclusions, ignore_case=False, whole_words=whole_words) if exclusions else None
+
+    def dump(self) -> tuple:
+        return (self.categories, self.keyword_category, self.names, self.exclusion_category,
+                self.node_matcher.dump(), self.prompt_matcher.dump(),
+                self.node_exclusions.dump() if self.node_exclusions else None,
+                self.prompt_exclusions.dump() if self.prompt_exclusions else None)
+
+    @classmethod
+    def load(cls, state: tuple) -> 'CategoryMatcher':
+        matcher = cls.__new__(cls)
+        (matcher.categories, matcher.keyword_category, matcher.names, matcher.exclusion_category,
+         node_matcher, prompt_matcher, node_exclusions, prompt_exclusions) = state
+        matcher.node_matcher = KeywordMatcher.load(node_matcher)
+        matcher.prompt_matcher = KeywordMatcher.load(prompt_matcher)
+        matcher.node_exclusions = KeywordMatcher.load(node_exclusions) if node_exclusions else None
+        matcher.prompt_exclusions = KeywordMatcher.load(prompt_exclusions) if prompt_exclusions else None
+        return matcher
+
+    def _found(self, matcher: KeywordMatcher, exclusions: Optional[KeywordMatcher], text: str) -> Set[int]:
+        # Keyword indices found in text, leaving out occurrences inside an excluded phrase of
+        # the keyword's own category
+        excluded = []
+        if exclusions is not None:
+            excluded = [(start, end, self.exclusion_category[index]) for start, end, pattern_id in exclusions.iter_matches(text)
+                        for index in exclusions.pattern_keywords[pattern_id]]
+        if not excluded:
+            return matcher.matched_indices(text)
+        found = set()
+        for start, end, pattern_id in matcher.iter_matches(text):
+            for index in matcher.pattern_keywords[pattern_id]:
+                category = self.keyword_category[index]
+                if not any(category == excluded_category and excluded_start <= start and end <= excluded_end
+                           for excluded_start, excluded_end, excluded_category in excluded):
+                    found.add(index)
+        return found
+
+    def _first_by_category(self, found_per_text: List[Set[int]], any_text: bool) -> Optional[Tuple[str, str]]:
+        for category_index, category in enumerate(self.categories):
+            if any_text:
+                # Prompts: first keyword of the category found in any prompt
+                found = set().union(*found_per_text) if found_per_text else set()
+                found = [index for index in found if self.keyword_category[index] == category_index]
+                if found:
+                    return category, self.names[min(found)]
+                continue
+            # ShowText values: first text with a match of this category, then first keyword
+            for found in found_per_text:
+                in_category = [index for index in found if self.keyword_category[index] == category_index]
+                if in_category:
+                    return category, self.names[min(in_category)]
+        return None
+
+    def match_nodes(self, node_texts: List[str]) -> Optional[Tuple[str, str]]:
+        found_per_text = [self._found(self.node_matcher, self.node_exclusions, text) for text in node_texts]
+        return self._first_by_category(found_per_text, any_text=False)
+
+    def match_prompts(self, prompts: List[str]) -> Optional[Tuple[str, str]]:
+        found_per_text = [self._found(self.prompt_matcher, self.prompt_exclusions, text) for text in prompts]
+        return self._first_by_category(found_per_text, any_text=True)
+
+    def match_all(self, node_texts: List[str], prompts: List[str]) -> Dict[int, str]:
+        # Category index -> first keyword for every category with a match, with the precedence
+        # of match_nodes/match_prompts: the prompts only count when no ShowText value matched
+        found_per_text = [self._found(self.node_matcher, self.node_exclusions, text) for text in node_texts]
+        if not any(found_per_text):
+            found_per_text = [set().union(*(self._found(self.prompt_matcher, self.prompt_exclusions, text) for text in prompts))]
+        matches: Dict[int, str] = {}
+        for found in found_per_text:
+            for index in sorted(found):
+                matches.setdefault(self.keyword_category[index], self.names[index])
+        return matches
@@ -1,16 +1,103 @@
+import io
+import os
+import re
 import json
-from typing import Any, Dict, List
-from PIL import Image
-from sd_parsers import ParserManager
+import time
+from dataclasses import asdict, dataclass, field, fields
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple, Union
+from scripts import metrics
+from scripts.parser_dispatch import ParserDispatch
+from scripts.png_chunks import PngText, has_trailing_chunks, read_png_text, read_png_text_from_file
+from scripts.workflow_query import NodeFilter, WorkflowIndex, WorkflowQuery, compile_node_filters, compile_query, iter_workflow_nodes, node_texts
+from scripts.workflow_stream import read_workflow
 
-# Initialize the parser manager
-parser_manager = ParserManager()
+if TYPE_CHECKING:
+    from sd_parsers import ParserManager, PromptInfo
+
+# PIL and sd_parsers are imported on first use so the headless CLI starts quickly
+_parser_manager = None
+_dispatch = None
+
+def get_parser_manager() -> 'ParserManager':
+    global _parser_manager
+    if _parser_manager is None:
+        from sd_parsers import ParserManager
+        # Initialize the parser manager
+        _parser_manager = ParserManager()
+    return _parser_manager
+
+def get_dispatch() -> ParserDispatch:
+    global _dispatch
+    if _dispatch is None:
+        _dispatch = ParserDispatch(get_parser_manager().managed_parsers)
+    return _dispatch
+
+def __getattr__(name: str):
+    # Keeps `metadata_extractor.parser_manager` working without creating it at import time
+    if name == 'parser_manager':
+        return get_parser_manager()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# A1111 style <lora:name:weight> (and LyCORIS <lyco:...>) prompt tags
+LORA_TAG_PATTERN = re.compile(r'<(?:lora|lyco):([^:>]+)', re.IGNORECASE)
+
+DEFAULT_NODE_DEFAULTS = {
+    "node_type": "ShowText|pysssss",
+    "node_key": "Node name for S&R",
+    "node_name": "ShowText|pysssss"
+}
+
+@dataclass(slots=True)
+class ImageRecord:
+    # Everything the GUI preview and the organizer need from one image, read in a single pass
+    generator: Optional[str] = None
+    prompts: List[str] = field(default_factory=list)
+    negative_prompts: List[str] = field(default_factory=list)
+    models: List[str] = field(default_factory=list)
+    vaes: List[str] = field(default_factory=list)
+    loras: List[str] = field(default_factory=list)
+    sampler: Optional[str] = None
+    seed: Any = None
+    steps: Any = None
+    cfg: Any = None
+    scheduler: Optional[str] = None
+    denoise: Any = None
+    clip_skip: Any = None
+    width: int = 0
+    height: int = 0
+    node_texts: List[str] = field(default_factory=list)
+    # Human readable dump for the GUI; large for big workflows, so it is not persisted
+    formatted_metadata: str = ""
+
+    @property
+    def has_metadata(self) -> bool:
+        return self.generator is not None
+
+    @property
+    def positive_prompt(self) -> str:
+        # ShowText output is the prompt as actually sent; fall back to the parsed prompts
+        if self.node_texts:
+            return self.node_texts[0]
+        return '\n'.join(self.prompts)
+
+    @property
+    def negative_prompt(self) -> str:
+        return '\n'.join(self.negative_prompts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        del data['formatted_metadata']
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ImageRecord':
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in names})
 
 def extract_metadata(file_path: str) -> Dict[str, Any]:
     try:
-        img = Image.open(file_path)
         # Extract metadata using sd_parsers
-        prompt_info = parser_manager.parse(file_path)
+        prompt_info, _, _ = read_prompt_info(file_path)
         if not prompt_info:
             raise ValueError("No metadata found in image.")
         metadata = {
@@ -21,65 +108,248 @@ def extract_metadata(file_path: str) -> Dict[str, Any]:
     except Exception as e:
         raise ValueError(f"Error extracting metadata: {e}")
 
-def find_particular_keywords(metadata: Dict[str, Any], keywords: List[str], node_type: str = "ShowText|pysssss", node_key: str = "Node name for S&R", node_name: str = "ShowText|pysssss") -> List[str]:
-    out_found_names = []
+def convert_keys_to_strings(d):
+    if isinstance(d, dict):
+        return {str(k): convert_keys_to_strings(v) for k, v in d.items()}
+    elif isinstance(d, list):
+        return [convert_keys_to_strings(i) for i in d]
+    else:
+        return d
 
-    # Checking in both 'prompt' and 'workflow' sections for relevant nodes
-    for key, section in metadata.items():
-        if key == 'workflow' and isinstance(section, dict):
-            if "nodes" in section:
-                for node in section["nodes"]:
-                    if node.get("type") == node_type and node.get("properties", {}).get(node_key) == node_name:
-                        widgets_values = node.get("widgets_values", [])
-                        for widget in widgets_values:
-                            if isinstance(widget, list):
-                                text_value = widget[0]
-                                for keyword in keywords:
-                                    if keyword.lower() in text_value.lower():
-                                        out_found_names.append(keyword)
-
-        elif isinstance(section, dict):
-            for subkey, subsection in section.items():
-                if subkey == 'workflow' and isinstance(subsection, dict):
-                    if "nodes" in subsection:
-                        for node in subsection["nodes"]:
-                            if node.get("type") == node_type and node.get("properties", {}).get(node_key) == node_name:
-                                widgets_values = node.get("widgets_values", [])
-                                for widget in widgets_values:
-                                    if isinstance(widget, list):
-                                        text_value = widget[0]
-                                        for keyword in keywords:
-                                            if keyword.lower() in text_value.lower():
-                                                out_found_names.append(keyword)
+def find_value_in_dict(d: Union[Dict, List], key: str, default=None) -> Any:
+    if isinstance(d, dict):
+        for k, v in d.items():
+            if k == key:
+                return v
+            elif isinstance(v, (dict, list)):
+                result = find_value_in_dict(v, key, default)
+                if result is not None:
+                    return result
+    elif isinstance(d, list):
+        for item in d:
+            result = find_value_in_dict(item, key, default)
+            if result is not None:
+                return result
+    return default
 
-    return out_found_names
+def find_values_in_dict(d: Union[Dict, List], key: str) -> List[Any]:
+    values = []
+    if isinstance(d, dict):
+        for k, v in d.items():
+            if k == key:
+                values.append(v)
+            elif isinstance(v, (dict, list)):
+                values.extend(find_values_in_dict(v, key))
+    elif isinstance(d, list):
+        for item in d:
+            values.extend(find_values_in_dict(item, key))
+    return values
 
-def get_workflow_node_data(metadata: Dict[str, Any], node_type: str = "ShowText|pysssss", node_key: str = "Node name for S&R", node_name: str = "ShowText|pysssss") -> List[str]:
-    out_found_names = []
+def get_model_names(parameters: Dict[str, Any]) -> List[str]:
+    return [model['content'] if isinstance(model, dict) else model for model in find_values_in_dict(parameters, 'ckpt_name')]
+
+def get_lora_names(index: WorkflowIndex, prompts: List[str]) -> List[str]:
+    # LoRA loader nodes for ComfyUI, prompt tags for A1111; each name once, in order of appearance
+    names = [name for name in index.all('lora_name') if isinstance(name, str)]
+    for prompt in prompts:
+        names.extend(name.strip() for name in LORA_TAG_PATTERN.findall(prompt))
+    return list(dict.fromkeys(names))
+
+def get_prompt_text(prompts):
+    if prompts:
+        return '\n'.join([prompt.value for prompt in prompts])
+    return ""
+
+def format_metadata(prompt_info: 'PromptInfo', index: Optional[WorkflowIndex] = None):
+    metadata_parts = []
+    if index is None:
+        index = WorkflowQuery(('ckpt_name', 'vae_name')).run(prompt_info.parameters)
+
+    models = [model['content'] if isinstance(model, dict) else model for model in index.all('ckpt_name')]
+    if models:
+        model_text = '\n'.join(models)
+        metadata_parts.append(f"Models:\n{model_text}")
+
+    vaes = index.all('vae_name')
+    if vaes:
+        vae_text = '\n'.join(vaes)
+        metadata_parts.append(f"VAEs:\n{vae_text}")
+
+    if prompt_info.samplers:
+        sampler_names = '\n'.join([sampler.name for sampler in prompt_info.samplers])
+        metadata_parts.append(f"Samplers:\n{sampler_names}")
+        for sampler in prompt_info.samplers:
+            for param, value in sampler.parameters.items():
+                metadata_parts.append(f"{param.title()}: {value}")
+
+    if prompt_info.prompts:
+        prompt_text = '\n'.join([prompt.value for prompt in prompt_info.prompts])
+        metadata_parts.append(f"Prompts:\n{prompt_text}")
+
+    if prompt_info.negative_prompts:
+        negative_prompt_text = '\n'.join([prompt.value for prompt in prompt_info.negative_prompts])
+        metadata_parts.append(f"Negative Prompts:\n{negative_prompt_text}")
 
-    for key, section in metadata.items():
-        if key == 'prompt' and isinstance(section, dict):
-            for subkey, subsection in section.items():
-                if subkey == 'workflow' and isinstance(subsection, dict):
-                    if "nodes" in subsection:
-                        for node in subsection["nodes"]:
-                            if node.get("type") == node_type and node.get("properties", {}).get(node_key) == node_name:
-                                widgets_values = node.get("widgets_values", [])
-                                for widget in widgets_values:
-                                    if isinstance(widget, list):
-                                        text_value = widget[0]
-                                        out_found_names.append(text_value)
-
-        elif isinstance(section, dict):
-            for subkey, subsection in section.items():
-                if subkey == 'workflow' and isinstance(subsection, dict):
-                    if "nodes" in subsection:
-                        for node in subsection["nodes"]:
-                            if node.get("type") == node_type and node.get("properties", {}).get(node_key) == node_name:
-                                widgets_values = node.get("widgets_values", [])
-                                for widget in widgets_values:
-                                    if isinstance(widget, list):
-                                        text_value = widget[0]
-                                        out_found_names.append(text_value)
+    if prompt_info.metadata:
+        additional_metadata = '\n'.join([f"{k}: {v}" for k, v in prompt_info.metadata.items()])
+        metadata_parts.append(f"Additional Metadata:\n{additional_metadata}")
 
+    if prompt_info.parameters:
+        params_text = '\n'.join([f"{k}: {v}" for k, v in prompt_info.parameters.items()])
+        metadata_parts.append(f"Parameters:\n{params_text}")
+
+    return '\n\n'.join(metadata_parts)
+
+def read_comfyui_parameters(parser, png: PngText, node_filters: Sequence[NodeFilter]) -> Optional['PromptInfo']:
+    # ComfyUIParser.read_parameters, keeping only the workflow nodes the filters select. sd_parsers
+    # only uses the workflow's links, and the record only the selected nodes.
+    from sd_parsers import PromptInfo
+    from sd_parsers.exceptions import ParserError
+
+    try:
+        prompt = json.loads(png.text["prompt"])
+        workflow = read_workflow(png.text["workflow"], node_filters)
+    except KeyError:
+        return None
+    except (json.JSONDecodeError, TypeError) as error:
+        raise ParserError("error reading metadata") from error
+    return PromptInfo(parser, {"prompt": prompt, "workflow": workflow})
+
+def parse_png_text(png: PngText, node_filters: Optional[Sequence[NodeFilter]] = None, folder: Optional[str] = None) -> Optional['PromptInfo']:
+    from sd_parsers.exceptions import ParserError
+    from sd_parsers.parsers import ComfyUIParser
+
+    # Same as ParserManager's loop, fed with the text chunks instead of a PIL image, but only
+    # over the parsers whose chunks are present (see parser_dispatch). With node_filters,
+    # ComfyUI workflows are streamed rather than loaded whole (see workflow_stream).
+    registry = metrics.current()
+    parser_manager = get_parser_manager()
+    dispatch = get_dispatch()
+    parsers, guessed = dispatch.candidates(png.text, folder)
+    if guessed:
+        registry.count('parser_folder_guesses')
+    prompt_info = None
+    attempts = 0
+    for parser in parsers:
+        attempts += 1
+        try:
+            if node_filters is not None and isinstance(parser, ComfyUIParser):
+                prompt_info = read_comfyui_parameters(parser, png, node_filters)
+            else:
+                prompt_info = parser.read_parameters(png, True)
+            if prompt_info is None:
+                continue
+            if not parser_manager.lazy_read:
+                prompt_info.parse()
+        except ParserError:
+            prompt_info = None
+            continue
+        dispatch.succeeded(folder, parser)
+        break
+    if attempts:
+        # Hit rate: files read by the first parser tried
+        registry.count('parse_attempts', attempts)
+        registry.count('parser_hits' if prompt_info is not None and attempts == 1 else 'parser_misses')
+    return prompt_info
+
+def read_prompt_info(file_path: str, node_defaults: Optional[Dict[str, str]] = None,
+                     head: Optional[bytes] = None) -> Tuple[Optional['PromptInfo'], int, int]:
+    # The only place an image file is opened for metadata. PNGs are read chunk by chunk and
+    # never decoded; other formats (JPEG/WEBP EXIF) go through PIL and sd_parsers.
+    # node_defaults: only the workflow nodes they select are kept, for building a record
+    # without the formatted dump of the whole workflow. head: the file's first bytes, already
+    # read by png_chunks.read_png_head.
+    registry = metrics.current()
+    start = time.perf_counter()
+    png = read_png_text(file_path) if head is None else read_png_text_from_file(io.BytesIO(head))
+    if png is not None:
+        node_filters = compile_query(node_defaults).node_filters if node_defaults is not None else None
+        folder = os.path.dirname(file_path)
+        parse_start = time.perf_counter()
+        registry.observe('read_chunks', parse_start - start)
+        prompt_info = parse_png_text(png, node_filters, folder) if png.text else None
+        if not prompt_info and has_trailing_chunks(file_path):
+            # Rare: text stored after the image data. Seek over it rather than letting
+            # sd_parsers' second pass (Image.text) decode every pixel.
+            registry.count('trailing_text_reads')
+            png = read_png_text(file_path, include_trailing=True)
+            prompt_info = parse_png_text(png, node_filters, folder) if png.text else None
+        registry.observe('parse', time.perf_counter() - parse_start)
+        return prompt_info, png.width, png.height
+
+    from PIL import Image
+
+    with Image.open(file_path) as img:
+        width, height = img.size
+        parse_start = time.perf_counter()
+        registry.observe('pil_open', parse_start - start)
+        prompt_info = get_parser_manager().parse(img)
+    registry.observe('parse', time.perf_counter() - parse_start)
+    return prompt_info, width, height
+
+def build_record(prompt_info: Optional['PromptInfo'], width: int, height: int, node_defaults: Dict[str, str], formatted: bool = False) -> ImageRecord:
+    if not prompt_info:
+        # Still a valid record, so images without metadata are indexed like any other
+        return ImageRecord(width=width, height=height)
+
+    samplers = list(prompt_info.samplers)
+    sampler_params = samplers[0].parameters if samplers else {}
+    # One walk over the parameters answers every lookup below
+    index = compile_query(node_defaults).run(prompt_info.parameters, prompt_info.metadata)
+
+    def lookup(key: str, *sampler_keys: str) -> Any:
+        # ComfyUI keeps node inputs in the raw parameters; other generators only have sampler parameters
+        value = index.first(key)
+        for sampler_key in (key,) + sampler_keys:
+            if value is not None:
+                break
+            value = sampler_params.get(sampler_key)
+        return value
+
+    models = [model['content'] if isinstance(model, dict) else model for model in index.all('ckpt_name')]
+    models = models or sorted({str(model.name) for model in prompt_info.models if model.name})
+    prompts = sorted(prompt.value for prompt in prompt_info.prompts)
+
+    return ImageRecord(
+        generator=prompt_info.generator.value,
+        prompts=prompts,
+        negative_prompts=sorted(prompt.value for prompt in prompt_info.negative_prompts),
+        models=models,
+        vaes=index.all('vae_name'),
+        loras=get_lora_names(index, prompts + index.texts),
+        sampler=index.first('sampler_name') or (samplers[0].name if samplers else None),
+        seed=lookup('seed', 'noise_seed'),
+        steps=lookup('steps'),
+        cfg=lookup('cfg', 'cfg_scale'),
+        scheduler=lookup('scheduler'),
+        denoise=lookup('denoise'),
+        clip_skip=lookup('clip', 'clip_skip'),
+        width=width,
+        height=height,
+        node_texts=index.texts,
+        formatted_metadata=format_metadata(prompt_info, index) if formatted else ""
+    )
+
+def extract_record(file_path: str, node_defaults: Dict[str, str] = DEFAULT_NODE_DEFAULTS, formatted: bool = False,
+                   head: Optional[bytes] = None) -> ImageRecord:
+    try:
+        # The formatted dump lists the whole workflow; a record alone only needs the selected nodes
+        prompt_info, width, height = read_prompt_info(file_path, None if formatted else node_defaults, head)
+        with metrics.current().timed('record'):
+            return build_record(prompt_info, width, height, node_defaults, formatted)
+    except Exception as e:
+        raise ValueError(f"Error extracting metadata: {e}")
+
+def find_node_texts(metadata: Dict[str, Any], node_defaults: Dict[str, str] = DEFAULT_NODE_DEFAULTS) -> List[str]:
+    return node_texts(iter_workflow_nodes(metadata), compile_node_filters(node_defaults))
+
+def find_particular_keywords(metadata: Dict[str, Any], keywords: List[str], node_type: str = "ShowText|pysssss", node_key: str = "Node name for S&R", node_name: str = "ShowText|pysssss") -> List[str]:
+    out_found_names = []
+    for text_value in get_workflow_node_data(metadata, node_type, node_key, node_name):
+        for keyword in keywords:
+            if keyword.lower() in text_value.lower():
+                out_found_names.append(keyword)
     return out_found_names
+
+def get_workflow_node_data(metadata: Dict[str, Any], node_type: str = "ShowText|pysssss", node_key: str = "Node name for S&R", node_name: str = "ShowText|pysssss") -> List[str]:
+    return find_node_texts(metadata, {"node_type": node_type, "node_key": node_key, "node_name": node_name})
@@ -0,0 +1,330 @@
+import os
+import json
+import hashlib
+import time
+import logging
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from scripts import metrics
+from scripts.config import index_path_for
+from scripts.metadata_extractor import ImageRecord, extract_record
+from scripts.read_ahead import FileHead, read_head
+
+# The index lives next to data/config.json
+INDEX_FILE = index_path_for()
+
+# Bump when the shape of the stored records changes; older indexes are rebuilt
+SCHEMA_VERSION = 4
+
+# Bytes read from the start and the end of a file for the cheap content hash
+HASH_BLOCK_SIZE = 64 * 1024
+
+# Number of writes buffered before the mover commits them
+COMMIT_EVERY = 500
+
+IndexEntry = Tuple[str, int, int, str, str, ImageRecord]
+
+# Record fields copied into their own columns for the gallery search (see gallery_search)
+SEARCH_COLUMNS = ('model', 'sampler', 'seed', 'cfg', 'prompt', 'models', 'loras')
+
+
+def content_hash(file_path: str, size: int) -> str:
+    # Hash of the size plus the first and last blocks of the file. PNG text chunks
+    # usually sit at the start, so two different generations almost never collide,
+    # and the cost is two small reads no matter how large the image is.
+    with open(file_path, 'rb') as f:
+        first = f.read(HASH_BLOCK_SIZE)
+        last = None
+        if size > 2 * HASH_BLOCK_SIZE:
+            f.seek(-HASH_BLOCK_SIZE, os.SEEK_END)
+            last = f.read(HASH_BLOCK_SIZE)
+    return hash_blocks(size, first, last)
+
+
+def hash_blocks(size: int, first: bytes, last: Optional[bytes]) -> str:
+    # content_hash of blocks read elsewhere, e.g. by read-ahead
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    digest.update(first[:HASH_BLOCK_SIZE])
+    if size > 2 * HASH_BLOCK_SIZE:
+        digest.update(last)
+    return digest.hexdigest()
+
+
+def _number(value, kind):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def search_values(record: ImageRecord) -> Tuple[Any, ...]:
+    return (
+        record.models[0] if record.models else None,
+        record.sampler,
+        _number(record.seed, int),
+        _number(record.cfg, float),
+        '\n'.join(record.node_texts + record.prompts),
+        '\n'.join(record.models),
+        '\n'.join(record.loras)
+    )
+
+
+def node_filter_key(node_defaults: Dict[str, str]) -> str:
+    # Records hold the ShowText values picked out by node_defaults, so they are only
+    # valid for the filter they were extracted with
+    return json.dumps(node_defaults, sort_keys=True)
+
+
+class MetadataIndex:
+    def __init__(self, db_path: str = INDEX_FILE, readonly: bool = False):
+        self.db_path = db_path
+        self.readonly = readonly
+        self.pending_writes = 0
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self.conn = sqlite3.connect(db_path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            # REPLACE deletes the old row; the full text triggers have to see that
+            self.conn.execute("PRAGMA recursive_triggers=ON")
+            self.create_schema()
+
+    def create_schema(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS perceptual_hashes")
+            self.conn.execute("DROP TABLE IF EXISTS images_fts")
+            self.conn.execute("DROP TABLE IF EXISTS images")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                node_filter TEXT NOT NULL,
+                record TEXT NOT NULL,
+                model TEXT,
+                sampler TEXT,
+                seed INTEGER,
+                cfg REAL,
+                prompt TEXT NOT NULL DEFAULT '',
+                models TEXT NOT NULL DEFAULT '',
+                loras TEXT NOT NULL DEFAULT '',
+                -- "characters/Alice Smith", set by the organizer
+                category TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS images_by_content ON images (size, content_hash)")
+        for column in ('model', 'sampler', 'seed', 'cfg', 'category'):
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS images_by_{column} ON images ({column})")
+        # Trigram tokens make every substring of 3+ characters an index lookup
+        self.conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+                prompt, models, loras, content='images', content_rowid='rowid', tokenize='trigram'
+            )
+        """)
+        self.conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images BEGIN
+                INSERT INTO images_fts (rowid, prompt, models, loras) VALUES (new.rowid, new.prompt, new.models, new.loras);
+            END;
+            CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images BEGIN
+                INSERT INTO images_fts (images_fts, rowid, prompt, models, loras) VALUES ('delete', old.rowid, old.prompt, old.models, old.loras);
+            END;
+            CREATE TRIGGER IF NOT EXISTS images_fts_update AFTER UPDATE OF prompt, models, loras ON images BEGIN
+                INSERT INTO images_fts (images_fts, rowid, prompt, models, loras) VALUES ('delete', old.rowid, old.prompt, old.models, old.loras);
+                INSERT INTO images_fts (rowid, prompt, models, loras) VALUES (new.rowid, new.prompt, new.models, new.loras);
+            END;
+        """)
+        # Filled by dedupe, independently of the metadata records
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS perceptual_hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                dhash INTEGER NOT NULL
+            )
+        """)
+        # Directories the scanner found nothing left to do in, by the settings of the scan;
+        # subdirs is a JSON list of names, so unchanged directories need not be listed again
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS scanned_dirs (
+                path TEXT NOT NULL,
+                scan_key TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                subdirs TEXT NOT NULL,
+                PRIMARY KEY (path, scan_key)
+            )
+        """)
+        self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def get(self, file_path: str, size: int, mtime_ns: int, node_filter: str) -> Optional[ImageRecord]:
+        row = self.conn.execute(
+            "SELECT record FROM images WHERE path = ? AND size = ? AND mtime_ns = ? AND node_filter = ?",
+            (os.path.abspath(file_path), size, mtime_ns, node_filter)
+        ).fetchone()
+        return ImageRecord.from_dict(json.loads(row[0])) if row else None
+
+    def find_by_content(self, size: int, digest: str, node_filter: str) -> Optional[ImageRecord]:
+        # Used for files that were moved or copied: same bytes under a path we haven't seen
+        row = self.conn.execute(
+            "SELECT record FROM images WHERE size = ? AND content_hash = ? AND node_filter = ? LIMIT 1",
+            (size, digest, node_filter)
+        ).fetchone()
+        return ImageRecord.from_dict(json.loads(row[0])) if row else None
+
+    def put(self, entry: IndexEntry):
+        self.put_many([entry])
+
+    def put_many(self, entries: Iterable[IndexEntry]):
+        # A rewritten entry keeps the category the organizer gave it
+        rows = [
+            (os.path.abspath(path), size, mtime_ns, digest, node_filter, json.dumps(record.to_dict())) + search_values(record)
+            for path, size, mtime_ns, digest, node_filter, record in entries
+        ]
+        self.conn.executemany(f"""
+            INSERT INTO images (path, size, mtime_ns, content_hash, node_filter, record, {', '.join(SEARCH_COLUMNS)})
+            VALUES ({', '.join('?' * (6 + len(SEARCH_COLUMNS)))})
+            ON CONFLICT (path) DO UPDATE SET
+                size = excluded.size, mtime_ns = excluded.mtime_ns, content_hash = excluded.content_hash,
+                node_filter = excluded.node_filter, record = excluded.record,
+                {', '.join(f'{column} = excluded.{column}' for column in SEARCH_COLUMNS)}
+        """, rows)
+        self._wrote(len(rows))
+
+    def set_category(self, file_path: str, category: Optional[str]):
+        self.conn.execute(
+            "UPDATE images SET category = ? WHERE path = ? AND category IS NOT ?",
+            (category, os.path.abspath(file_path), category)
+        )
+        self._wrote(1)
+
+    def get_dhash(self, file_path: str, size: int, mtime_ns: int) -> Optional[int]:
+        # Stored signed, as SQLite integers are; see dedupe
+        row = self.conn.execute(
+            "SELECT dhash FROM perceptual_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (os.path.abspath(file_path), size, mtime_ns)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put_dhashes(self, rows: Iterable[Tuple[str, int, int, int]]):
+        rows = [(os.path.abspath(path), size, mtime_ns, dhash) for path, size, mtime_ns, dhash in rows]
+        self.conn.executemany("INSERT OR REPLACE INTO perceptual_hashes VALUES (?, ?, ?, ?)", rows)
+        self._wrote(len(rows))
+
+    def get_scanned_dirs(self, scan_key: str) -> Dict[str, Tuple[int, List[str]]]:
+        return {path: (mtime_ns, json.loads(subdirs)) for path, mtime_ns, subdirs in self.conn.execute(
+            "SELECT path, mtime_ns, subdirs FROM scanned_dirs WHERE scan_key = ?", (scan_key,))}
+
+    def put_scanned_dirs(self, scan_key: str, rows: Iterable[Tuple[str, int, List[str]]]):
+        rows = [(path, scan_key, mtime_ns, json.dumps(subdirs)) for path, mtime_ns, subdirs in rows]
+        self.conn.executemany("INSERT OR REPLACE INTO scanned_dirs VALUES (?, ?, ?, ?)", rows)
+        self._wrote(len(rows))
+
+    def move(self, old_path: str, new_path: str):
+        for table in ('images', 'perceptual_hashes'):
+            self.conn.execute(
+                f"UPDATE OR REPLACE {table} SET path = ? WHERE path = ?",
+                (os.path.abspath(new_path), os.path.abspath(old_path))
+            )
+        self._wrote(1)
+
+    def merge(self, other_path: str) -> int:
+        # Copies the entries of another index into this one, e.g. those a sharded organize
+        # worker wrote; its rows replace this index's for the same paths. Returns the images merged.
+        self.commit()
+        self.conn.execute("ATTACH DATABASE ? AS other", (other_path,))
+        try:
+            version = self.conn.execute("PRAGMA other.user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                logging.warning("Not merging " + other_path + ": written by another version")
+                return 0
+            columns = ', '.join(('path', 'size', 'mtime_ns', 'content_hash', 'node_filter', 'record') + SEARCH_COLUMNS + ('category',))
+            merged = self.conn.execute(f"INSERT OR REPLACE INTO images ({columns}) SELECT {columns} FROM other.images").rowcount
+            self.conn.execute("INSERT OR REPLACE INTO perceptual_hashes SELECT path, size, mtime_ns, dhash FROM other.perceptual_hashes")
+            self.conn.commit()
+            return merged
+        finally:
+            self.conn.execute("DETACH DATABASE other")
+
+    def prune(self, under: Optional[str] = None) -> int:
+        # Drop entries whose files no longer exist; with under, only those in that directory
+        removed = 0
+        prefix = os.path.join(os.path.abspath(under), '') if under else ''
+        for table in ('images', 'perceptual_hashes', 'scanned_dirs'):
+            missing = [(path,) for (path,) in self.conn.execute(f"SELECT DISTINCT path FROM {table} WHERE substr(path, 1, ?) = ?",
+                                                                  (len(prefix), prefix))
+                       if not os.path.exists(path)]
+            self.conn.executemany(f"DELETE FROM {table} WHERE path = ?", missing)
+            removed += len(missing)
+        self.conn.commit()
+        return removed
+
+    def _wrote(self, count: int):
+        self.pending_writes += count
+        if self.pending_writes >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending_writes = 0
+
+    def close(self):
+        if not self.readonly:
+            self.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def fetch_head(index: Optional[MetadataIndex], file_path: str, node_filter: str) -> FileHead:
+    # The I/O half of lookup_or_extract, run ahead on a read-ahead thread with a connection of
+    # its own: the index lookup, or the bytes the hash and the parse need
+    if index is None:
+        return FileHead(data=read_head(file_path)[0])
+    st = os.stat(file_path)
+    record = index.get(file_path, st.st_size, st.st_mtime_ns, node_filter)
+    if record is not None:
+        return FileHead(st.st_size, st.st_mtime_ns, record)
+    data, tail = read_head(file_path, st.st_size, HASH_BLOCK_SIZE, HASH_BLOCK_SIZE)
+    return FileHead(st.st_size, st.st_mtime_ns, None, data, tail)
+
+
+def lookup_or_extract(index: Optional[MetadataIndex], file_path: str, node_defaults: Dict[str, str],
+                      head: Optional[FileHead] = None) -> Tuple[ImageRecord, Optional[IndexEntry]]:
+    # Returns the record for file_path and, when the index needs updating, the entry to write.
+    # Unchanged files are answered from the index without opening the image. head is what
+    # fetch_head read ahead for the file, if it was.
+    data = head.data if head else None
+    if index is None:
+        return extract_record(file_path, node_defaults, head=data), None
+
+    registry = metrics.current()
+    start = time.perf_counter()
+    node_filter = node_filter_key(node_defaults)
+    if head is None:
+        st = os.stat(file_path)
+        size, mtime_ns = st.st_size, st.st_mtime_ns
+        record = index.get(file_path, size, mtime_ns, node_filter)
+    else:
+        size, mtime_ns, record = head.size, head.mtime_ns, head.record
+    if record is not None:
+        registry.observe('index_lookup', time.perf_counter() - start)
+        registry.count('index_hits')
+        return record, None
+
+    digest = content_hash(file_path, size) if head is None else hash_blocks(size, head.data, head.tail)
+    record = index.find_by_content(size, digest, node_filter)
+    registry.observe('index_lookup', time.perf_counter() - start)
+    if record is None:
+        record = extract_record(file_path, node_defaults, head=data)
+    else:
+        # Same image under another name, e.g. moved by something else
+        registry.count('index_content_hits')
+    return record, (file_path, size, mtime_ns, digest, node_filter, record)
@@ -0,0 +1,313 @@
+import os
+import sys
+import time
+import json
+import bisect
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Timers and counters for organize runs. Each process records into its own registry (current());
+# pool workers hand theirs back with every batch (see pipeline.measured_batch), so the registry of
+# the main process ends up covering the whole run. Read it as a run summary, as JSON, or in
+# Prometheus text format from the watch mode metrics endpoint.
+#
+# Stages, each a histogram of seconds per file:
+#   walk             finding the next PNG in the input tree
+#   index_lookup     answering a file from the metadata index (stat + lookup, hash on a miss)
+#   read_chunks      reading the PNG text chunks
+#   pil_open         opening non-PNG images with PIL
+#   parse            sd_parsers on the text chunks
+#   record           building the ImageRecord from the parsed parameters
+#   match            evaluating the rules
+#   file             the whole of the above for one file, in the worker
+#   io_wait          the part of file not spent on the worker's CPU: waiting for the disk or share
+#   move             moving, copying or linking one file into place
+#   extract_metadata MetadataParser.extract_metadata, as used by the GUI
+#
+# parser_hits and parser_misses count the PNGs read by the first sd_parsers parser tried, or not;
+# parse_attempts counts the parsers tried (see parser_dispatch).
+
+# Upper bounds in seconds, from 10 us to 10 s
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_PREFIX = 'sd_organizer'
+
+# Example paths kept per distinct error
+ERROR_EXAMPLES = 3
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: 'Histogram'):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        # Interpolated within the bucket, like Prometheus' histogram_quantile
+        count = self.count
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / bucket_count)
+            seen += bucket_count
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        count = self.count
+        return {
+            'count': count,
+            'total_s': round(self.total, 6),
+            'mean_ms': round(self.total / count * 1000, 4) if count else 0.0,
+            'p50_ms': round(self.quantile(0.5) * 1000, 4),
+            'p95_ms': round(self.quantile(0.95) * 1000, 4),
+            'p99_ms': round(self.quantile(0.99) * 1000, 4),
+            'max_ms': round(self.max * 1000, 4),
+            'buckets': self.counts
+        }
+
+
+class Timer:
+    # with metrics.timed('stage'): ...
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics: 'Metrics', stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.stages: Dict[str, Histogram] = {}
+            self.counters: Dict[str, int] = {}
+            # (stage, message) -> [count, example paths]
+            self.errors: Dict[Tuple[str, str], List[Any]] = {}
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def timed(self, stage: str) -> Timer:
+        return Timer(self, stage)
+
+    def timed_iter(self, stage: str, items: Iterable[Any]) -> Iterator[Any]:
+        # Times how long each item takes to produce, e.g. the next file of a directory walk
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(stage, time.perf_counter() - start)
+            yield item
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def error(self, stage: str, message: str, path: Optional[str] = None):
+        # Errors are grouped by message, so a thousand unreadable files are one line of the summary
+        if path:
+            message = message.replace(path, '<file>')
+        with self.lock:
+            self.counters['errors'] = self.counters.get('errors', 0) + 1
+            entry = self.errors.setdefault((stage, message), [0, []])
+            entry[0] += 1
+            if path and len(entry[1]) < ERROR_EXAMPLES:
+                entry[1].append(path)
+
+    def drain(self) -> Dict[str, Any]:
+        # Everything recorded so far, for merging into another process's registry; starts afresh
+        with self.lock:
+            data = {'stages': self.stages, 'counters': self.counters, 'errors': self.errors}
+            self.stages, self.counters, self.errors = {}, {}, {}
+        return data
+
+    def merge(self, data: Dict[str, Any]):
+        with self.lock:
+            for stage, histogram in data['stages'].items():
+                if stage in self.stages:
+                    self.stages[stage].merge(histogram)
+                else:
+                    self.stages[stage] = histogram
+            for name, amount in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+            for key, (count, examples) in data['errors'].items():
+                entry = self.errors.setdefault(key, [0, []])
+                entry[0] += count
+                entry[1].extend(examples[:ERROR_EXAMPLES - len(entry[1])])
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'elapsed_s': round(time.time() - self.started, 3),
+                'stages': {stage: histogram.to_dict() for stage, histogram in self.stages.items()},
+                'counters': dict(self.counters),
+                'errors': [{'stage': stage, 'message': message, 'count': count, 'examples': examples}
+                           for (stage, message), (count, examples) in sorted(self.errors.items(), key=lambda item: -item[1][0])]
+            }
+
+    def summary(self) -> str:
+        data = self.to_dict()
+        lines = [f"Run summary ({data['elapsed_s']:.1f} s)",
+                 f"  {'stage':<17} {'files':>8} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+        for stage, s in data['stages'].items():
+            lines.append(f"  {stage:<17} {s['count']:>8} {s['total_s']:>9.2f} {s['mean_ms']:>9.3f} {s['p50_ms']:>9.3f} {s['p95_ms']:>9.3f} {s['max_ms']:>9.3f}")
+        if data['counters']:
+            lines.append("  " + ", ".join(f"{name.replace('_', ' ')}: {count}" for name, count in sorted(data['counters'].items())))
+        file_stage, io_wait = data['stages'].get('file'), data['stages'].get('io_wait')
+        if file_stage and io_wait and file_stage['total_s']:
+            waited = min(io_wait['total_s'], file_stage['total_s'])
+            lines.append(f"  I/O wait: {waited:.2f} s, CPU: {file_stage['total_s'] - waited:.2f} s "
+                         f"({waited / file_stage['total_s']:.0%} of the time per file spent waiting)")
+        parsed = data['counters'].get('parser_hits', 0) + data['counters'].get('parser_misses', 0)
+        if parsed:
+            lines.append(f"  parser hit rate: {data['counters'].get('parser_hits', 0) / parsed:.1%} of {parsed} files")
+        if data['errors']:
+            lines.append("  Errors:")
+            for error in data['errors']:
+                examples = (" (" + ", ".join(error['examples']) + (", ..." if error['count'] > len(error['examples']) else "") + ")"
+                            if error['examples'] else "")
+                lines.append(f"  {error['count']:>6} x {error['stage']}: {error['message']}{examples}")
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        # Text exposition format 0.0.4
+        prefix = PROMETHEUS_PREFIX
+        with self.lock:
+            lines = [f"# HELP {prefix}_stage_seconds Time per file in each stage of organizing",
+                     f"# TYPE {prefix}_stage_seconds histogram"]
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+            for name, count in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {count}")
+            lines.append(f"# TYPE {prefix}_start_time_seconds gauge")
+            lines.append(f"{prefix}_start_time_seconds {self.started}")
+        return "\n".join(lines) + "\n"
+
+
+_current = Metrics()
+
+
+def current() -> Metrics:
+    return _current
+
+
+def serve_metrics(port: int, host: str = '127.0.0.1', metrics: Optional[Metrics] = None):
+    # Prometheus endpoint at http://host:port/metrics on a daemon thread; call shutdown() on the
+    # returned server to stop it. Local only unless host says otherwise.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    metrics = metrics or _current
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scraped every few seconds; not worth a log line each time
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+class Profiler:
+    # cProfile, or pyinstrument when the output file ends in .html and it is installed.
+    # Only the main process is profiled; with --workers 1 that includes the parsing.
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.profiler = None
+
+    def __enter__(self):
+        if self.output_path.endswith('.html'):
+            try:
+                from pyinstrument import Profiler as Pyinstrument
+                self.profiler = Pyinstrument()
+            except ImportError:
+                print("pyinstrument is not installed, using cProfile (pip install pyinstrument)", file=sys.stderr)
+        if self.profiler is None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler.start()
+        return self
+
+    def __exit__(self, *exc):
+        if hasattr(self.profiler, 'output_html'):
+            self.profiler.stop()
+            with open(self.output_path, 'w', encoding='utf-8') as f:
+                f.write(self.profiler.output_html())
+            print("Profile written to " + self.output_path, file=sys.stderr)
+            return False
+
+        import pstats
+        self.profiler.disable()
+        output_path = self.output_path
+        if output_path.endswith('.html'):
+            output_path = os.path.splitext(output_path)[0] + '.prof'
+        self.profiler.dump_stats(output_path)
+        pstats.Stats(self.profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(20)
+        print("Profile written to " + output_path + " (view with: python -m pstats " + output_path + ")", file=sys.stderr)
+        return False
+
+
+def write_json(metrics: Metrics, output_path: str):
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(metrics.to_dict(), f, indent=2)
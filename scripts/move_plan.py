@@ -0,0 +1,337 @@
+import os
+import json
+import filecmp
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, List, Optional, Set, Tuple
+from scripts import metrics
+from scripts.config import CONFIG_FILE, data_file_for
+from scripts.name_allocator import NameAllocator
+from scripts.placement import PLACED, PLACERS, is_placed, move_no_clobber
+
+# Two-phase organizing: every destination is resolved in memory first, then the moves are
+# applied in one pass. The apply pass keeps a journal so an interrupted run can be resumed
+# or rolled back.
+
+# The journal lives next to data/config.json while a run is being applied
+JOURNAL_FILE = data_file_for(CONFIG_FILE, 'organize_journal.jsonl')
+# Watch mode keeps its own, so it can run alongside an organize run
+WATCH_JOURNAL_FILE = data_file_for(CONFIG_FILE, 'watch_journal.jsonl')
+
+# Completed moves are fsynced to the journal in batches of this size. A crash can lose at most
+# one batch of "done" lines; resume and rollback recover those from the filesystem.
+JOURNAL_SYNC_EVERY = 256
+
+OnMoved = Callable[[str, str], None]
+
+
+@dataclass(slots=True)
+class PlannedMove:
+    source: str
+    dest: str
+    # 'move', or 'copy', 'hardlink' or 'symlink' for the extra destinations of a rule
+    mode: str = 'move'
+
+
+class MovePlan:
+    def __init__(self, allocator: Optional[NameAllocator] = None):
+        self.moves: List[PlannedMove] = []
+        # Each target directory is listed once, however many files go there. Watch mode passes
+        # one allocator for all its batches.
+        self.allocator = allocator or NameAllocator()
+        self.directories: Set[str] = set()
+
+    def __len__(self):
+        return len(self.moves)
+
+    def add(self, source: str, directory: str, mode: str = 'move', name: Optional[str] = None) -> str:
+        # Taken names are numbered: name.png, name(1).png, name(2).png, ...
+        name = name or os.path.basename(source)
+        if mode != 'move':
+            # Copied or linked there by an earlier run, under its name or, after a collision, a
+            # numbered one; originals stay put, so they come round again
+            for placed in self.allocator.in_use(directory, name):
+                if is_placed(source, placed, mode):
+                    return placed
+        dest = self.allocator.allocate(directory, name)
+        self.directories.add(directory)
+        self.moves.append(PlannedMove(source, dest, mode))
+        return dest
+
+    def print(self):
+        for move in self.moves:
+            print("Would " + ('place' if move.mode == 'auto' else move.mode) + " " + move.source + " to " + move.dest)
+        verb = "moved" if all(move.mode == 'move' for move in self.moves) else "placed"
+        print(str(len(self.moves)) + " files would be " + verb + " into " + str(len(self.directories)) + " directories")
+
+
+class MoveJournal:
+    # JSON lines: the whole plan as {"move": [source, dest]} lines (with "mode" for copies and
+    # links), written and fsynced before anything is moved, followed by {"done": i} as moves complete. A move whose name was taken
+    # by another process in the meantime is recorded as {"done": i, "dest": new_dest}.
+    def __init__(self, journal_path: str = JOURNAL_FILE):
+        self.journal_path = journal_path
+        self.file = None
+        self.unsynced = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.journal_path)
+
+    def begin(self, moves: List[PlannedMove]):
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for move in moves:
+                item = {'move': [move.source, move.dest]}
+                if move.mode != 'move':
+                    item['mode'] = move.mode
+                f.write(json.dumps(item) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        self.file = open(self.journal_path, 'a', encoding='utf-8')
+
+    def reopen(self):
+        self.file = open(self.journal_path, 'a', encoding='utf-8')
+
+    def load(self) -> Tuple[List[PlannedMove], Set[int]]:
+        moves, done = [], set()
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    break  # Torn last line from a crash
+                if 'move' in item:
+                    moves.append(PlannedMove(*item['move'], item.get('mode', 'move')))
+                else:
+                    done.add(item['done'])
+                    if 'dest' in item:
+                        planned_dest = moves[item['done']].dest
+                        moves[item['done']].dest = item['dest']
+                        # Copies and links of the image are made from where it ended up
+                        for later in moves[item['done'] + 1:]:
+                            if later.source == planned_dest:
+                                later.source = item['dest']
+        return moves, done
+
+    def mark_done(self, index: int, dest: Optional[str] = None):
+        self.file.write(json.dumps({'done': index, 'dest': dest} if dest else {'done': index}) + '\n')
+        self.unsynced += 1
+        if self.unsynced >= JOURNAL_SYNC_EVERY:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def finish(self):
+        # The run is complete, nothing left to resume
+        self.file.close()
+        self.file = None
+        os.remove(self.journal_path)
+
+    def close(self):
+        if self.file:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+def _place(move: PlannedMove, allocator: NameAllocator) -> bool:
+    # Copies and links leave the source where it is, so a taken dest may be this very placement
+    while True:
+        try:
+            PLACERS[move.mode](move.source, move.dest)
+            return True
+        except FileExistsError:
+            if is_placed(move.source, move.dest, move.mode):
+                return False  # The journal line was lost
+            allocator.reserve(move.dest)
+            move.dest = allocator.allocate(os.path.dirname(move.dest), os.path.basename(move.source))
+
+
+def _move(move: PlannedMove, allocator: NameAllocator) -> bool:
+    # Moves without ever replacing a file; returns False if the move had already been made
+    # before an interrupted run stopped
+    if move.mode != 'move':
+        return _place(move, allocator)
+    while True:
+        try:
+            move_no_clobber(move.source, move.dest)
+            return True
+        except FileNotFoundError:
+            if os.path.exists(move.dest):
+                return False  # The journal line was lost
+            raise
+        except FileExistsError:
+            if os.path.exists(move.source) and (os.path.samefile(move.source, move.dest) or (
+                    is_placed(move.source, move.dest, 'copy') and filecmp.cmp(move.source, move.dest, shallow=False))):
+                # Interrupted between linking (or copying to another volume) and unlinking the source
+                os.unlink(move.source)
+                return False
+            # Another process took the name after the directory was listed
+            allocator.reserve(move.dest)
+            move.dest = allocator.allocate(os.path.dirname(move.dest), os.path.basename(move.source))
+
+
+def _attempt(move: PlannedMove, allocator: NameAllocator) -> Tuple[bool, Optional[OSError], float]:
+    # (made, error, seconds); with io_depth above 1 this runs on the move threads
+    start = time.perf_counter()
+    try:
+        return _move(move, allocator), None, time.perf_counter() - start
+    except OSError as e:
+        return False, e, time.perf_counter() - start
+
+
+def _apply_moves(moves: List[PlannedMove], done: Set[int], journal: MoveJournal, allocator: NameAllocator,
+                 on_moved: Optional[OnMoved], cancel: Optional[threading.Event] = None,
+                 on_placed: Optional[OnMoved] = None, io_depth: int = 1) -> int:
+    # Up to io_depth moves are made at once, each on a thread of its own; the journal, the
+    # callbacks and the output still follow the plan's order
+    directories = {os.path.dirname(moves[i].dest) for i in range(len(moves)) if i not in done}
+    executor = ThreadPoolExecutor(max_workers=io_depth, thread_name_prefix='move') if io_depth > 1 else None
+    if executor:
+        list(executor.map(lambda directory: os.makedirs(directory, exist_ok=True), directories))
+    else:
+        for directory in directories:
+            os.makedirs(directory, exist_ok=True)
+
+    registry = metrics.current()
+    moved = 0
+    # Copies and links of a moved image are made from where it ended up
+    renamed = {}
+    # (index, move, planned dest, outcome or its future), in plan order
+    pending: Deque[Tuple[int, PlannedMove, str, Any]] = deque()
+    in_flight: Set[str] = set()
+
+    def finish():
+        nonlocal moved
+        i, move, planned_dest, outcome = pending.popleft()
+        in_flight.discard(planned_dest)
+        made, error, seconds = outcome.result() if executor else outcome
+        if isinstance(error, FileNotFoundError):
+            logging.error("Cannot " + ("place" if move.mode == 'auto' else move.mode) + " " + move.source + ": file no longer exists")
+            registry.error('move', "File no longer exists", move.source)
+            return
+        if error:
+            logging.error("Error " + ("moving" if move.mode == 'move' else "placing") + " file " + move.source + ": " + str(error))
+            registry.error('move', str(error), move.source)
+            return
+        if made:
+            registry.observe('move', seconds)
+            registry.count('files_' + PLACED[move.mode].lower())
+            print(PLACED[move.mode] + " " + move.source + " to " + move.dest)
+            moved += 1
+        journal.mark_done(i, move.dest if move.dest != planned_dest else None)
+        if move.mode != 'move':
+            if on_placed:
+                on_placed(move.source, move.dest)
+            return
+        if move.dest != planned_dest:
+            renamed[planned_dest] = move.dest
+        if on_moved:
+            on_moved(move.source, move.dest)
+
+    try:
+        for i, move in enumerate(moves):
+            if cancel is not None and cancel.is_set():
+                # Stop between files; the moves not made yet are simply dropped from the run
+                break
+            if i in done:
+                continue
+            # A copy of an image still being moved waits for the move
+            while move.source in in_flight:
+                finish()
+            move.source = renamed.get(move.source, move.source)
+            if executor:
+                pending.append((i, move, move.dest, executor.submit(_attempt, move, allocator)))
+                in_flight.add(move.dest)
+                if len(pending) > io_depth:
+                    finish()
+            else:
+                pending.append((i, move, move.dest, _attempt(move, allocator)))
+                finish()
+        while pending:
+            finish()
+    finally:
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+    return moved
+
+
+def apply_plan(plan: MovePlan, journal_path: str = JOURNAL_FILE, on_moved: Optional[OnMoved] = None,
+               cancel: Optional[threading.Event] = None, on_placed: Optional[OnMoved] = None, io_depth: int = 1) -> int:
+    # Returns the number of files moved, copied or linked. on_moved(source, dest) is called
+    # after each move, on_placed(source, dest) after each copy or link. io_depth moves are
+    # made at once, for output folders on a network share.
+    if not plan.moves:
+        return 0
+    journal = MoveJournal(journal_path)
+    if journal.exists():
+        raise RuntimeError("An interrupted organize run must be resumed or rolled back first (" + journal_path + ")")
+    journal.begin(plan.moves)
+    try:
+        moved = _apply_moves(plan.moves, set(), journal, plan.allocator, on_moved, cancel, on_placed, io_depth)
+    except BaseException:
+        journal.close()
+        raise
+    journal.finish()
+    return moved
+
+
+def resume_moves(journal_path: str = JOURNAL_FILE, on_moved: Optional[OnMoved] = None) -> int:
+    # Finish the moves of an interrupted run. Returns the number of files moved.
+    journal = MoveJournal(journal_path)
+    if not journal.exists():
+        return 0
+    moves, done = journal.load()
+    journal.reopen()
+    try:
+        moved = _apply_moves(moves, done, journal, NameAllocator(), on_moved)
+    except BaseException:
+        journal.close()
+        raise
+    journal.finish()
+    return moved
+
+
+def rollback_moves(journal_path: str = JOURNAL_FILE, on_moved: Optional[OnMoved] = None) -> int:
+    # Put the files of an interrupted run back where they came from, newest first.
+    # Returns the number of files restored.
+    journal = MoveJournal(journal_path)
+    if not journal.exists():
+        return 0
+    moves, _ = journal.load()
+    restored = 0
+    for move in reversed(moves):
+        if move.mode != 'move':
+            # Copies and links go; the image they were made from is restored by its own move
+            if is_placed(move.source, move.dest, move.mode):
+                os.remove(move.dest)
+                print("Removed " + move.dest)
+            continue
+        # Decided from the filesystem rather than the "done" lines, which may lag behind by a batch
+        if not os.path.exists(move.dest):
+            continue
+        if os.path.exists(move.source):
+            if os.path.samefile(move.source, move.dest):
+                os.unlink(move.dest)  # Interrupted halfway through the move
+            continue
+        try:
+            os.makedirs(os.path.dirname(move.source), exist_ok=True)
+            move_no_clobber(move.dest, move.source)
+        except OSError as e:
+            logging.error("Error restoring file " + move.dest + ": " + str(e))
+            continue
+        print("Restored " + move.dest + " to " + move.source)
+        restored += 1
+        if on_moved:
+            on_moved(move.dest, move.source)
+    os.remove(journal_path)
+    return restored
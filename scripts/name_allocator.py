@@ -0,0 +1,84 @@
+import os
+import re
+import threading
+from typing import Dict, List, Set, Tuple
+
+# Collision-free destination names without probing the filesystem. Each destination directory
+# is listed once; after that a colliding name costs a dictionary lookup, however many
+# name(1).png, name(2).png, ... the directory already holds.
+
+# "name(12)" -> ("name", 12), the numbering organizing has always used
+COUNTER_PATTERN = re.compile(r'^(.*)\((\d+)\)$')
+
+
+class DirectoryNames:
+    def __init__(self, directory: str):
+        self.names: Set[str] = set()
+        # (base, extension) -> highest counter in use for it
+        self.highest: Dict[Tuple[str, str], int] = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    self.add(entry.name)
+        except FileNotFoundError:
+            pass
+
+    def add(self, name: str):
+        self.names.add(name)
+        stem, ext = os.path.splitext(name)
+        match = COUNTER_PATTERN.match(stem)
+        if match:
+            key = (match.group(1), ext)
+            counter = int(match.group(2))
+            if counter > self.highest.get(key, 0):
+                self.highest[key] = counter
+
+    def allocate(self, name: str) -> str:
+        if name in self.names:
+            base, ext = os.path.splitext(name)
+            counter = self.highest.get((base, ext), 0) + 1
+            name = base + "(" + str(counter) + ")" + ext
+            while name in self.names:
+                # Only when a file was literally named like a numbered copy of another base
+                counter += 1
+                name = base + "(" + str(counter) + ")" + ext
+        self.add(name)
+        return name
+
+    def numbered(self, name: str) -> List[str]:
+        # name and its numbered copies name(1), name(2), ... that are in use
+        base, ext = os.path.splitext(name)
+        candidates = [name] + [base + "(" + str(counter) + ")" + ext for counter in range(1, self.highest.get((base, ext), 0) + 1)]
+        return [candidate for candidate in candidates if candidate in self.names]
+
+
+class NameAllocator:
+    # Shared by everything that moves files into one output tree. Allocation is atomic within
+    # the process; move_no_clobber catches names taken by other processes in the meantime.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.directories: Dict[str, DirectoryNames] = {}
+
+    def _names(self, directory: str) -> DirectoryNames:
+        # Under self.lock
+        names = self.directories.get(directory)
+        if names is None:
+            names = self.directories[directory] = DirectoryNames(directory)
+        return names
+
+    def allocate(self, directory: str, name: str) -> str:
+        # Returns a path in directory that no earlier allocation has handed out
+        with self.lock:
+            return os.path.join(directory, self._names(directory).allocate(name))
+
+    def reserve(self, path: str):
+        # Record a name found to be in use after the directory was listed
+        directory, name = os.path.split(path)
+        with self.lock:
+            self._names(directory).add(name)
+
+    def in_use(self, directory: str, name: str) -> List[str]:
+        # Paths of name and of its numbered copies in directory, whether found there or handed out
+        with self.lock:
+            return [os.path.join(directory, taken) for taken in self._names(directory).numbered(name)]
+
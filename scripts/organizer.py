@@ -1,125 +1,299 @@
 import os
 import logging
-import shutil
-import json
-from typing import Any, Dict, List
-from scripts.metadata_extractor import extract_metadata, find_particular_keywords, get_workflow_node_data
-from sd_parsers import ParserManager
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from scripts import metrics
+from scripts.metadata_extractor import ImageRecord
+from scripts.config import WILDCARDS_DIR, resolve_app_path
+from scripts.metadata_index import INDEX_FILE, IndexEntry, MetadataIndex, fetch_head, lookup_or_extract, node_filter_key
+from scripts.move_plan import JOURNAL_FILE, MovePlan, apply_plan, resume_moves
+from scripts.name_allocator import NameAllocator
+from scripts.pipeline import DEFAULT_BATCH_SIZE, run_pipeline
+from scripts.progress import OrganizeCancelled, ProgressEvent, ProgressTracker
+from scripts.read_ahead import DEFAULT_IO_DEPTH, FileHead, ReadAhead, batch_size_for
+from scripts.rules import RULES_FILE, Decision, RuleSet, default_rules, read_rules, with_placement
+from scripts.scanner import CATEGORY_DIRS, DirectoryScanner, scan_key
+from scripts.wildcards import load_wildcards
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Initialize the parser manager
-parser_manager = ParserManager()
-
-def load_keywords(file_path):
-    with open(file_path, 'r') as f:
-        keywords = [line.strip() for line in f if line.strip()]
-    return keywords
-
-def increment_filename(filepath):
-    base, ext = os.path.splitext(filepath)
-    counter = 1
-    new_filepath = base + "(" + str(counter) + ")" + ext
-    while os.path.exists(new_filepath):
-        counter += 1
-        new_filepath = base + "(" + str(counter) + ")" + ext
-    return new_filepath
-
-def convert_keys_to_strings(d):
-    if isinstance(d, dict):
-        return {str(k): convert_keys_to_strings(v) for k, v in d.items()}
-    elif isinstance(d, list):
-        return [convert_keys_to_strings(i) for i in d]
+# The error of images without generation metadata; expected, so not worth a rescan
+NO_METADATA = "No metadata found in image."
+
+def iter_png_files(base_path, skip_dirs=CATEGORY_DIRS, exclude_dirs=(), ignore=()):
+    return iter(DirectoryScanner(base_path, skip_dirs, exclude_dirs, ignore))
+
+def category_label(decision: Optional[Decision]) -> Optional[str]:
+    # How a category is stored in the metadata index, e.g. "characters/Alice Smith"
+    return decision[0] if decision else None
+
+def categorize_record(record: ImageRecord, rules: RuleSet, file_path: Optional[str] = None) -> Optional[Decision]:
+    # Returns the (label, placements) decided by the rules, or None if no rule matched.
+    # ShowText nodes are checked for keywords first, the positive prompt is the fallback.
+    return rules.decide(record, file_path)
+
+# Per-process state for the worker pool, set once by init_worker so the rules are compiled
+# once per process instead of being pickled along with every batch
+_worker_state: Dict[str, Any] = {}
+
+def init_worker(rules: List[Dict[str, Any]], node_defaults: Dict[str, str], index_path: Optional[str] = None, whole_words: bool = False,
+                io_depth: int = DEFAULT_IO_DEPTH, matcher_cache: Optional[str] = None):
+    _worker_state['rules'] = RuleSet(rules, whole_words=whole_words, matcher_cache=matcher_cache)
+    _worker_state['node_defaults'] = node_defaults
+    _worker_state['node_filter'] = node_filter_key(node_defaults)
+    _worker_state['index_path'] = index_path
+    _worker_state['index'] = MetadataIndex(index_path, readonly=True) if index_path else None
+    if _worker_state.get('read_ahead'):
+        _worker_state['read_ahead'].close()
+    _worker_state['read_ahead'] = ReadAhead(io_depth) if io_depth > 1 else None
+
+def close_worker():
+    # Run in-process, the worker's index connection would otherwise stay open after the run,
+    # one more with every run from the GUI, and keep shard indexes open while they are merged
+    if _worker_state.get('index'):
+        _worker_state['index'].close()
+    if _worker_state.get('read_ahead'):
+        _worker_state['read_ahead'].close()
+    _worker_state.clear()
+
+def _fetch_head(file_path: str) -> FileHead:
+    # On a read-ahead thread, which opens an index connection of its own
+    local = _worker_state['read_ahead'].local
+    if _worker_state['index_path'] and not hasattr(local, 'index'):
+        local.index = MetadataIndex(_worker_state['index_path'], readonly=True)
+    return fetch_head(getattr(local, 'index', None), file_path, _worker_state['node_filter'])
+
+def worker_files(file_paths: List[str]):
+    # (file path, future of what was read ahead for it, or None without read-ahead)
+    read_ahead = _worker_state['read_ahead']
+    if read_ahead is None:
+        return ((file_path, None) for file_path in file_paths)
+    return read_ahead.fetch(_fetch_head, file_paths)
+
+def swap_rules(rules: RuleSet):
+    # Watch mode: rules recompiled after their files changed take effect from the next batch
+    _worker_state['rules'] = rules
+
+def categorize_batch(file_paths: List[str]) -> List[Tuple[str, Optional[Decision], Optional[IndexEntry], Optional[str]]]:
+    registry = metrics.current()
+    results = []
+    for file_path, head in worker_files(file_paths):
+        start = time.perf_counter()
+        # Whatever the file took beyond this thread's CPU time was spent waiting, mostly on I/O
+        cpu_start = time.thread_time()
+        try:
+            record, entry = lookup_or_extract(_worker_state['index'], file_path, _worker_state['node_defaults'],
+                                              head.result() if head else None)
+            if not record.has_metadata:
+                results.append((file_path, None, entry, NO_METADATA))
+                continue
+            match_start = time.perf_counter()
+            decision = categorize_record(record, _worker_state['rules'], file_path)
+            registry.observe('match', time.perf_counter() - match_start)
+            registry.count('files_matched' if decision else 'files_unmatched')
+            results.append((file_path, decision, entry, None))
+        except Exception as e:
+            results.append((file_path, None, None, str(e)))
+        finally:
+            elapsed = time.perf_counter() - start
+            registry.observe('file', elapsed)
+            registry.observe('io_wait', max(0.0, elapsed - (time.thread_time() - cpu_start)))
+    return results
+
+def plan_results(results, output_dir, index: Optional[MetadataIndex] = None, allocator: Optional[NameAllocator] = None) -> MovePlan:
+    # Results arrive in walk order; destinations are resolved in memory, nothing is moved yet
+    plan = MovePlan(allocator)
+    for file_path, decision, entry, error in results:
+        if index and entry:
+            index.put(entry)
+        if error == NO_METADATA:
+            # Expected for edited or downloaded images, so not an error
+            logging.info("No metadata in " + file_path)
+            metrics.current().count('no_metadata')
+            continue
+        if error:
+            logging.error("Error processing file " + file_path + ": " + error)
+            metrics.current().error('extract', error, file_path)
+            continue
+        if index:
+            index.set_category(file_path, category_label(decision))
+        if decision:
+            # The move comes first; copies and links are made from where the image ends up
+            placed_at = file_path
+            for directory, mode in decision[1]:
+                dest = plan.add(placed_at, os.path.join(output_dir, directory), mode, os.path.basename(file_path))
+                if mode == 'move':
+                    placed_at = dest
+    return plan
+
+def apply_results(results, output_dir, index: Optional[MetadataIndex] = None, journal_path=JOURNAL_FILE,
+                  allocator: Optional[NameAllocator] = None):
+    plan = plan_results(results, output_dir, index, allocator)
+    return apply_plan(plan, journal_path, index.move if index else None)
+
+def load_categories(wildcards_dir=WILDCARDS_DIR):
+    # One category per wildcard file, in priority order: an image matching a character is never
+    # filed under a location
+    return load_wildcards(wildcards_dir)
+
+def load_rules(rules_file=RULES_FILE, wildcards_dir=WILDCARDS_DIR, placement='move', matcher_cache=None):
+    # The rules file if there is one, otherwise the wildcard categories as rules.
+    # placement is how rules without an action put images in place; matcher_cache is where
+    # compiled keyword matchers are cached (see wildcards.compile_matcher).
+    rules_file = resolve_app_path(rules_file) if rules_file else None
+    if rules_file and os.path.exists(rules_file):
+        return with_placement(read_rules(rules_file, matcher_cache), placement)
+    return with_placement(default_rules(load_categories(wildcards_dir)), placement)
+
+def skip_dirs_for(rules, matcher_cache=None):
+    # Folders the rules file into are not rescanned as input
+    return tuple(dict.fromkeys(CATEGORY_DIRS + tuple(RuleSet(rules, matcher_cache=matcher_cache).top_dirs())))
+
+def make_scanner(purpose, base_path, rules, node_defaults, whole_words, index, output_dir=None, ignore=(), rescan=False,
+                 matcher_cache=None):
+    # Directories are only skipped when nothing that decides what happens to their files has
+    # changed since they were recorded
+    skip_dirs = skip_dirs_for(rules, matcher_cache)
+    exclude_dirs = (output_dir,) if output_dir else ()
+    key = scan_key(purpose, os.path.abspath(base_path), [os.path.abspath(d) for d in exclude_dirs], skip_dirs, list(ignore),
+                   rules, whole_words, node_filter_key(node_defaults))
+    return DirectoryScanner(base_path, skip_dirs, exclude_dirs, ignore, index, key, rescan)
+
+def report_scan(scanner):
+    if scanner.skipped:
+        logging.info(f"{scanner.skipped} unchanged folders skipped")
+    metrics.current().count('dirs_skipped', scanner.skipped)
+    metrics.current().count('dirs_listed', scanner.listed_count)
+
+def note_failures(results, scanner):
+    # Folders with a file that failed are listed again next time, so it is retried
+    for result in results:
+        if result[-1] and result[-1] != NO_METADATA:
+            scanner.mark_dirty(result[0])
+        yield result
+
+def organize_images(base_path, output_dir, node_defaults, workers=None, index_path=INDEX_FILE, whole_words=False,
+                    journal_path=JOURNAL_FILE, dry_run=False, progress: Optional[Callable[[ProgressEvent], Any]] = None,
+                    cancel: Optional[threading.Event] = None, rules_file=RULES_FILE, placement='move', ignore=(),
+                    rescan=False, io_depth=DEFAULT_IO_DEPTH, files: Optional[List[str]] = None,
+                    matcher_cache: Optional[str] = None) -> Optional[MovePlan]:
+    # progress receives ProgressEvents; setting cancel stops the run between two files.
+    # Returns the applied (or, with dry_run, printed) plan, or None if cancelled before moving.
+    # ignore is a list of file and folder name globs; the output folder is never scanned. With
+    # the index, folders left unchanged since a run with nothing to do in them are skipped
+    # unless rescan is set. io_depth is how many files each worker reads ahead, and how many
+    # moves are made at once (see read_ahead). files organizes just those, already found by
+    # someone else (a shard of a sharded run), instead of scanning base_path. matcher_cache is
+    # the folder compiled keyword matchers are cached in, next to the config by default.
+    rules = load_rules(rules_file, placement=placement, matcher_cache=matcher_cache)
+    tracker = ProgressTracker(progress, cancel)
+    # The run summary covers this run only
+    registry = metrics.current()
+    registry.reset()
+
+    if dry_run:
+        # Read the index if there is one, but write nothing
+        index = None
+        if index_path and not os.path.exists(index_path):
+            index_path = None
     else:
-        return d
-
-def move_file_to_category(file_path, output_dir, category, name):
-    category_dir = os.path.join(output_dir, category, name.replace(' ', '_').lower())
-    os.makedirs(category_dir, exist_ok=True)
-    dest_path = os.path.join(category_dir, os.path.basename(file_path))
-    if os.path.exists(dest_path):
-        dest_path = increment_filename(dest_path)
-    shutil.move(file_path, dest_path)
-    print("Moved " + file_path + " to " + dest_path)
-
-def organize_images(base_path, output_dir, node_defaults):
-    character_keywords = load_keywords('./wildcards/characters.txt')
-    location_keywords = load_keywords('./wildcards/locations.txt')
-
-    for root, dirs, files in os.walk(base_path):
-        if 'characters' in dirs:
-            dirs.remove('characters')  # Exclude 'characters' directory
-
-        if 'locations' in dirs:
-            dirs.remove('locations')  # Exclude 'locations' directory
-
-        for file in files:
-            if file.lower().endswith('.png'):
-                file_path = os.path.join(root, file)
-                #print("Processing file: " + file_path)
-                try:
-                    metadata = extract_metadata(file_path)
-                    metadata_str_keys = convert_keys_to_strings(metadata)
-
-                    #print("Metadata for " + file + ":")
-                    #print(json.dumps(metadata_str_keys, indent=4))
-
-                    # Look for the specific CharacterNames in nodes in the metadata
-                    found_character_names = find_particular_keywords(
-                        metadata_str_keys,
-                        character_keywords,
-                        node_type=node_defaults['node_type'],
-                        node_key=node_defaults['node_key'],
-                        node_name=node_defaults['node_name']
-                    )
-
-                    #print("Found Character Names: " + str(found_character_names))
-
-                    if found_character_names:
-                        # Move the images into the correct character directories
-                        for name in found_character_names:
-                            move_file_to_category(file_path, output_dir, 'characters', name)
-                            break  # Exit the loop after moving the file
-
-                    else:
-                        # Look for the specific Location Names from the txt file within nodes in the metadata
-                        found_location_names = find_particular_keywords(
-                            metadata_str_keys,
-                            location_keywords,
-                            node_type=node_defaults['node_type'],
-                            node_key=node_defaults['node_key'],
-                            node_name=node_defaults['node_name']
-                        )
-
-                        if found_location_names:
-                            print("Found Location Names: " + str(found_location_names))
-                            for name in found_location_names:
-                                move_file_to_category(file_path, output_dir, 'locations', name)
-                                break  # Exit the loop after moving the file
-
-                    # This is the fallback to use the positive prompt
-                    if not found_character_names:
-                        found_names = []
-                        prompt_info = parser_manager.parse(file_path)
-                        if prompt_info:
-                            for character in character_keywords:
-                                if any(character in prompt.value for prompt in prompt_info.prompts):
-                                    found_names.append(character)
-                            if found_names:
-                                for name in found_names:
-                                    move_file_to_category(file_path, output_dir, 'characters', name)
-                                    break
-                            else:
-                                for location in location_keywords:
-                                    if any(location in prompt.value for prompt in prompt_info.prompts):
-                                        found_names.append(location)
-                                if found_names:
-                                    for name in found_names:
-                                        move_file_to_category(file_path, output_dir, 'locations', name)
-                                        break
-
-                except ValueError as ve:
-                    logging.error("ValueError reading file: " + file_path + ": " + str(ve))
-                    logging.error("Problematic metadata: " + str(prompt_info.parameters if prompt_info else 'N/A'))
-                except Exception as e:
-                    logging.exception("Error processing file " + file + ": " + str(e))
+        # The mover owns the only writable connection; workers read through their own
+        index = MetadataIndex(index_path) if index_path else None
+
+    def on_moved(source, dest):
+        if index:
+            index.move(source, dest)
+        tracker.on_moved(source, dest)
+
+    try:
+        if not dry_run and os.path.exists(journal_path):
+            logging.warning("Finishing the interrupted organize run in " + journal_path)
+            resume_moves(journal_path, index.move if index else None)
+
+        scanner = None if files is not None else make_scanner('organize', base_path, rules, node_defaults, whole_words, index,
+                                                              output_dir, ignore, rescan, matcher_cache)
+        results = run_pipeline(
+            tracker.track_scan(registry.timed_iter('walk', scanner) if scanner else files),
+            categorize_batch,
+            workers=workers,
+            initializer=init_worker,
+            initargs=(rules, node_defaults, index_path, whole_words, io_depth, matcher_cache),
+            batch_size=batch_size_for(io_depth, DEFAULT_BATCH_SIZE),
+            finalizer=close_worker
+        )
+        try:
+            tracked = tracker.track_results(results)
+            plan = plan_results(note_failures(tracked, scanner) if scanner else tracked, output_dir, index)
+        except OrganizeCancelled:
+            tracker.finish(cancelled=True)
+            return None
+        finally:
+            # Shuts the worker pool down straight away when cancelled
+            results.close()
+
+        if scanner:
+            report_scan(scanner)
+        if dry_run:
+            plan.print()
+        else:
+            tracker.start_moving(len(plan))
+            apply_plan(plan, journal_path, on_moved, cancel, tracker.on_moved, io_depth)
+            if scanner and not tracker.cancelled:
+                for move in plan.moves:
+                    scanner.mark_dirty(move.source)
+                scanner.save()
+        tracker.finish(cancelled=tracker.cancelled)
+        return plan
+    finally:
+        if index:
+            index.close()
+
+def index_batch(file_paths: List[str]) -> List[Tuple[str, Optional[str], Optional[IndexEntry], Optional[str]]]:
+    results = []
+    for file_path, head in worker_files(file_paths):
+        try:
+            record, entry = lookup_or_extract(_worker_state['index'], file_path, _worker_state['node_defaults'],
+                                              head.result() if head else None)
+            with metrics.current().timed('match'):
+                decision = categorize_record(record, _worker_state['rules'], file_path)
+            results.append((file_path, category_label(decision), entry, None))
+        except Exception as e:
+            results.append((file_path, None, None, str(e)))
+    return results
+
+def index_images(base_path, node_defaults, workers=None, index_path=INDEX_FILE, whole_words=False, rules_file=RULES_FILE,
+                 ignore=(), rescan=False, io_depth=DEFAULT_IO_DEPTH, matcher_cache=None):
+    # Fill the metadata index for a directory tree without moving anything. Folders unchanged
+    # since they were last indexed are skipped unless rescan is set.
+    # Returns (files seen, entries written, errors).
+    seen = written = errors = 0
+    rules = load_rules(rules_file, matcher_cache=matcher_cache)
+    with MetadataIndex(index_path) as index:
+        scanner = make_scanner('index', base_path, rules, node_defaults, whole_words, index, ignore=ignore, rescan=rescan,
+                               matcher_cache=matcher_cache)
+        results = run_pipeline(
+            scanner,
+            index_batch,
+            workers=workers,
+            initializer=init_worker,
+            initargs=(rules, node_defaults, index_path, whole_words, io_depth, matcher_cache),
+            batch_size=batch_size_for(io_depth, DEFAULT_BATCH_SIZE),
+            finalizer=close_worker
+        )
+        for file_path, label, entry, error in results:
+            seen += 1
+            if entry:
+                index.put(entry)
+                written += 1
+            if not error:
+                # Categories make the index searchable by character or location before organizing
+                index.set_category(file_path, label)
+            if error:
+                errors += 1
+                logging.error("Error indexing file " + file_path + ": " + error)
+                metrics.current().error('extract', error, file_path)
+                scanner.mark_dirty(file_path)
+        report_scan(scanner)
+        scanner.save()
+    return seen, written, errors
@@ -0,0 +1,56 @@
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Tuple
+
+# Picks the sd_parsers parsers worth trying for a PNG from the keys of its text chunks, instead of
+# trying every generator in turn. A folder is nearly always written by one generator, so when
+# more than one parser fits, the one that read the previous file in the same folder goes first.
+
+# Text chunk keys each generator's parser reads; it returns None for a PNG without one of these
+# key sets, so it isn't tried then. Generators not listed here are always tried.
+GENERATOR_KEYS = {
+    'ComfyUI': (('prompt', 'workflow'),),
+    'InvokeAI': (('invokeai_metadata',), ('sd-metadata',), ('Dream',)),
+    'NovelAI': (('Description', 'Software', 'Source', 'Comment'),),
+    'AUTOMATIC1111': (('parameters',),)
+}
+
+# Folders whose last parser is remembered, per process
+MAX_FOLDERS = 1024
+
+
+class ParserDispatch:
+    def __init__(self, parsers: Iterable[Any]):
+        self.parsers = tuple(parsers)
+        self.by_keys: Dict[FrozenSet[str], Tuple[Any, ...]] = {}
+        self.last: 'OrderedDict[str, Any]' = OrderedDict()
+
+    @staticmethod
+    def can_read(parser: Any, keys: FrozenSet[str]) -> bool:
+        key_sets = GENERATOR_KEYS.get(parser.generator.value)
+        return key_sets is None or any(keys.issuperset(key_set) for key_set in key_sets)
+
+    def sniff(self, keys: Iterable[str]) -> Tuple[Any, ...]:
+        # The parsers that can read these text chunks, in ParserManager order
+        keys = frozenset(keys)
+        parsers = self.by_keys.get(keys)
+        if parsers is None:
+            parsers = self.by_keys[keys] = tuple(parser for parser in self.parsers if self.can_read(parser, keys))
+        return parsers
+
+    def candidates(self, keys: Iterable[str], folder: Optional[str] = None) -> Tuple[Tuple[Any, ...], bool]:
+        # Parsers to try in order, and whether the folder's last parser was moved to the front.
+        # Only matters for a PNG carrying metadata for two generators.
+        parsers = self.sniff(keys)
+        if len(parsers) > 1 and folder is not None:
+            guess = self.last.get(folder)
+            if guess is not None and guess is not parsers[0] and guess in parsers:
+                return (guess,) + tuple(parser for parser in parsers if parser is not guess), True
+        return parsers, False
+
+    def succeeded(self, folder: Optional[str], parser: Any):
+        if folder is None:
+            return
+        self.last[folder] = parser
+        self.last.move_to_end(folder)
+        if len(self.last) > MAX_FOLDERS:
+            self.last.popitem(last=False)
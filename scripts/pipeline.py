@@ -0,0 +1,89 @@
+import os
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from scripts import metrics
+
+# Number of files handed to a worker per task; amortizes the IPC cost of each submit
+DEFAULT_BATCH_SIZE = 16
+
+# How many batches may be queued per worker before the producer waits for the mover
+DEFAULT_PENDING_PER_WORKER = 4
+
+
+def resolve_workers(workers: Optional[int]) -> int:
+    if not workers or workers < 1:
+        return os.cpu_count() or 1
+    return workers
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def init_measured_worker(initializer: Optional[Callable[..., None]], initargs: Tuple):
+    # Forked workers start with a copy of the parent's timings, which must not be sent back
+    metrics.current().reset()
+    if initializer:
+        initializer(*initargs)
+
+
+def measured_batch(batch_fn: Callable[[List[Any]], List[Any]], batch: List[Any]) -> Tuple[List[Any], Dict[str, Any]]:
+    # Runs in a worker: the batch's results plus the timings and counters it recorded
+    results = batch_fn(batch)
+    return results, metrics.current().drain()
+
+
+def run_pipeline(items: Iterable[Any],
+                 batch_fn: Callable[[List[Any]], List[Any]],
+                 workers: Optional[int] = None,
+                 initializer: Optional[Callable[..., None]] = None,
+                 initargs: Tuple = (),
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 finalizer: Optional[Callable[[], None]] = None) -> Iterator[Any]:
+    # Producer -> process pool -> single consumer pipeline.
+    # `items` is consumed lazily (e.g. a directory walk), batches are processed by `batch_fn`
+    # in a pool of worker processes, and results are yielded back in submission order so the
+    # caller can act on them (move files) from a single stage. The timings and counters the
+    # workers record (scripts.metrics) are merged into this process's as their batches come back.
+    # finalizer undoes initializer where it ran in this process, once the results are consumed
+    # or the pipeline is closed; pool workers release theirs when they exit.
+    workers = resolve_workers(workers)
+    batches = batched(items, batch_size)
+
+    if workers == 1:
+        # No pool: run everything in-process, which also keeps tracebacks simple
+        if initializer:
+            initializer(*initargs)
+        try:
+            for batch in batches:
+                yield from batch_fn(batch)
+        finally:
+            if finalizer:
+                finalizer()
+        return
+
+    max_pending = workers * DEFAULT_PENDING_PER_WORKER
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_measured_worker, initargs=(initializer, initargs))
+    pending = deque()
+    try:
+        for batch in batches:
+            pending.append(executor.submit(measured_batch, batch_fn, batch))
+            if len(pending) >= max_pending:
+                yield from _collect(pending.popleft())
+        while pending:
+            yield from _collect(pending.popleft())
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _collect(future) -> List[Any]:
+    results, recorded = future.result()
+    metrics.current().merge(recorded)
+    return results
@@ -0,0 +1,268 @@
+import os
+import sys
+import errno
+import shutil
+import logging
+import threading
+from typing import Callable, Dict, Optional, Set, Tuple
+
+# Ways of putting an image into a category folder. None of them ever replaces an existing
+# file: a taken name raises FileExistsError, and the caller picks the next free one.
+#   move      rename on the same volume; across volumes, reflink or copy, then delete
+#   copy      an independent copy; reflinked where the filesystem can, so usually free
+#   hardlink  a second name for the same file, same volume only
+#   reflink   a copy-on-write clone sharing the data blocks (btrfs, XFS, APFS, bcachefs, ZFS 2.2)
+#   symlink   a link to the original's absolute path
+#   auto      the cheapest of hardlink, reflink and copy that works for the source and target
+#             volumes, found once per pair of volumes; never a symlink, which breaks if the
+#             original moves
+
+MODES = ('move', 'copy', 'hardlink', 'reflink', 'symlink', 'auto')
+
+# Past tense for the log lines
+PLACED = {
+    'move': 'Moved',
+    'copy': 'Copied',
+    'hardlink': 'Hardlinked',
+    'reflink': 'Reflinked',
+    'symlink': 'Symlinked',
+    'auto': 'Placed'
+}
+
+AUTO_ORDER = ('hardlink', 'reflink', 'copy')
+
+# What a filesystem answers when it can't do something at all, as opposed to a failure for
+# this one file
+UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL, errno.ENOTTY}
+
+COPY_BUFSIZE = 1024 * 1024
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409 if sys.platform.startswith('linux') else None
+
+# (source volume, target volume) -> strategies found unsupported there, so a failing ioctl or
+# link is tried once per pair of volumes rather than once per file
+_unsupported: Dict[Tuple[int, int], Set[str]] = {}
+_unsupported_lock = threading.Lock()
+
+
+def _volumes(source: str, dest: str) -> Tuple[int, int]:
+    return os.stat(source).st_dev, os.stat(os.path.dirname(dest) or '.').st_dev
+
+
+def _is_unsupported(volumes: Tuple[int, int], strategy: str) -> bool:
+    return strategy in _unsupported.get(volumes, ())
+
+
+def _mark_unsupported(volumes: Tuple[int, int], strategy: str, error: OSError):
+    with _unsupported_lock:
+        if strategy not in _unsupported.setdefault(volumes, set()):
+            logging.info(f"No {strategy} between devices {volumes[0]} and {volumes[1]}: {error.strerror}")
+            _unsupported[volumes].add(strategy)
+
+
+def _clone(source: str, tmp_path: str):
+    # Copy-on-write clone of source at tmp_path, or OSError if the filesystem can't
+    if sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(source), os.fsencode(tmp_path), 0) != 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), tmp_path)
+        return
+    if FICLONE is None:
+        raise OSError(errno.ENOTSUP, "Reflinks are not supported on this platform", tmp_path)
+    import fcntl
+    with open(source, 'rb') as src, open(tmp_path, 'xb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except BaseException:
+            dst.close()
+            os.remove(tmp_path)
+            raise
+
+
+def _copy_data(source: str, tmp_path: str):
+    # Byte copy. copy_file_range keeps the data in the kernel, and lets NFS 4.2 and SMB3
+    # servers copy without sending it over the network.
+    with open(source, 'rb') as src, open(tmp_path, 'xb') as dst:
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            size = os.fstat(src.fileno()).st_size
+            try:
+                while copied < size:
+                    count = os.copy_file_range(src.fileno(), dst.fileno(), size - copied)
+                    if count == 0:
+                        break
+                    copied += count
+            except OSError as e:
+                if copied or e.errno not in UNSUPPORTED:
+                    raise
+        src.seek(copied)
+        dst.seek(copied)
+        shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+
+
+def _write_copy(source: str, tmp_path: str, volumes: Tuple[int, int], clone_only: bool = False):
+    # Reflink where the volumes allow it, otherwise (unless clone_only) a byte copy
+    if not _is_unsupported(volumes, 'reflink'):
+        try:
+            _clone(source, tmp_path)
+            shutil.copystat(source, tmp_path)
+            return
+        except OSError as e:
+            if e.errno not in UNSUPPORTED:
+                raise
+            _mark_unsupported(volumes, 'reflink', e)
+    if clone_only:
+        raise OSError(errno.ENOTSUP, "Reflinks are not supported between these volumes", source)
+    _copy_data(source, tmp_path)
+    shutil.copystat(source, tmp_path)
+
+
+def _claim(tmp_path: str, dest: str):
+    # Gives the finished copy its real name, unless that name has been taken
+    try:
+        os.link(tmp_path, dest)
+    except FileExistsError:
+        os.remove(tmp_path)
+        raise
+    except OSError as e:
+        if e.errno not in UNSUPPORTED and e.errno != errno.EMLINK:
+            os.remove(tmp_path)
+            raise
+        # No hard links here: claim the name with an empty file, then replace it
+        try:
+            os.close(os.open(dest, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, dest)
+        return
+    os.unlink(tmp_path)
+
+
+def _copy_to(source: str, dest: str, clone_only: bool = False):
+    # Copied under a temporary name first, so a crash never leaves half an image under the real one
+    tmp_path = dest + '.' + str(os.getpid()) + '.partial'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)  # Left by a crash
+    volumes = _volumes(source, dest)
+    try:
+        _write_copy(source, tmp_path, volumes, clone_only)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _claim(tmp_path, dest)
+
+
+def move_no_clobber(source: str, dest: str):
+    # Like os.rename, but raises FileExistsError instead of replacing an existing dest.
+    # A hard link claims the name atomically on the same filesystem.
+    try:
+        os.link(source, dest)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            # Another volume: reflinked or copied, then the original goes
+            _copy_to(source, dest)
+            os.unlink(source)
+            return
+        if e.errno not in UNSUPPORTED and e.errno != errno.EMLINK:
+            raise
+        # No hard links here: claim the name with an empty file, then move over it
+        os.close(os.open(dest, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        try:
+            os.replace(source, dest)
+        except BaseException:
+            os.remove(dest)
+            raise
+        return
+    os.unlink(source)
+
+
+def copy_no_clobber(source: str, dest: str):
+    _copy_to(source, dest)
+
+
+def reflink_no_clobber(source: str, dest: str):
+    _copy_to(source, dest, clone_only=True)
+
+
+def hardlink_no_clobber(source: str, dest: str):
+    os.link(source, dest)
+
+
+def symlink_no_clobber(source: str, dest: str):
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+    os.symlink(os.path.abspath(source), dest)
+
+
+def auto_no_clobber(source: str, dest: str):
+    volumes = _volumes(source, dest)
+    for strategy in AUTO_ORDER:
+        if _is_unsupported(volumes, strategy):
+            continue
+        try:
+            PLACERS[strategy](source, dest)
+            return
+        except OSError as e:
+            if e.errno not in UNSUPPORTED:
+                raise
+            _mark_unsupported(volumes, strategy, e)
+    raise OSError(errno.ENOTSUP, "No way to place files between these volumes", source)
+
+
+PLACERS: Dict[str, Callable[[str, str], None]] = {
+    'move': move_no_clobber,
+    'copy': copy_no_clobber,
+    'hardlink': hardlink_no_clobber,
+    'reflink': reflink_no_clobber,
+    'symlink': symlink_no_clobber,
+    'auto': auto_no_clobber
+}
+
+
+def is_placed(source: str, dest: str, mode: str) -> bool:
+    # Whether dest already holds source placed with mode: a copy or link whose journal line was
+    # lost, or one made by an earlier run. Moves are recognised by the mover itself.
+    try:
+        if mode == 'symlink':
+            return os.path.islink(dest) and os.readlink(dest) == os.path.abspath(source)
+        if mode in ('hardlink', 'auto') and os.path.samefile(source, dest):
+            return True
+        if mode in ('copy', 'reflink', 'auto'):
+            # Copies keep the modification time
+            src, dst = os.stat(source), os.lstat(dest)
+            return (src.st_size, src.st_mtime_ns) == (dst.st_size, dst.st_mtime_ns)
+    except OSError:
+        pass
+    return False
+
+
+def strategy_for(source_dir: str, target_dir: str) -> Optional[str]:
+    # What auto would use between two directories, by trying it on a scratch file; None if
+    # nothing works. For the benchmark and for reporting.
+    probe = os.path.join(source_dir, '.placement-probe')
+    target = os.path.join(target_dir, '.placement-probe-target')
+    with open(probe, 'wb') as f:
+        f.write(b'probe')
+    try:
+        volumes = _volumes(probe, target)
+        for strategy in AUTO_ORDER:
+            if _is_unsupported(volumes, strategy):
+                continue
+            try:
+                PLACERS[strategy](probe, target)
+                os.remove(target)
+                return strategy
+            except OSError as e:
+                if e.errno not in UNSUPPORTED:
+                    raise
+                _mark_unsupported(volumes, strategy, e)
+        return None
+    finally:
+        os.remove(probe)
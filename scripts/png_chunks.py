@@ -0,0 +1,169 @@
+import zlib
+import struct
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, Optional, Set
+
+# Minimal PNG reader for the text chunks written by Stable Diffusion front ends.
+# Reads the header and the chunks before the image data, seeking over anything it doesn't
+# need, and never decodes pixels.
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Text keys the sd_parsers generators look for
+METADATA_KEYS = frozenset({
+    'prompt', 'workflow',                              # ComfyUI
+    'parameters',                                      # AUTOMATIC1111 / Forge
+    'invokeai_metadata', 'sd-metadata', 'Dream',       # InvokeAI
+    'Description', 'Software', 'Source', 'Comment'     # NovelAI
+})
+
+# Large enough that a typical header plus embedded workflow arrives in one read
+READ_BUFFER_SIZE = 64 * 1024
+TRAILING_BUFFER_SIZE = 1024
+
+# How much of the end of a file has_trailing_chunks reads: enough for the last image data
+# chunk of the usual encoders, which write them 8 or 64 KiB at a time
+TAIL_SIZE = 128 * 1024
+
+# Upper bound for a single decompressed text chunk, against decompression bombs
+MAX_TEXT_CHUNK = 64 * 1024 * 1024
+
+TEXT_CHUNKS = (b'tEXt', b'zTXt', b'iTXt')
+
+
+@dataclass(slots=True)
+class PngText:
+    # Quacks enough like a PIL PNG image (format, size, info, text) for the sd_parsers parsers
+    width: int = 0
+    height: int = 0
+    text: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def format(self) -> str:
+        return "PNG"
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def info(self) -> Dict[str, str]:
+        return self.text
+
+
+def _decompress(data: bytes) -> bytes:
+    decompressor = zlib.decompressobj()
+    result = decompressor.decompress(data, MAX_TEXT_CHUNK)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Text chunk exceeds the size limit")
+    return result
+
+
+def _parse_text_chunk(chunk_type: bytes, data: bytes, decompress: bool) -> Optional[str]:
+    if chunk_type == b'tEXt':
+        return data.partition(b'\0')[2].decode('latin-1')
+
+    if chunk_type == b'zTXt':
+        if not decompress:
+            return None
+        return _decompress(data.partition(b'\0')[2][1:]).decode('latin-1')
+
+    # iTXt: keyword, compression flag and method, language tag, translated keyword, text
+    rest = data.partition(b'\0')[2]
+    compressed, rest = rest[0], rest[2:]
+    rest = rest.partition(b'\0')[2].partition(b'\0')[2]
+    if compressed:
+        if not decompress:
+            return None
+        rest = _decompress(rest)
+    return rest.decode('utf-8')
+
+
+def read_png_text(file_path: str, keys: Optional[Set[str]] = METADATA_KEYS, decompress: bool = True, include_trailing: bool = False) -> Optional[PngText]:
+    # When seeking over the image data a large buffer would be refilled at every chunk header
+    buffering = TRAILING_BUFFER_SIZE if include_trailing else READ_BUFFER_SIZE
+    with open(file_path, 'rb', buffering=buffering) as f:
+        return read_png_text_from_file(f, keys, decompress, include_trailing)
+
+
+def read_png_head(f: BinaryIO, min_size: int = 0) -> bytes:
+    # The start of a PNG up to the header of its image data, which holds every chunk
+    # read_png_text_from_file reads by default, and at least min_size bytes of any file. One
+    # read does for most images; a file on a network share is read in as few round trips as
+    # its chunk layout allows, and parsed afterwards from memory.
+    data = bytearray()
+
+    def fill(size):
+        while len(data) < size:
+            # Bounded, since a corrupt chunk length can be anything
+            block = f.read(max(READ_BUFFER_SIZE, min(size - len(data), MAX_TEXT_CHUNK)))
+            if not block:
+                return False
+            data.extend(block)
+        return True
+
+    fill(max(min_size, len(PNG_SIGNATURE)))
+    if data[:len(PNG_SIGNATURE)] != PNG_SIGNATURE:
+        return bytes(data)
+    offset = len(PNG_SIGNATURE)
+    while fill(offset + 8):
+        length, chunk_type = struct.unpack_from('>I4s', data, offset)
+        if chunk_type in (b'IDAT', b'IEND'):
+            break
+        offset += length + 12
+    return bytes(data)
+
+
+def has_trailing_chunks(file_path: str) -> bool:
+    # Whether anything but image data comes before IEND, judged from the end of the file: the
+    # last IDAT is found by its length, which must lead exactly up to IEND. True when the tail
+    # doesn't tell, so the caller walks the chunks to be sure.
+    with open(file_path, 'rb') as f:
+        f.seek(max(0, f.seek(0, 2) - TAIL_SIZE))
+        tail = f.read()
+    iend = len(tail) - 12
+    if iend < 0 or tail[iend + 4:iend + 8] != b'IEND':
+        return True
+    tag = tail.rfind(b'IDAT', 0, iend)
+    while tag >= 4:
+        if tag + 8 + struct.unpack_from('>I', tail, tag - 4)[0] == iend:
+            return False
+        tag = tail.rfind(b'IDAT', 0, tag)
+    return True
+
+
+def read_png_text_from_file(f: BinaryIO, keys: Optional[Set[str]] = METADATA_KEYS, decompress: bool = True, include_trailing: bool = False) -> Optional[PngText]:
+    # Returns None if the file isn't a PNG. Only chunks named in `keys` are read
+    # (all of them when keys is None); compressed chunks are inflated only if `decompress`.
+    # Reading stops at the image data unless `include_trailing`, in which case the image
+    # data is seeked over to pick up text chunks stored after it.
+    if f.read(8) != PNG_SIGNATURE:
+        return None
+
+    result = PngText()
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack('>I4s', header)
+
+        if chunk_type == b'IHDR':
+            data = f.read(length)
+            result.width, result.height = struct.unpack('>II', data[:8])
+            f.seek(4, 1)  # CRC
+        elif chunk_type in TEXT_CHUNKS:
+            # The keyword is at most 79 bytes, so peek before reading the whole chunk
+            start = f.tell()
+            key = f.read(min(length, 80)).partition(b'\0')[0].decode('latin-1')
+            if keys is None or key in keys:
+                f.seek(start)
+                value = _parse_text_chunk(chunk_type, f.read(length), decompress)
+                if value is not None:
+                    result.text[key] = value
+            f.seek(start + length + 4)
+        elif chunk_type == b'IEND' or (chunk_type == b'IDAT' and not include_trailing):
+            # Metadata written by generators precedes the image data
+            break
+        else:
+            f.seek(length + 4, 1)
+    return result
@@ -0,0 +1,127 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+from PIL import Image
+from scripts.config import CONFIG_FILE, data_file_for
+from scripts.metadata_extractor import ImageRecord
+
+# Thumbnails and parsed metadata for the GUI preview. Recently shown images are answered
+# from memory; thumbnails also survive restarts in a size-capped folder next to the config.
+
+THUMBNAIL_DIR = data_file_for(CONFIG_FILE, 'thumbnails')
+THUMBNAIL_SIZE = (200, 200)
+
+# Previews (thumbnail + record) kept in memory
+MEMORY_ITEMS = 64
+
+# Oldest thumbnails are deleted once the folder grows past this
+DISK_BYTES = 64 * 1024 * 1024
+
+Preview = Tuple[Image.Image, ImageRecord]
+
+
+def make_thumbnail(file_path: str, size: Tuple[int, int] = THUMBNAIL_SIZE) -> Image.Image:
+    with Image.open(file_path) as img:
+        # JPEGs are decoded straight at 1/2, 1/4 or 1/8 scale. PNGs have no reduced decode,
+        # but reducing_gap shrinks them by whole factors before the final resample.
+        img.draft('RGB', size)
+        img.thumbnail(size, reducing_gap=2.0)
+        return img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+
+
+class PreviewCache:
+    def __init__(self, cache_dir: Optional[str] = THUMBNAIL_DIR, memory_items: int = MEMORY_ITEMS,
+                 disk_bytes: int = DISK_BYTES, size: Tuple[int, int] = THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        self.size = size
+        self.memory: 'OrderedDict[str, Preview]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.disk_used: Optional[int] = None
+
+    def _key(self, file_path: str) -> str:
+        # Path plus size and mtime, so an overwritten image isn't served from the cache
+        st = os.stat(file_path)
+        identity = f"{os.path.abspath(file_path)}\0{st.st_size}\0{st.st_mtime_ns}\0{self.size}"
+        return hashlib.blake2b(identity.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+    def get(self, file_path: str, extract: Callable[[str], ImageRecord]) -> Preview:
+        key = self._key(file_path)
+        with self.lock:
+            preview = self.memory.get(key)
+            if preview is not None:
+                self.memory.move_to_end(key)
+                return preview
+
+        preview = (self._thumbnail(key, file_path), extract(file_path))
+        with self.lock:
+            self.memory[key] = preview
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+        return preview
+
+    def thumbnail(self, file_path: str) -> Image.Image:
+        # Thumbnail only, for the gallery grid; shares the disk cache with the previews
+        return self._thumbnail(self._key(file_path), file_path)
+
+    def _thumbnail(self, key: str, file_path: str) -> Image.Image:
+        if not self.cache_dir:
+            return make_thumbnail(file_path, self.size)
+
+        cached_path = os.path.join(self.cache_dir, key[:2], key + '.png')
+        try:
+            with Image.open(cached_path) as img:
+                thumbnail = img.copy()
+            os.utime(cached_path)  # Recently used, pruned last
+            return thumbnail
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning("Ignoring broken thumbnail " + cached_path + ": " + str(e))
+
+        thumbnail = make_thumbnail(file_path, self.size)
+        try:
+            os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+            tmp_path = cached_path + '.tmp'
+            thumbnail.save(tmp_path, format='PNG', compress_level=1)
+            os.replace(tmp_path, cached_path)
+            self._account(os.path.getsize(cached_path))
+        except OSError as e:
+            logging.warning("Cannot cache thumbnail for " + file_path + ": " + str(e))
+        return thumbnail
+
+    def _account(self, added: int):
+        with self.lock:
+            if self.disk_used is None:
+                self.disk_used = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self.disk_used += added
+            if self.disk_used <= self.disk_bytes:
+                return
+            # Drop the least recently used thumbnails down to 3/4 of the limit
+            entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+            target = self.disk_bytes * 3 // 4
+            for path, size, _ in entries:
+                if self.disk_used <= target:
+                    break
+                try:
+                    os.remove(path)
+                    self.disk_used -= size
+                except OSError:
+                    pass
+
+    def _disk_entries(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime_ns))
+        return entries
@@ -0,0 +1,112 @@
+import time
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+# Progress reporting for long organize runs. The tracker is driven from the thread doing the
+# work and hands snapshots to a callback (the GUI passes queue.put), at most every
+# PROGRESS_INTERVAL seconds plus once at the end.
+
+PROGRESS_INTERVAL = 0.1
+
+SCANNING = 'scanning'
+MOVING = 'moving'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+
+@dataclass(slots=True)
+class ProgressEvent:
+    phase: str
+    scanned: int
+    scan_complete: bool
+    parsed: int
+    failed: int
+    to_move: int
+    moved: int
+    elapsed: float
+    # Files per second in the current phase
+    rate: float
+    # Seconds left in the current phase, None while the total is still unknown
+    eta: Optional[float]
+
+    @property
+    def finished(self) -> bool:
+        return self.phase in (DONE, CANCELLED)
+
+
+class OrganizeCancelled(Exception):
+    pass
+
+
+class ProgressTracker:
+    def __init__(self, callback: Optional[Callable[[ProgressEvent], Any]] = None,
+                 cancel: Optional[threading.Event] = None, interval: float = PROGRESS_INTERVAL):
+        self.callback = callback
+        self.cancel = cancel
+        self.interval = interval
+        self.phase = SCANNING
+        self.scanned = self.parsed = self.failed = self.to_move = self.moved = 0
+        self.scan_complete = False
+        self.moving = False
+        self.start = self.phase_start = time.monotonic()
+        self.last_emit = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.is_set()
+
+    def track_scan(self, paths: Iterable[str]) -> Iterator[str]:
+        for path in paths:
+            self.scanned += 1
+            yield path
+        self.scan_complete = True
+
+    def track_results(self, results: Iterable[tuple]) -> Iterator[tuple]:
+        # Results with an error in their last field count as failed. Stops between files
+        # once cancel is set.
+        for result in results:
+            if self.cancelled:
+                raise OrganizeCancelled()
+            if result[-1]:
+                self.failed += 1
+            else:
+                self.parsed += 1
+            self._maybe_emit()
+            yield result
+
+    def start_moving(self, total: int):
+        self.phase = MOVING
+        self.moving = True
+        self.to_move = total
+        self.phase_start = time.monotonic()
+        self.emit()
+
+    def on_moved(self, source: str, dest: str):
+        self.moved += 1
+        self._maybe_emit()
+
+    def finish(self, cancelled: bool = False):
+        self.phase = CANCELLED if cancelled else DONE
+        self.emit()
+
+    def snapshot(self) -> ProgressEvent:
+        now = time.monotonic()
+        phase_elapsed = max(now - self.phase_start, 1e-9)
+        if self.moving:
+            done, total = self.moved, self.to_move
+        else:
+            done, total = self.parsed + self.failed, self.scanned if self.scan_complete else None
+        rate = done / phase_elapsed
+        eta = (total - done) / rate if total is not None and rate > 0 and self.phase not in (DONE, CANCELLED) else None
+        return ProgressEvent(self.phase, self.scanned, self.scan_complete, self.parsed, self.failed,
+                             self.to_move, self.moved, now - self.start, rate, eta)
+
+    def emit(self):
+        self.last_emit = time.monotonic()
+        if self.callback:
+            self.callback(self.snapshot())
+
+    def _maybe_emit(self):
+        if self.callback and time.monotonic() - self.last_emit >= self.interval:
+            self.emit()
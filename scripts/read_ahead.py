@@ -0,0 +1,66 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+from scripts.png_chunks import read_png_head
+
+# Read-ahead for input folders on network shares (SMB/NFS), where every stat, open and read is a
+# round trip to the server. Each worker process keeps up to io_depth of them in flight on a
+# thread pool: while one file's metadata is parsed, the files after it in the batch are already
+# being looked up and read. Only the bytes parsing needs are fetched, in as few reads as
+# possible: a PNG's chunks before its image data, and the last block of the file when the
+# index has to hash it. With io_depth 1 files are read as they are parsed, one after another.
+
+DEFAULT_IO_DEPTH = 1
+
+# Batches are long enough to keep every I/O thread busy
+BATCHES_PER_DEPTH = 2
+
+
+@dataclass(slots=True)
+class FileHead:
+    # What one read-ahead fetched for a file: its size and mtime when the index needed them,
+    # the record if the index already had one, otherwise the start of the file and, for
+    # content_hash, its last block
+    size: int = 0
+    mtime_ns: int = 0
+    record: Any = None
+    data: Optional[bytes] = None
+    tail: Optional[bytes] = None
+
+
+def read_head(file_path: str, size: int = 0, tail_size: int = 0, min_size: int = 0) -> Tuple[bytes, Optional[bytes]]:
+    # (start of the file, its last tail_size bytes if it is longer than twice that)
+    with open(file_path, 'rb', buffering=0) as f:
+        data = read_png_head(f, min_size)
+        tail = None
+        if tail_size and size > 2 * tail_size:
+            f.seek(-tail_size, os.SEEK_END)
+            tail = f.read(tail_size)
+    return data, tail
+
+
+class ReadAhead:
+    def __init__(self, depth: int):
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=depth, thread_name_prefix='read-ahead')
+        # Per thread state for the fetch functions, e.g. a database connection of their own
+        self.local = threading.local()
+
+    def fetch(self, fetch_fn: Callable[[str], FileHead], file_paths: Iterable[str]) -> Iterator[Tuple[str, 'Future[FileHead]']]:
+        # Starts fetch_fn on every path, then hands them back in order to be waited for
+        # one at a time; the pool keeps at most depth of them running
+        pending = [(file_path, self.executor.submit(fetch_fn, file_path)) for file_path in file_paths]
+        try:
+            yield from pending
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def batch_size_for(io_depth: int, batch_size: int) -> int:
+    return max(batch_size, io_depth * BATCHES_PER_DEPTH)
@@ -0,0 +1,351 @@
+import os
+import re
+import json
+import fnmatch
+from dataclasses import dataclass, field
+from datetime import datetime
+from string import Formatter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from scripts.config import resolve_app_path
+from scripts.metadata_extractor import ImageRecord
+from scripts.placement import MODES
+from scripts.wildcards import category_files, compile_matcher, read_wildcard_file
+
+# Declarative routing rules, read from data/rules.json. Each rule lists conditions on the
+# extracted metadata and a path template for the folder its images go to. Rules are compiled
+# once per process: the keyword lists of all rules share one CategoryMatcher, so an image's
+# texts are scanned once however many rules there are; glob patterns become regexes, and only
+# the rules without keywords plus those whose keywords were found are checked at all.
+
+RULES_FILE = 'data/rules.json'
+
+# Conditions matched with glob patterns (case-insensitive); list fields match if any entry does
+PATTERN_FIELDS = {
+    'model': 'models',
+    'lora': 'loras',
+    'vae': 'vaes',
+    'sampler': 'sampler',
+    'scheduler': 'scheduler',
+    'generator': 'generator'
+}
+# Conditions given as a number or a {"min": ..., "max": ...} range
+NUMBER_FIELDS = ('width', 'height', 'seed', 'steps', 'cfg', 'denoise', 'clip_skip')
+ORIENTATIONS = ('portrait', 'landscape', 'square')
+
+RULE_KEYS = {'name', 'priority', 'keywords', 'date', 'orientation', 'to', 'action', 'continue'}
+RULE_KEYS.update(PATTERN_FIELDS, NUMBER_FIELDS)
+
+# Fields a path template can use, besides {name}, {keyword} and {date}
+TEMPLATE_FIELDS = set(PATTERN_FIELDS) | set(NUMBER_FIELDS) | {'orientation'}
+
+# (folder relative to the output directory, placement mode)
+Placement = Tuple[str, str]
+# (category stored in the metadata index, placements with the move, if any, first)
+Decision = Tuple[str, List[Placement]]
+
+Check = Callable[[ImageRecord, Optional[float]], bool]
+
+
+class TemplateDate(datetime):
+    # {date} on its own is the day; {date:%Y/%m} and the like pick any strftime format
+    def __format__(self, spec):
+        return super().__format__(spec or '%Y-%m-%d')
+
+
+def _number(value) -> Optional[float]:
+    # Inputs wired to another node hold a link like ["4", 0] instead of a value
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _stem(value: str) -> str:
+    # "SDXL\\juggernaut_v9.safetensors" -> "juggernaut_v9"
+    return os.path.splitext(value.replace('\\', '/').rsplit('/', 1)[-1])[0]
+
+
+def _values(record: ImageRecord, attribute: str) -> List[str]:
+    value = getattr(record, attribute)
+    if isinstance(value, list):
+        return [str(item) for item in value]
+    return [] if value is None else [str(value)]
+
+
+def orientation(record: ImageRecord) -> Optional[str]:
+    if not record.width or not record.height:
+        return None
+    if record.width == record.height:
+        return 'square'
+    return 'landscape' if record.width > record.height else 'portrait'
+
+
+def path_part(value: Any) -> str:
+    # Category folder names: spaces to underscores, lower case
+    text = str(value) if value is not None and value != '' else 'unknown'
+    return text.replace('/', '_').replace('\\', '_').replace(' ', '_').lower()
+
+
+def template_value(name: str, record: ImageRecord) -> Any:
+    if name == 'orientation':
+        return orientation(record)
+    if name in PATTERN_FIELDS:
+        values = _values(record, PATTERN_FIELDS[name])
+        if not values:
+            return None
+        # Model files are named without their folder and extension
+        return _stem(values[0]) if name in ('model', 'lora', 'vae') else values[0]
+    value = _number(getattr(record, name))
+    return None if value is None else (int(value) if value.is_integer() else value)
+
+
+def _pattern_check(rule_name: str, key: str, spec: Any) -> Check:
+    patterns = [spec] if isinstance(spec, str) else spec
+    if not isinstance(patterns, list) or not patterns or not all(isinstance(p, str) for p in patterns):
+        raise ValueError(f"Rule '{rule_name}': '{key}' must be a pattern or a list of patterns")
+    regex = re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns), re.IGNORECASE)
+    attribute = PATTERN_FIELDS[key]
+    stems = key in ('model', 'lora', 'vae')
+
+    def check(record, mtime):
+        for value in _values(record, attribute):
+            if regex.match(value) or (stems and regex.match(_stem(value))):
+                return True
+        return False
+    return check
+
+
+def _range(rule_name: str, key: str, spec: Any) -> Tuple[float, float]:
+    if isinstance(spec, (int, float)) and not isinstance(spec, bool):
+        return spec, spec
+    if isinstance(spec, dict) and spec and set(spec) <= {'min', 'max'}:
+        return spec.get('min', float('-inf')), spec.get('max', float('inf'))
+    raise ValueError(f"Rule '{rule_name}': '{key}' must be a number or {{\"min\": ..., \"max\": ...}}")
+
+
+def _number_check(rule_name: str, key: str, spec: Any) -> Check:
+    low, high = _range(rule_name, key, spec)
+
+    def check(record, mtime):
+        value = _number(getattr(record, key))
+        return value is not None and low <= value <= high
+    return check
+
+
+def _date_check(rule_name: str, spec: Any) -> Check:
+    # On the file's modification time; "after" is inclusive, "before" exclusive
+    if not isinstance(spec, dict) or not spec or not set(spec) <= {'after', 'before'}:
+        raise ValueError(f"Rule '{rule_name}': 'date' must be {{\"after\": \"YYYY-MM-DD\", \"before\": \"YYYY-MM-DD\"}}")
+    try:
+        after = datetime.fromisoformat(spec['after']).timestamp() if 'after' in spec else float('-inf')
+        before = datetime.fromisoformat(spec['before']).timestamp() if 'before' in spec else float('inf')
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Rule '{rule_name}': bad date: {e}")
+    return lambda record, mtime: after <= mtime < before
+
+
+def _orientation_check(rule_name: str, spec: Any) -> Check:
+    if spec not in ORIENTATIONS:
+        raise ValueError(f"Rule '{rule_name}': 'orientation' must be one of " + ', '.join(ORIENTATIONS))
+    return lambda record, mtime: orientation(record) == spec
+
+
+@dataclass(slots=True)
+class Rule:
+    name: str
+    template: str
+    template_fields: List[str]
+    action: str = 'move'
+    priority: float = 0
+    keep_going: bool = False
+    checks: List[Check] = field(default_factory=list)
+    needs_date: bool = False
+    # Index of the rule's keyword list in the shared CategoryMatcher
+    keyword_category: Optional[int] = None
+
+    def directory(self, record: ImageRecord, keyword: Optional[str], mtime: Optional[float]) -> str:
+        values: Dict[str, Any] = {}
+        for name in self.template_fields:
+            if name == 'name':
+                values[name] = path_part(self.name)
+            elif name == 'keyword':
+                values[name] = path_part(keyword)
+            elif name == 'date':
+                values[name] = TemplateDate.fromtimestamp(mtime)
+            else:
+                values[name] = path_part(template_value(name, record))
+        parts = [part for part in self.template.format_map(values).replace('\\', '/').split('/') if part not in ('', '.')]
+        if not parts or '..' in parts:
+            raise ValueError(f"Rule '{self.name}' gives the folder '{self.template.format_map(values)}', outside the output directory")
+        return os.path.join(*parts)
+
+
+def compile_rule(spec: Dict[str, Any]) -> Tuple[Rule, Optional[List[str]]]:
+    # Returns the rule and its keywords, if it has any
+    if not isinstance(spec, dict) or not isinstance(spec.get('name'), str) or not spec['name']:
+        raise ValueError("Every rule needs a 'name': " + json.dumps(spec))
+    name = spec['name']
+    unknown = set(spec) - RULE_KEYS
+    if unknown:
+        raise ValueError(f"Rule '{name}': unknown setting " + ', '.join(sorted(unknown)))
+    template = spec.get('to')
+    if not isinstance(template, str) or not template.strip():
+        raise ValueError(f"Rule '{name}' needs a 'to' folder template")
+    try:
+        template_fields = sorted({field_name for _, field_name, _, _ in Formatter().parse(template) if field_name is not None})
+    except ValueError as e:
+        raise ValueError(f"Rule '{name}': bad template '{template}': {e}")
+    bad_fields = set(template_fields) - TEMPLATE_FIELDS - {'name', 'keyword', 'date'}
+    if bad_fields:
+        raise ValueError(f"Rule '{name}': unknown template field " + ', '.join(sorted(bad_fields)))
+    action = spec.get('action', 'move')
+    if action not in MODES:
+        raise ValueError(f"Rule '{name}': 'action' must be one of " + ', '.join(MODES))
+
+    keywords = spec.get('keywords')
+    if keywords is not None and (not isinstance(keywords, list) or not all(isinstance(k, str) for k in keywords)):
+        raise ValueError(f"Rule '{name}': 'keywords' must be a list of strings")
+    if 'keyword' in template_fields and keywords is None:
+        raise ValueError(f"Rule '{name}': {{keyword}} needs a 'keywords' list or 'keywords_file'")
+
+    priority = spec.get('priority', 0)
+    if isinstance(priority, bool) or not isinstance(priority, (int, float)):
+        raise ValueError(f"Rule '{name}': 'priority' must be a number")
+
+    rule = Rule(name, template, template_fields, action, priority, bool(spec.get('continue', False)))
+    for key, value in spec.items():
+        if key in PATTERN_FIELDS:
+            rule.checks.append(_pattern_check(name, key, value))
+        elif key in NUMBER_FIELDS:
+            rule.checks.append(_number_check(name, key, value))
+        elif key == 'orientation':
+            rule.checks.append(_orientation_check(name, value))
+        elif key == 'date':
+            rule.checks.append(_date_check(name, value))
+    rule.needs_date = 'date' in spec or 'date' in template_fields
+    return rule, keywords
+
+
+class RuleSet:
+    # Rules in priority order (highest first, file order among equals). The first matching rule
+    # decides; one with "continue": true adds its folder and lets the next ones match as well.
+    def __init__(self, specs: Sequence[Dict[str, Any]], whole_words: bool = False, matcher_cache: Optional[str] = None):
+        compiled = [compile_rule(spec) for spec in specs]
+        compiled.sort(key=lambda item: -item[0].priority)
+        self.rules = [rule for rule, _ in compiled]
+
+        categories = []
+        # Matcher category -> rule position
+        self.keyword_rules: List[int] = []
+        self.unconditional: List[int] = []
+        for position, (rule, keywords) in enumerate(compiled):
+            if keywords is None:
+                self.unconditional.append(position)
+                continue
+            rule.keyword_category = len(categories)
+            categories.append((rule.name, keywords))
+            self.keyword_rules.append(position)
+        self.matcher = compile_matcher(categories, whole_words, matcher_cache) if categories else None
+        self.needs_date = any(rule.needs_date for rule in self.rules)
+
+    def top_dirs(self) -> List[str]:
+        # First folder of every template that starts with a fixed one, e.g. 'characters'
+        dirs = []
+        for rule in self.rules:
+            literal = rule.template.replace('\\', '/').split('{', 1)[0]
+            if '/' in literal and literal.split('/', 1)[0] not in ('', '.', '..'):
+                dirs.append(literal.split('/', 1)[0])
+        return dirs
+
+    def decide(self, record: ImageRecord, file_path: Optional[str] = None) -> Optional[Decision]:
+        keyword_matches = self.matcher.match_all(record.node_texts, record.prompts) if self.matcher else {}
+        positions = self.unconditional
+        if keyword_matches:
+            positions = sorted(positions + [self.keyword_rules[category] for category in keyword_matches])
+        mtime = os.stat(file_path).st_mtime if self.needs_date and file_path else None
+
+        label = None
+        placements: List[Placement] = []
+        moved = False
+        for position in positions:
+            rule = self.rules[position]
+            if rule.needs_date and mtime is None:
+                continue
+            if not all(check(record, mtime) for check in rule.checks):
+                continue
+            keyword = keyword_matches.get(rule.keyword_category)
+            directory = rule.directory(record, keyword, mtime)
+            if rule.action != 'move':
+                placements.append((directory, rule.action))
+            elif moved:
+                # An image is moved once; later move rules get the cheapest copy or link
+                placements.append((directory, 'auto'))
+            else:
+                moved = True
+                placements.insert(0, (directory, 'move'))
+            if label is None:
+                label = rule.name + '/' + keyword if keyword else rule.name
+            if not rule.keep_going:
+                break
+        return (label, placements) if placements else None
+
+
+def default_rules(categories: Sequence[Tuple[str, List[str]]]) -> List[Dict[str, Any]]:
+    # The built-in behaviour: one rule per wildcard file, in category order (see wildcards)
+    return [{'name': category, 'keywords': keywords, 'to': category + '/{keyword}'} for category, keywords in categories]
+
+
+def with_placement(specs: Sequence[Dict[str, Any]], placement: str) -> List[Dict[str, Any]]:
+    # The organize-wide placement mode is the action of every rule that doesn't pick its own
+    if placement not in MODES:
+        raise ValueError("Placement must be one of " + ', '.join(MODES))
+    return [spec if 'action' in spec or placement == 'move' else dict(spec, action=placement) for spec in specs]
+
+
+def read_rules(rules_file: str, matcher_cache: Optional[str] = None) -> List[Dict[str, Any]]:
+    # A JSON list of rules, or {"rules": [...]}. keywords_file paths are read here, relative to
+    # the rules file or the install, so workers get plain keyword lists.
+    with open(rules_file, 'r', encoding='utf-8') as f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            raise ValueError("Cannot read " + rules_file + ": " + str(e))
+    specs = data.get('rules') if isinstance(data, dict) else data
+    if not isinstance(specs, list):
+        raise ValueError(rules_file + " must hold a list of rules")
+
+    rules = []
+    for spec in specs:
+        if isinstance(spec, dict) and 'keywords_file' in spec:
+            spec = dict(spec)
+            spec['keywords'] = spec.get('keywords', []) + read_wildcard_file(keywords_file_path(rules_file, spec.pop('keywords_file')))
+        rules.append(spec)
+    # Fail here rather than in every worker
+    RuleSet(rules, matcher_cache=matcher_cache)
+    return rules
+
+
+def keywords_file_path(rules_file: str, keywords_file: str) -> str:
+    path = os.path.join(os.path.dirname(rules_file), keywords_file)
+    return path if os.path.exists(path) else resolve_app_path(keywords_file)
+
+
+def rules_sources(rules_file: Optional[str], wildcards_dir: str) -> List[str]:
+    # The files the rules are read from: the rules file and its keywords files if there is a
+    # rules file, otherwise the wildcards folder (for files added or removed) and its files
+    rules_file = resolve_app_path(rules_file) if rules_file else None
+    if rules_file and os.path.exists(rules_file):
+        sources = [rules_file]
+        try:
+            with open(rules_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            specs = data.get('rules') if isinstance(data, dict) else data
+            sources.extend(keywords_file_path(rules_file, spec['keywords_file']) for spec in specs
+                           if isinstance(spec, dict) and isinstance(spec.get('keywords_file'), str))
+        except (OSError, ValueError, TypeError, AttributeError):
+            pass
+        return sources
+    wildcards_dir = resolve_app_path(wildcards_dir)
+    return [wildcards_dir] + [file_path for _, file_path in category_files(wildcards_dir)]
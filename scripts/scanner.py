@@ -0,0 +1,151 @@
+import os
+import re
+import json
+import time
+import fnmatch
+import hashlib
+import logging
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+# Finds the PNGs under an input folder. Lists each directory once with os.scandir, never enters
+# folders the organizer writes to (category folders by name, and the output folder wherever it
+# is), skips names matching the ignore globs, and, given a metadata index, skips listing
+# directories whose mtime hasn't changed since a previous scan with the same settings.
+#
+# A directory's mtime changes when a file is added, removed or renamed in it, not when a file
+# is rewritten in place; scan with rescan=True after editing images in place.
+
+# Category folders created by the organizer (and dedupe); never rescanned as input
+CATEGORY_DIRS = ('characters', 'locations', 'duplicates')
+
+# Directories modified this recently may still change within the same mtime tick (FAT and
+# some network filesystems have 1-2 second timestamps), so they are listed again next time
+RACY_SECONDS = 2
+
+
+def is_png(name: str) -> bool:
+    return name.lower().endswith('.png')
+
+
+def compile_ignore(globs: Sequence[str]) -> Optional[Callable[[str], bool]]:
+    # One regex for all globs; a glob matches a file or folder name, or a path relative to the
+    # scanned folder ("*_preview.png", "tmp", "2024-*/upscaled")
+    if not globs:
+        return None
+    pattern = re.compile('|'.join(fnmatch.translate(os.path.normcase(glob).replace('\\', '/')) for glob in globs))
+    return lambda name: pattern.match(os.path.normcase(name).replace('\\', '/')) is not None
+
+
+def make_exclusion(exclude_dirs: Sequence[str] = (), skip_dirs=CATEGORY_DIRS, ignore: Sequence[str] = ()) -> Callable[[str], bool]:
+    # Whether a directory is never to be scanned: a category folder, inside one of exclude_dirs
+    # (the output folder, even when nested inside the input), or matching an ignore glob
+    exclude_dirs = [os.path.abspath(directory) for directory in exclude_dirs if directory]
+    is_ignored = compile_ignore(ignore)
+
+    def is_excluded(dir_path: str) -> bool:
+        dir_path = os.path.abspath(dir_path)
+        return (os.path.basename(dir_path) in skip_dirs
+                or any(dir_path == directory or dir_path.startswith(directory + os.sep) for directory in exclude_dirs)
+                or (is_ignored is not None and is_ignored(os.path.basename(dir_path))))
+    return is_excluded
+
+
+def scan_key(*parts) -> str:
+    # Recorded directories are only valid for the settings they were scanned with
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+class DirectoryScanner:
+    def __init__(self, base_path: str, skip_dirs=CATEGORY_DIRS, exclude_dirs: Sequence[str] = (), ignore: Sequence[str] = (),
+                 index=None, key: Optional[str] = None, rescan: bool = False):
+        # index and key turn on skipping unchanged directories; nothing is skipped with rescan,
+        # but the directories are still recorded for next time
+        self.base_path = base_path
+        self.skip_dirs = set(skip_dirs)
+        self.is_excluded = make_exclusion(exclude_dirs, (), ())
+        self.has_exclusions = any(exclude_dirs)
+        self.is_ignored = compile_ignore(ignore)
+        self.index = index if key else None
+        self.key = key
+        self.known: Dict[str, Tuple[int, List[str]]] = {}
+        if self.index is not None and not rescan:
+            self.known = self.index.get_scanned_dirs(key)
+        # abspath -> (mtime_ns, subdirectory names) of the directories listed this time
+        self.listed: Dict[str, Tuple[int, List[str]]] = {}
+        self.dirty: Set[str] = set()
+        self.skipped = self.listed_count = 0
+
+    def __iter__(self) -> Iterator[str]:
+        # Same order as os.walk: a directory's files, then each subdirectory in turn
+        track = self.index is not None
+        racy_after = time.time_ns() - RACY_SECONDS * 1_000_000_000
+        base_abs = os.path.abspath(self.base_path)
+        stack: List[Tuple[str, str, Optional[int]]] = [(self.base_path, base_abs, None)]
+        while stack:
+            path, abs_path, mtime_ns = stack.pop()
+            if track and mtime_ns is None:
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+            known = self.known.get(abs_path)
+            if known is not None and known[0] == mtime_ns:
+                # Same entries as last time: only the subdirectories can hold anything new
+                self.skipped += 1
+                stack.extend((os.path.join(path, name), os.path.join(abs_path, name), None) for name in reversed(known[1]))
+                continue
+
+            files = []
+            subdirs = []
+            # Ignore globs also match paths relative to the scanned folder
+            prefix = ''
+            if self.is_ignored is not None and abs_path != base_abs:
+                prefix = os.path.relpath(abs_path, base_abs).replace(os.sep, '/') + '/'
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        name = entry.name
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        if is_dir:
+                            # Like os.walk, symlinked folders are not followed
+                            if (name in self.skip_dirs or entry.is_symlink() or self._ignored(name, prefix)
+                                    or (self.has_exclusions and self.is_excluded(entry.path))):
+                                continue
+                            subdirs.append((name, self._mtime(entry) if track else None))
+                        elif is_png(name) and not self._ignored(name, prefix):
+                            files.append(entry.path)
+            except OSError as e:
+                logging.warning("Cannot list " + path + ": " + (e.strerror or str(e)))
+                continue
+
+            self.listed_count += 1
+            if track and mtime_ns < racy_after:
+                self.listed[abs_path] = (mtime_ns, [name for name, _ in subdirs])
+            yield from files
+            stack.extend((os.path.join(path, name), os.path.join(abs_path, name), subdir_mtime)
+                         for name, subdir_mtime in reversed(subdirs))
+
+    @staticmethod
+    def _mtime(entry: os.DirEntry) -> Optional[int]:
+        # Free from the directory listing on Windows; one lstat elsewhere
+        try:
+            return entry.stat(follow_symlinks=False).st_mtime_ns
+        except OSError:
+            return None
+
+    def _ignored(self, name: str, prefix: str) -> bool:
+        return self.is_ignored is not None and (self.is_ignored(name) or (prefix and self.is_ignored(prefix + name)))
+
+    def mark_dirty(self, file_path: str):
+        # A file that was moved, placed or failed: list its directory again next time
+        self.dirty.add(os.path.dirname(os.path.abspath(file_path)))
+
+    def save(self):
+        # Records the directories listed this time that had nothing left to do
+        if self.index is None:
+            return
+        self.index.put_scanned_dirs(self.key, [(path, mtime_ns, subdirs) for path, (mtime_ns, subdirs) in self.listed.items()
+                                               if path not in self.dirty])
@@ -0,0 +1,160 @@
+import os
+import glob
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+from scripts import metrics
+from scripts.metadata_index import MetadataIndex
+from scripts.move_plan import JOURNAL_FILE, resume_moves
+from scripts.organizer import load_rules, make_scanner, organize_images
+from scripts.read_ahead import DEFAULT_IO_DEPTH
+from scripts.rules import RULES_FILE
+from scripts.scanner import scan_key
+from scripts.work_queue import DEFAULT_LEASE_SECONDS, QUEUE_FILE, LeaseKeeper, WorkQueue, default_worker_id
+
+# Organizing one input tree with several workers, on one machine or several sharing the storage:
+# every worker runs organize_sharded with the same queue file (see work_queue). The first lists
+# the input tree and splits it into shards of one directory's files; each worker then organizes
+# shard after shard into its own metadata index, with a move journal per shard, both next to
+# the queue, and the last shard's worker merges the indexes into the run's index.
+
+# Files per shard; larger directories are split into several
+SHARD_FILES = 1000
+
+# Seconds between asks while the other workers finish their shards: from the first, doubling
+# up to the last, so a worker idles briefly while the plan is made but doesn't keep the queue busy
+POLL_SECONDS = (0.05, 2.0)
+
+
+def plan_shards(base_path, output_dir, rules, node_defaults, whole_words, ignore, matcher_cache=None) -> List[Tuple[str, List[str]]]:
+    by_dir: Dict[str, List[str]] = {}
+    for file_path in make_scanner('organize', base_path, rules, node_defaults, whole_words, None, output_dir, ignore,
+                                  matcher_cache=matcher_cache):
+        by_dir.setdefault(os.path.dirname(file_path), []).append(file_path)
+    shards = []
+    for directory, files in by_dir.items():
+        for start in range(0, len(files), SHARD_FILES):
+            shards.append((directory, files[start:start + SHARD_FILES]))
+    return shards
+
+
+def journal_path_for(queue_dir, task_id):
+    # Per shard rather than per worker: a worker that gave a shard back and went on to the next
+    # never writes the journal the shard's next holder finishes
+    return os.path.join(queue_dir, f"{os.path.splitext(os.path.basename(JOURNAL_FILE))[0]}-{task_id}.jsonl")
+
+
+def shard_index_for(shard_dir, worker_id):
+    return os.path.join(shard_dir, worker_id + '.sqlite')
+
+
+def finish_interrupted(journal_path, shard_index=None):
+    # Finishes the moves the shard's previous holder had journaled, so the shard is not
+    # organized twice: an image it had linked to its destination but not yet unlinked from the
+    # input would otherwise be moved again under another name. shard_index is the index of a
+    # holder whose lease expired; one that gave the shard back is still writing its own.
+    if not os.path.exists(journal_path):
+        return
+    logging.warning("Finishing the moves left in " + journal_path)
+    index = MetadataIndex(shard_index) if shard_index else None
+    try:
+        resume_moves(journal_path, index.move if index else None)
+    finally:
+        if index:
+            index.close()
+
+
+def merge_shard_indexes(shard_dir, index_path, base_path):
+    index = MetadataIndex(index_path)
+    try:
+        for shard_path in sorted(glob.glob(os.path.join(shard_dir, '*.sqlite'))):
+            merged = index.merge(shard_path)
+            logging.info(f"Merged {merged} entries from {shard_path}")
+            # A later run starts its shards afresh
+            for path in glob.glob(shard_path + '*'):
+                os.remove(path)
+        # Entries for the files the workers moved away
+        index.prune(under=base_path)
+    finally:
+        index.close()
+
+
+def organize_sharded(base_path, output_dir, node_defaults, queue_path=QUEUE_FILE, worker_id: Optional[str] = None,
+                     lease_seconds=DEFAULT_LEASE_SECONDS, workers=None, index_path=None, whole_words=False,
+                     rules_file=RULES_FILE, placement='move', ignore=(), io_depth=DEFAULT_IO_DEPTH, matcher_cache=None) -> int:
+    # Works on the run in queue_path until it is finished, then returns the tasks given up on.
+    # A worker that is stopped or dies loses its lease, and its shard goes to another worker once
+    # the lease expires, which first finishes the moves journaled for it.
+    worker_id = worker_id or default_worker_id()
+    queue_dir = os.path.dirname(os.path.abspath(queue_path))
+    shard_dir = os.path.join(queue_dir, 'shard_indexes')
+    shard_index = shard_index_for(shard_dir, worker_id) if index_path else None
+    os.makedirs(shard_dir, exist_ok=True)
+
+    rules = load_rules(rules_file, placement=placement, matcher_cache=matcher_cache)
+    queue = WorkQueue(queue_path)
+    # The run summary covers every shard this worker organized
+    total = metrics.Metrics()
+    try:
+        queue.check_settings({
+            'input': os.path.abspath(base_path),
+            'output': os.path.abspath(output_dir),
+            # The rules themselves can be large with wildcard categories
+            'rules': scan_key(rules),
+            'placement': placement,
+            'ignore': list(ignore),
+            'whole_words': whole_words,
+            'node_defaults': node_defaults,
+            'index': bool(index_path)
+        })
+        poll = POLL_SECONDS[0]
+        while True:
+            lease = queue.claim(worker_id, lease_seconds)
+            if lease is None:
+                if queue.finished():
+                    break
+                time.sleep(poll)
+                poll = min(poll * 2, POLL_SECONDS[1])
+                continue
+            poll = POLL_SECONDS[0]
+            with LeaseKeeper(queue, lease, worker_id, lease_seconds) as keeper:
+                try:
+                    shards = ()
+                    if lease.kind == 'plan':
+                        shards = plan_shards(base_path, output_dir, rules, node_defaults, whole_words, ignore, matcher_cache)
+                        logging.info(f"{sum(len(files) for _, files in shards)} files in {len(shards)} shards")
+                    elif lease.kind == 'files':
+                        # A shard taken over may have had some of its files moved already
+                        files = lease.files
+                        journal_path = journal_path_for(queue_dir, lease.task_id)
+                        if lease.attempt > 1:
+                            expired = index_path and lease.previous_owner
+                            finish_interrupted(journal_path, shard_index_for(shard_dir, lease.previous_owner) if expired else None)
+                            files = [f for f in files if os.path.exists(f)]
+                        organize_images(base_path, output_dir, node_defaults, workers=workers, index_path=shard_index,
+                                        whole_words=whole_words, journal_path=journal_path, cancel=keeper.lost,
+                                        rules_file=rules_file, placement=placement, ignore=ignore, io_depth=io_depth,
+                                        files=files, matcher_cache=matcher_cache)
+                        total.merge(metrics.current().drain())
+                    elif lease.kind == 'merge' and index_path:
+                        merge_shard_indexes(shard_dir, index_path, base_path)
+                except Exception as e:
+                    logging.exception(f"Error in {lease.kind} task {lease.task_id} {lease.directory}")
+                    queue.fail(lease, worker_id, str(e))
+                    continue
+            if keeper.lost.is_set():
+                # Back to the others straight away, unless one has taken it over already
+                queue.fail(lease, worker_id, "lease lost")
+            elif not queue.complete(lease, worker_id, shards):
+                logging.warning(f"Task {lease.task_id} was taken over by another worker")
+
+        failures = queue.failures()
+        for kind, directory, error in failures:
+            logging.error(f"Gave up on {kind} task {directory}: {error}")
+        return len(failures)
+    finally:
+        queue.close()
+        registry = metrics.current()
+        registry.reset()
+        registry.started = total.started
+        registry.merge(total.drain())
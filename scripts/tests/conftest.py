@@ -0,0 +1,26 @@
+import shutil
+import pytest
+from scripts.metadata_extractor import DEFAULT_NODE_DEFAULTS
+from scripts.organizer import organize_images
+from scripts.tests.corpus import write_corpus
+from scripts.tests.helpers import files_under, write_rules
+
+# Run with: python -m pytest scripts/tests
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    # 60 small images with metadata in three folders
+    corpus_dir = tmp_path / 'corpus'
+    write_corpus(str(corpus_dir), 60, size=16, workflow_kb=10, mix={'comfyui': 3, 'a1111': 1}, per_dir=20)
+    return str(corpus_dir)
+
+
+@pytest.fixture
+def reference(tmp_path, corpus):
+    # (output, input left) of a single-process run
+    work = tmp_path / 'reference'
+    shutil.copytree(corpus, work / 'in')
+    organize_images(str(work / 'in'), str(work / 'out'), DEFAULT_NODE_DEFAULTS, workers=1, index_path=None,
+                    journal_path=str(work / 'journal.jsonl'), rules_file=write_rules(str(work)))
+    return files_under(work / 'out'), files_under(work / 'in')
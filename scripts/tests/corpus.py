@@ -0,0 +1,113 @@
+import os
+import json
+import random
+from typing import Dict, List, Optional
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+# Synthetic Stable Diffusion outputs, for the tests and the benchmarks. To write a corpus to
+# disk, see scripts.benchmarks.corpus.
+
+SUBJECTS = ["Alice Smith", "Bob Jones", "Martin Van Buren", "Forest", "Castle", "Beach", "a cat"]
+STYLES = ["highly detailed", "cinematic lighting", "bokeh", "masterpiece", "oil painting", "35mm photo"]
+
+# comfyui: a small API prompt plus a UI workflow with a ShowText node
+# a1111: an A1111/Forge "parameters" text chunk
+# large: a ComfyUI workflow padded to workflow_kb, like a big graph with notes and groups
+# none: a PNG without generation metadata
+KINDS = ('comfyui', 'a1111', 'large', 'none')
+
+# File name prefixes, so the kind of an image can be told from its name
+KIND_PREFIXES = {
+    'comfyui': 'ComfyUI',
+    'a1111': 'A1111',
+    'large': 'ComfyUILarge',
+    'none': 'Plain'
+}
+
+# Roughly what one filler node adds to the workflow JSON
+FILLER_NODE_BYTES = 420
+
+
+def filler_nodes(count: int, first_id: int = 100) -> List[dict]:
+    # Typical UI-only nodes that pad real workflows (groups, reroutes, previews, notes)
+    return [
+        {"id": first_id + i, "type": "Note", "pos": [i * 10, i * 20], "size": {"0": 400, "1": 200}, "flags": {}, "order": i, "mode": 0,
+         "properties": {"Node name for S&R": "Note"}, "widgets_values": [f"note {i}: " + "lorem ipsum dolor sit amet " * 8]}
+        for i in range(count)
+    ]
+
+
+def comfyui_pnginfo(text: str, seed: int, extra_nodes: int = 60) -> PngInfo:
+    prompt = {
+        "3": {"class_type": "KSampler", "inputs": {"seed": seed, "steps": 20, "cfg": 7.0, "sampler_name": "euler", "scheduler": "normal", "denoise": 1.0, "model": ["4", 0], "positive": ["6", 0], "negative": ["7", 0], "latent_image": ["5", 0]}},
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sd_xl_base_1.0.safetensors"}},
+        "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 1024, "height": 1024, "batch_size": 1}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": text, "clip": ["4", 1]}},
+        "7": {"class_type": "CLIPTextEncode", "inputs": {"text": "blurry, lowres", "clip": ["4", 1]}},
+        "8": {"class_type": "VAELoader", "inputs": {"vae_name": "sdxl_vae.safetensors"}}
+    }
+    workflow = {
+        "nodes": [
+            {"id": 9, "type": "ShowText|pysssss", "properties": {"Node name for S&R": "ShowText|pysssss"}, "widgets_values": [[text]]},
+            {"id": 6, "type": "CLIPTextEncode", "properties": {"Node name for S&R": "CLIPTextEncode"}, "widgets_values": [text]}
+        ] + filler_nodes(extra_nodes),
+        "links": [[1, 4, 0, 3, 0, "MODEL"], [2, 6, 0, 3, 1, "CONDITIONING"], [3, 7, 0, 3, 2, "CONDITIONING"], [4, 4, 1, 6, 0, "CLIP"]]
+    }
+    info = PngInfo()
+    info.add_text("prompt", json.dumps(prompt))
+    info.add_text("workflow", json.dumps(workflow))
+    return info
+
+
+def a1111_pnginfo(text: str, seed: int) -> PngInfo:
+    info = PngInfo()
+    info.add_text("parameters", f"{text}\nNegative prompt: blurry, lowres, bad anatomy\n"
+                                f"Steps: 28, Sampler: DPM++ 2M Karras, CFG scale: 6.5, Seed: {seed}, Size: 832x1216, "
+                                f"Model hash: 31e35c80fc, Model: juggernautXL_v9, Clip skip: 2, Version: v1.9.4")
+    return info
+
+
+def pnginfo_for(kind: str, text: str, seed: int, workflow_kb: int = 500) -> Optional[PngInfo]:
+    if kind == 'comfyui':
+        return comfyui_pnginfo(text, seed)
+    if kind == 'a1111':
+        return a1111_pnginfo(text, seed)
+    if kind == 'large':
+        return comfyui_pnginfo(text, seed, extra_nodes=workflow_kb * 1024 // FILLER_NODE_BYTES)
+    return None
+
+
+def kind_of(path: str) -> str:
+    prefix = os.path.basename(path).split('_', 1)[0]
+    for kind, kind_prefix in KIND_PREFIXES.items():
+        if prefix == kind_prefix:
+            return kind
+    return 'comfyui'
+
+
+def write_corpus(output_dir: str, count: int, size: int = 256, seed: int = 0, mix: Optional[Dict[str, float]] = None,
+                 workflow_kb: int = 500, per_dir: Optional[int] = None, noise: bool = False) -> List[str]:
+    # mix weights the kinds of image (default: all comfyui); per_dir spreads the images over
+    # subfolders like ComfyUI's dated output folders; noise makes the pixels compress like a render
+    rng = random.Random(seed)
+    kinds = list(mix) if mix else ['comfyui']
+    weights = [mix[kind] for kind in kinds] if mix else None
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for i in range(count):
+        text = f"a photo of {rng.choice(SUBJECTS)}, highly detailed"
+        kind = rng.choices(kinds, weights)[0] if len(kinds) > 1 else kinds[0]
+        if kind != 'comfyui':
+            text += ", " + rng.choice(STYLES)
+        directory = os.path.join(output_dir, f"{i // per_dir:04d}") if per_dir else output_dir
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{KIND_PREFIXES[kind]}_{i:05d}_.png")
+        if noise:
+            img = Image.frombytes("RGB", (size, size), rng.randbytes(size * size * 3))
+        else:
+            img = Image.new("RGB", (size, size), (i % 256, 64, 128))
+        pnginfo = pnginfo_for(kind, text, i, workflow_kb)
+        img.save(path, pnginfo=pnginfo, compress_level=1 if noise else 6)
+        paths.append(path)
+    return paths
@@ -0,0 +1,40 @@
+import os
+import json
+import time
+import sqlite3
+
+# Shared by the tests and the benchmarks: rules for the synthetic corpus (see corpus), and
+# ways to look at a run from outside.
+
+# Categories matching the subjects corpus.write_corpus puts in its prompts
+CHARACTERS = ["Alice Smith", "Bob Jones", "Martin Van Buren"]
+LOCATIONS = ["Forest", "Castle", "Beach"]
+
+
+def write_rules(work_dir):
+    from scripts.rules import default_rules
+    rules_file = os.path.join(work_dir, 'rules.json')
+    with open(rules_file, 'w', encoding='utf-8') as f:
+        json.dump(default_rules([('characters', CHARACTERS), ('locations', LOCATIONS)]), f)
+    return rules_file
+
+
+def files_under(directory):
+    # Relative paths of every file below directory, sorted
+    return sorted(os.path.relpath(os.path.join(root, file), directory) for root, _, files in os.walk(directory) for file in files)
+
+
+def wait_for_shard(queue_path, worker_id):
+    # Until the worker is partway through organizing a shard
+    while True:
+        try:
+            conn = sqlite3.connect(queue_path)
+            try:
+                if conn.execute("SELECT 1 FROM tasks WHERE kind = 'files' AND state = 'leased' AND owner = ?", (worker_id,)).fetchone():
+                    time.sleep(0.05)
+                    return
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+        time.sleep(0.01)
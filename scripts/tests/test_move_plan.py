@@ -0,0 +1,124 @@
+import os
+import pytest
+from scripts.move_plan import MoveJournal, MovePlan, apply_plan, resume_moves, rollback_moves
+from scripts.placement import move_no_clobber
+from scripts.tests.helpers import files_under
+
+# Two-phase organizing: a plan is applied under a journal, and a run interrupted at any point
+# can be finished or undone without losing, duplicating or overwriting an image.
+
+
+@pytest.fixture
+def images(tmp_path):
+    # Four images in the input, two of them with the same name
+    paths = []
+    for folder, name in (('a', 'one.png'), ('a', 'two.png'), ('b', 'one.png'), ('b', 'three.png')):
+        os.makedirs(tmp_path / 'in' / folder, exist_ok=True)
+        path = tmp_path / 'in' / folder / name
+        path.write_bytes((folder + name).encode())
+        paths.append(str(path))
+    return paths
+
+
+def plan_for(images, output_dir):
+    plan = MovePlan()
+    for path in images:
+        plan.add(path, output_dir)
+    return plan
+
+
+def contents(directory):
+    return {name: (directory / name).read_bytes() for name in files_under(directory)}
+
+
+def interrupt(plan, journal_path):
+    # The state a crash leaves: the first move made and marked done, the second made without
+    # its done line, the third linked but its source not yet unlinked, the fourth not started
+    journal = MoveJournal(journal_path)
+    journal.begin(plan.moves)
+    for move in plan.moves:
+        os.makedirs(os.path.dirname(move.dest), exist_ok=True)
+    move_no_clobber(plan.moves[0].source, plan.moves[0].dest)
+    journal.mark_done(0)
+    move_no_clobber(plan.moves[1].source, plan.moves[1].dest)
+    os.link(plan.moves[2].source, plan.moves[2].dest)
+    journal.close()
+
+
+def test_apply(tmp_path, images):
+    journal_path = str(tmp_path / 'journal.jsonl')
+    assert apply_plan(plan_for(images, str(tmp_path / 'out')), journal_path) == 4
+    assert contents(tmp_path / 'out') == {'one.png': b'aone.png', 'two.png': b'atwo.png', 'one(1).png': b'bone.png',
+                                          'three.png': b'bthree.png'}
+    assert files_under(tmp_path / 'in') == []
+    assert not os.path.exists(journal_path)
+
+
+def test_names_taken_before_the_run_are_kept(tmp_path, images):
+    os.makedirs(tmp_path / 'out')
+    (tmp_path / 'out' / 'one.png').write_bytes(b'already there')
+    apply_plan(plan_for(images, str(tmp_path / 'out')), str(tmp_path / 'journal.jsonl'))
+    assert contents(tmp_path / 'out') == {'one.png': b'already there', 'one(1).png': b'aone.png', 'two.png': b'atwo.png',
+                                          'one(2).png': b'bone.png', 'three.png': b'bthree.png'}
+
+
+def test_resume(tmp_path, images):
+    journal_path = str(tmp_path / 'journal.jsonl')
+    interrupt(plan_for(images, str(tmp_path / 'out')), journal_path)
+    moved = []
+    resume_moves(journal_path, lambda source, dest: moved.append(os.path.basename(dest)))
+    assert contents(tmp_path / 'out') == {'one.png': b'aone.png', 'two.png': b'atwo.png', 'one(1).png': b'bone.png',
+                                          'three.png': b'bthree.png'}
+    assert files_under(tmp_path / 'in') == []
+    assert not os.path.exists(journal_path)
+    # Every move not marked done is reported, whether it had been made or not
+    assert moved == ['two.png', 'one(1).png', 'three.png']
+
+
+def test_rollback(tmp_path, images):
+    journal_path = str(tmp_path / 'journal.jsonl')
+    before = contents(tmp_path / 'in')
+    interrupt(plan_for(images, str(tmp_path / 'out')), journal_path)
+    assert rollback_moves(journal_path) == 2
+    assert contents(tmp_path / 'in') == before
+    assert files_under(tmp_path / 'out') == []
+    assert not os.path.exists(journal_path)
+
+
+def test_rollback_removes_copies(tmp_path, images):
+    journal_path = str(tmp_path / 'journal.jsonl')
+    plan = MovePlan()
+    dest = plan.add(images[0], str(tmp_path / 'out'))
+    plan.add(dest, str(tmp_path / 'copies'), 'copy')
+    journal = MoveJournal(journal_path)
+    journal.begin(plan.moves)
+    for move in plan.moves:
+        os.makedirs(os.path.dirname(move.dest), exist_ok=True)
+    move_no_clobber(plan.moves[0].source, plan.moves[0].dest)
+    with open(plan.moves[0].dest, 'rb') as src, open(plan.moves[1].dest, 'wb') as dst:
+        dst.write(src.read())
+    os.utime(plan.moves[1].dest, ns=(os.stat(dest).st_atime_ns, os.stat(dest).st_mtime_ns))
+    journal.close()
+
+    rollback_moves(journal_path)
+    assert files_under(tmp_path / 'out') == files_under(tmp_path / 'copies') == []
+    assert os.path.exists(images[0])
+
+
+def test_an_unfinished_run_blocks_the_next(tmp_path, images):
+    journal_path = str(tmp_path / 'journal.jsonl')
+    interrupt(plan_for(images, str(tmp_path / 'out')), journal_path)
+    with pytest.raises(RuntimeError):
+        apply_plan(plan_for([images[3]], str(tmp_path / 'other')), journal_path)
+    assert not os.path.exists(tmp_path / 'other')
+
+
+def test_a_name_taken_while_applying(tmp_path, images):
+    # Another process takes a planned name after the plan was made
+    journal_path = str(tmp_path / 'journal.jsonl')
+    plan = plan_for(images, str(tmp_path / 'out'))
+    os.makedirs(tmp_path / 'out')
+    (tmp_path / 'out' / 'two.png').write_bytes(b'someone else')
+    apply_plan(plan, journal_path)
+    assert contents(tmp_path / 'out')['two.png'] == b'someone else'
+    assert sorted(contents(tmp_path / 'out').values()) == sorted([b'someone else', b'aone.png', b'atwo.png', b'bone.png', b'bthree.png'])
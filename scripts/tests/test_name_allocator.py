@@ -0,0 +1,58 @@
+import os
+from scripts.name_allocator import NameAllocator
+
+# Collision-free names from one listing of each directory: the numbering continues after the
+# highest name(N) present, and nothing handed out is handed out again.
+
+
+def touch(directory, *names):
+    os.makedirs(directory, exist_ok=True)
+    for name in names:
+        open(os.path.join(directory, name), 'w').close()
+
+
+def test_free_name_is_kept(tmp_path):
+    assert NameAllocator().allocate(str(tmp_path), 'a.png') == str(tmp_path / 'a.png')
+
+
+def test_collisions_are_numbered_in_turn(tmp_path):
+    allocator = NameAllocator()
+    names = [os.path.basename(allocator.allocate(str(tmp_path), 'a.png')) for _ in range(4)]
+    assert names == ['a.png', 'a(1).png', 'a(2).png', 'a(3).png']
+
+
+def test_numbering_continues_after_the_highest(tmp_path):
+    touch(tmp_path, 'a.png', 'a(1).png', 'a(7).png', 'b(9).png')
+    allocator = NameAllocator()
+    assert allocator.allocate(str(tmp_path), 'a.png') == str(tmp_path / 'a(8).png')
+    assert allocator.allocate(str(tmp_path), 'b.png') == str(tmp_path / 'b.png')
+
+
+def test_names_that_look_numbered(tmp_path):
+    # "a(1).png" is a file of its own; a second one is numbered on its own base
+    touch(tmp_path, 'a.png', 'a(1).png')
+    allocator = NameAllocator()
+    assert allocator.allocate(str(tmp_path), 'a(1).png') == str(tmp_path / 'a(1)(1).png')
+    assert allocator.allocate(str(tmp_path), 'a.png') == str(tmp_path / 'a(2).png')
+
+
+def test_directory_is_listed_once(tmp_path):
+    allocator = NameAllocator()
+    assert allocator.allocate(str(tmp_path), 'a.png') == str(tmp_path / 'a.png')
+    # Created by someone else after the listing: unknown until reserved
+    touch(tmp_path, 'c.png')
+    assert allocator.allocate(str(tmp_path), 'c.png') == str(tmp_path / 'c.png')
+    allocator.reserve(str(tmp_path / 'c.png'))
+    assert allocator.allocate(str(tmp_path), 'c.png') == str(tmp_path / 'c(1).png')
+
+
+def test_missing_directory(tmp_path):
+    assert NameAllocator().allocate(str(tmp_path / 'new'), 'a.png') == str(tmp_path / 'new' / 'a.png')
+
+
+def test_in_use(tmp_path):
+    touch(tmp_path, 'a.png', 'a(2).png', 'ab.png')
+    allocator = NameAllocator()
+    allocator.allocate(str(tmp_path), 'a.png')
+    assert allocator.in_use(str(tmp_path), 'a.png') == [str(tmp_path / name) for name in ('a.png', 'a(2).png', 'a(3).png')]
+    assert allocator.in_use(str(tmp_path), 'b.png') == []
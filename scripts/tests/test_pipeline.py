@@ -0,0 +1,68 @@
+import os
+import shutil
+import pytest
+from scripts import organizer
+from scripts.metadata_extractor import DEFAULT_NODE_DEFAULTS
+from scripts.organizer import organize_images
+from scripts.pipeline import run_pipeline
+from scripts.tests.helpers import files_under, write_rules
+
+# The producer/worker/mover pipeline: results come back in order from any number of workers,
+# the in-process worker is torn down when the results are done with, and organizing with a
+# pool ends up where a single process does.
+
+# What the in-process initializer and finalizer did, in order
+calls = []
+
+
+def square_batch(batch):
+    return [(item, item * item, os.getpid()) for item in batch]
+
+
+def init_calls(tag):
+    calls.append(('init', tag))
+
+
+def close_calls():
+    calls.append(('close',))
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_results_in_submission_order(workers):
+    results = list(run_pipeline(range(100), square_batch, workers=workers, batch_size=7))
+    assert [(item, square) for item, square, _ in results] == [(i, i * i) for i in range(100)]
+    # One worker runs in this process, a pool in others
+    assert ({pid for _, _, pid in results} == {os.getpid()}) == (workers == 1)
+
+
+def test_finalizer_after_the_last_result():
+    calls.clear()
+    results = run_pipeline(range(10), square_batch, workers=1, initializer=init_calls, initargs=('a',), finalizer=close_calls)
+    assert len(list(results)) == 10
+    assert calls == [('init', 'a'), ('close',)]
+
+
+def test_finalizer_when_closed_early():
+    # As organize_images does when a run is cancelled
+    calls.clear()
+    results = run_pipeline(range(100), square_batch, workers=1, initializer=init_calls, initargs=('b',), finalizer=close_calls,
+                           batch_size=4)
+    next(results)
+    assert calls == [('init', 'b')]
+    results.close()
+    assert calls == [('init', 'b'), ('close',)]
+
+
+def test_in_process_organize_closes_its_worker(tmp_path, corpus):
+    shutil.copytree(corpus, tmp_path / 'in')
+    organize_images(str(tmp_path / 'in'), str(tmp_path / 'out'), DEFAULT_NODE_DEFAULTS, workers=1,
+                    index_path=str(tmp_path / 'index.sqlite'), journal_path=str(tmp_path / 'journal.jsonl'),
+                    rules_file=write_rules(str(tmp_path)))
+    assert organizer._worker_state == {}
+
+
+def test_pool_organizes_like_one_process(tmp_path, corpus, reference):
+    shutil.copytree(corpus, tmp_path / 'in')
+    organize_images(str(tmp_path / 'in'), str(tmp_path / 'out'), DEFAULT_NODE_DEFAULTS, workers=3, index_path=None,
+                    journal_path=str(tmp_path / 'journal.jsonl'), rules_file=write_rules(str(tmp_path)))
+    assert (files_under(tmp_path / 'out'), files_under(tmp_path / 'in')) == reference
@@ -0,0 +1,111 @@
+import os
+import errno
+import pytest
+from scripts import placement
+from scripts.move_plan import MovePlan, apply_plan
+from scripts.placement import PLACERS, UNSUPPORTED, is_placed
+from scripts.tests.helpers import files_under
+
+# Placement modes: each puts the image at its destination the way it says, none ever replaces
+# a file already there, and auto falls back to the next strategy where one isn't supported.
+
+
+@pytest.fixture(autouse=True)
+def fresh_volumes(monkeypatch):
+    # What the volumes don't support is remembered per process
+    monkeypatch.setattr(placement, '_unsupported', {})
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'in' / 'image.png'
+    os.makedirs(path.parent)
+    path.write_bytes(b'pixels')
+    os.makedirs(tmp_path / 'out')
+    return str(path)
+
+
+def place(mode, source, dest):
+    try:
+        PLACERS[mode](source, dest)
+    except OSError as e:
+        if mode == 'reflink' and e.errno in UNSUPPORTED:
+            pytest.skip("no reflinks on this filesystem")
+        raise
+
+
+@pytest.mark.parametrize('mode', ['move', 'copy', 'hardlink', 'reflink', 'symlink', 'auto'])
+def test_places(tmp_path, source, mode):
+    dest = str(tmp_path / 'out' / 'image.png')
+    place(mode, source, dest)
+    with open(dest, 'rb') as f:
+        assert f.read() == b'pixels'
+    assert os.path.exists(source) == (mode != 'move')
+    if mode in ('hardlink', 'auto'):
+        # The cheapest that works here: the same volume allows a hard link
+        assert os.path.samefile(source, dest)
+    if mode in ('copy', 'reflink'):
+        assert not os.path.samefile(source, dest)
+    if mode == 'symlink':
+        assert os.readlink(dest) == os.path.abspath(source)
+    if mode != 'move':
+        assert is_placed(source, dest, mode)
+    # Nothing left under a temporary name
+    assert files_under(tmp_path / 'out') == ['image.png']
+
+
+@pytest.mark.parametrize('mode', ['move', 'copy', 'hardlink', 'reflink', 'symlink', 'auto'])
+def test_never_replaces(tmp_path, source, mode):
+    dest = tmp_path / 'out' / 'image.png'
+    dest.write_bytes(b'another image')
+    with pytest.raises(FileExistsError):
+        place(mode, source, str(dest))
+    assert dest.read_bytes() == b'another image'
+    assert os.path.exists(source)
+    assert files_under(tmp_path / 'out') == ['image.png']
+
+
+def test_copies_are_independent(tmp_path, source):
+    dest = str(tmp_path / 'out' / 'image.png')
+    place('copy', source, dest)
+    with open(source, 'wb') as f:
+        f.write(b'edited')
+    with open(dest, 'rb') as f:
+        assert f.read() == b'pixels'
+
+
+def test_auto_falls_back(tmp_path, source, monkeypatch):
+    tried = []
+
+    def no_hardlink(source, dest):
+        tried.append(dest)
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setitem(PLACERS, 'hardlink', no_hardlink)
+
+    for name in ('a.png', 'b.png'):
+        place('auto', source, str(tmp_path / 'out' / name))
+        assert not os.path.samefile(source, tmp_path / 'out' / name)
+        assert (tmp_path / 'out' / name).read_bytes() == b'pixels'
+    # Found unsupported once for this pair of volumes, then skipped
+    assert len(tried) == 1
+
+
+def test_auto_gives_up(tmp_path, source, monkeypatch):
+    def unsupported(source, dest):
+        raise OSError(errno.ENOTSUP, "Operation not supported")
+    for strategy in placement.AUTO_ORDER:
+        monkeypatch.setitem(PLACERS, strategy, unsupported)
+    with pytest.raises(OSError):
+        place('auto', source, str(tmp_path / 'out' / 'image.png'))
+    assert files_under(tmp_path / 'out') == []
+
+
+@pytest.mark.parametrize('mode', ['copy', 'hardlink', 'symlink'])
+def test_rerun_after_a_collision(tmp_path, source, mode):
+    # An earlier run had to number the copy; later runs find it rather than add another
+    (tmp_path / 'out' / 'image.png').write_bytes(b'another image')
+    for _ in range(3):
+        plan = MovePlan()
+        plan.add(source, str(tmp_path / 'out'), mode)
+        apply_plan(plan, str(tmp_path / 'journal.jsonl'))
+    assert files_under(tmp_path / 'out') == ['image(1).png', 'image.png']
@@ -0,0 +1,86 @@
+import json
+import pytest
+from scripts.metadata_extractor import ImageRecord
+from scripts.rules import RuleSet, read_rules
+
+# Routing rules: which rule decides, where its template puts the image, and which folders a
+# template may never reach.
+
+
+def record(prompt='a cat on a beach', **fields):
+    fields.setdefault('width', 832)
+    fields.setdefault('height', 1216)
+    return ImageRecord(generator='comfyui', prompts=[prompt], **fields)
+
+
+def decide(specs, image, tmp_path):
+    return RuleSet(specs, matcher_cache=str(tmp_path)).decide(image)
+
+
+def test_no_rule_matches(tmp_path):
+    assert decide([{'name': 'dogs', 'keywords': ['dog'], 'to': 'dogs'}], record(), tmp_path) is None
+
+
+def test_higher_priority_decides(tmp_path):
+    specs = [{'name': 'places', 'keywords': ['beach'], 'to': 'places/{keyword}'},
+             {'name': 'animals', 'keywords': ['cat'], 'to': 'animals/{keyword}', 'priority': 10}]
+    assert decide(specs, record(), tmp_path) == ('animals/cat', [('animals/cat', 'move')])
+
+
+def test_file_order_among_equal_priorities(tmp_path):
+    specs = [{'name': 'places', 'keywords': ['beach'], 'to': 'places/{keyword}'},
+             {'name': 'animals', 'keywords': ['cat'], 'to': 'animals/{keyword}'}]
+    assert decide(specs, record(), tmp_path) == ('places/beach', [('places/beach', 'move')])
+
+
+def test_continue(tmp_path):
+    # The image moves to the first folder; later move rules get a copy or link, and rules with
+    # an action of their own keep it
+    specs = [{'name': 'by model', 'model': 'juggernaut*', 'to': 'models/{model}', 'continue': True},
+             {'name': 'portraits', 'orientation': 'portrait', 'to': 'portraits', 'action': 'symlink', 'continue': True},
+             {'name': 'animals', 'keywords': ['cat'], 'to': 'animals'},
+             {'name': 'never', 'to': 'never'}]
+    image = record(models=['SDXL\\juggernautXL_v9.safetensors'])
+    assert decide(specs, image, tmp_path) == ('by model', [('models/juggernautxl_v9', 'move'), ('portraits', 'symlink'),
+                                                           ('animals', 'auto')])
+
+
+def test_conditions(tmp_path):
+    specs = [{'name': 'quick', 'steps': {'max': 10}, 'to': 'quick'},
+             {'name': 'square', 'orientation': 'square', 'to': 'square'},
+             {'name': 'euler', 'sampler': 'euler*', 'cfg': 7, 'to': '{sampler}/{steps}'}]
+    assert decide(specs, record(steps=30, sampler='euler_ancestral', cfg=7.0), tmp_path) == ('euler', [('euler_ancestral/30', 'move')])
+    assert decide(specs, record(steps=8), tmp_path)[0] == 'quick'
+    assert decide(specs, record(steps=30, sampler='dpmpp_2m', cfg=7.0), tmp_path) is None
+
+
+def test_template_stays_in_the_output(tmp_path):
+    with pytest.raises(ValueError):
+        decide([{'name': 'up', 'to': '../outside'}], record(), tmp_path)
+    with pytest.raises(ValueError):
+        decide([{'name': 'sampler', 'to': '{sampler}'}], record(sampler='..'), tmp_path)
+    # Separators in a value stay inside one folder name
+    assert decide([{'name': 'sampler', 'to': 'by/{sampler}'}], record(sampler='../../etc'), tmp_path) == \
+        ('sampler', [('by/.._.._etc', 'move')])
+
+
+@pytest.mark.parametrize('spec', [
+    {'name': 'no folder'},
+    {'name': 'typo', 'to': 'x', 'keyword': ['cat']},
+    {'name': 'field', 'to': '{colour}'},
+    {'name': 'keyword', 'to': '{keyword}'},
+    {'name': 'action', 'to': 'x', 'action': 'teleport'},
+    {'name': 'range', 'to': 'x', 'steps': {'from': 1}},
+])
+def test_bad_rules(tmp_path, spec):
+    with pytest.raises(ValueError):
+        RuleSet([spec], matcher_cache=str(tmp_path))
+
+
+def test_keywords_file(tmp_path):
+    (tmp_path / 'animals.txt').write_text("dog\ncat\n", encoding='utf-8')
+    rules_file = tmp_path / 'rules.json'
+    rules_file.write_text(json.dumps({'rules': [{'name': 'animals', 'keywords_file': 'animals.txt', 'to': 'animals/{keyword}'}]}),
+                          encoding='utf-8')
+    specs = read_rules(str(rules_file), str(tmp_path))
+    assert decide(specs, record(), tmp_path) == ('animals/cat', [('animals/cat', 'move')])
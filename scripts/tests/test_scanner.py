@@ -0,0 +1,103 @@
+import os
+import time
+import pytest
+from scripts.metadata_index import MetadataIndex
+from scripts.scanner import DirectoryScanner
+
+# Scanning the input: which PNGs are found, and which directories a later scan with the index
+# skips because nothing was added, removed or renamed in them since.
+
+KEY = 'test'
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+
+
+def age(directory, seconds=3600):
+    # Directories last changed long enough ago that their mtime can be trusted
+    past = time.time() - seconds
+    for root, dirs, _ in os.walk(directory):
+        for name in dirs:
+            os.utime(os.path.join(root, name), (past, past))
+    os.utime(directory, (past, past))
+
+
+@pytest.fixture
+def tree(tmp_path):
+    base = tmp_path / 'in'
+    for path in ('a.png', 'b.PNG', 'notes.txt', 'x/c.png', 'x/y/d.png', 'characters/e.png', 'out/f.png', 'tmp/g.png',
+                 'x/h_preview.png'):
+        touch(str(base / path))
+    age(str(base))
+    return str(base)
+
+
+@pytest.fixture
+def index(tmp_path):
+    with MetadataIndex(str(tmp_path / 'index.sqlite')) as index:
+        yield index
+
+
+def scan(tree, index=None, **kwargs):
+    scanner = DirectoryScanner(tree, exclude_dirs=(os.path.join(tree, 'out'),), ignore=('tmp', '*_preview.png'), index=index,
+                               key=KEY if index else None, **kwargs)
+    return scanner, [os.path.relpath(path, tree).replace(os.sep, '/') for path in scanner]
+
+
+def test_finds_pngs(tree):
+    _, found = scan(tree)
+    # Category folders, the output folder and ignored names are left out
+    assert sorted(found) == ['a.png', 'b.PNG', 'x/c.png', 'x/y/d.png']
+
+
+def test_unchanged_directories_are_skipped(tree, index):
+    scanner, found = scan(tree, index)
+    assert sorted(found) == ['a.png', 'b.PNG', 'x/c.png', 'x/y/d.png']
+    scanner.save()
+
+    scanner, found = scan(tree, index)
+    assert found == []
+    assert (scanner.skipped, scanner.listed_count) == (3, 0)
+
+
+def test_changed_directory_is_listed_again(tree, index):
+    scan(tree, index)[0].save()
+    touch(os.path.join(tree, 'x', 'y', 'new.png'))
+    age(os.path.join(tree, 'x', 'y'))
+    scanner, found = scan(tree, index)
+    # Only the directory that changed; its parents are still walked through for it
+    assert sorted(found) == ['x/y/d.png', 'x/y/new.png']
+    assert (scanner.skipped, scanner.listed_count) == (2, 1)
+
+
+def test_recently_changed_directories_are_not_recorded(tree, index):
+    # Changed within RACY_SECONDS: another file could arrive without changing the mtime
+    touch(os.path.join(tree, 'x', 'i.png'))
+    scan(tree, index)[0].save()
+    scanner, found = scan(tree, index)
+    assert sorted(found) == ['x/c.png', 'x/i.png']
+    assert scanner.listed_count == 1
+
+
+def test_dirty_directories_are_not_recorded(tree, index):
+    scanner, _ = scan(tree, index)
+    scanner.mark_dirty(os.path.join(tree, 'x', 'c.png'))
+    scanner.save()
+    _, found = scan(tree, index)
+    assert found == ['x/c.png']
+
+
+def test_rescan(tree, index):
+    scan(tree, index)[0].save()
+    scanner, found = scan(tree, index, rescan=True)
+    assert sorted(found) == ['a.png', 'b.PNG', 'x/c.png', 'x/y/d.png']
+    assert scanner.skipped == 0
+
+
+def test_other_settings_scan_afresh(tree, index):
+    scan(tree, index)[0].save()
+    scanner = DirectoryScanner(tree, exclude_dirs=(os.path.join(tree, 'out'),), index=index, key='other settings')
+    # Without the ignore globs this time
+    assert len(list(scanner)) == 6
@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import subprocess
+import threading
+import pytest
+from scripts.config import APP_DIR
+from scripts.metadata_extractor import DEFAULT_NODE_DEFAULTS
+from scripts.move_plan import MoveJournal, resume_moves
+from scripts.organizer import load_rules, organize_images
+from scripts.placement import move_no_clobber
+from scripts.sharded import journal_path_for, organize_sharded, plan_shards
+from scripts.tests.helpers import files_under, wait_for_shard, write_rules
+from scripts.work_queue import WorkQueue
+
+# Sharded organizing with a worker that dies mid-shard: whatever it had done, the shard's next
+# holder must leave the library exactly as a single process would have.
+
+
+def open_under(directory):
+    # Files under directory this process still has open
+    prefix = os.path.join(os.path.realpath(directory), '')
+    paths = (os.path.realpath(os.path.join('/proc/self/fd', fd)) for fd in os.listdir('/proc/self/fd'))
+    return [path for path in paths if path.startswith(prefix)]
+
+
+def test_takeover_finishes_the_dead_workers_moves(tmp_path, corpus, reference):
+    work = tmp_path / 'sharded'
+    input_dir, output_dir = str(work / 'in'), str(work / 'out')
+    shutil.copytree(corpus, input_dir)
+    rules_file = write_rules(str(work))
+    queue_path = str(work / 'queue.sqlite')
+
+    # A worker plans the run, takes a shard and dies partway through its moves: one made, the
+    # next linked to its destination but not yet unlinked from the input
+    queue = WorkQueue(queue_path)
+    lease = queue.claim('dead', lease_seconds=0.2)
+    shards = plan_shards(input_dir, output_dir, load_rules(rules_file), DEFAULT_NODE_DEFAULTS, False, ())
+    assert queue.complete(lease, 'dead', shards)
+    lease = queue.claim('dead', lease_seconds=0.2)
+    plan = organize_images(input_dir, output_dir, DEFAULT_NODE_DEFAULTS, workers=1, index_path=None, dry_run=True,
+                           rules_file=rules_file, files=lease.files)
+    assert len(plan.moves) >= 2
+    journal = MoveJournal(journal_path_for(str(work), lease.task_id))
+    journal.begin(plan.moves)
+    first, second = plan.moves[:2]
+    os.makedirs(os.path.dirname(first.dest), exist_ok=True)
+    move_no_clobber(first.source, first.dest)
+    journal.mark_done(0)
+    os.makedirs(os.path.dirname(second.dest), exist_ok=True)
+    os.link(second.source, second.dest)
+    journal.close()
+    queue.close()
+    time.sleep(0.3)
+
+    failed = organize_sharded(input_dir, output_dir, DEFAULT_NODE_DEFAULTS, queue_path=queue_path, worker_id='next',
+                              lease_seconds=5, workers=1, index_path=str(work / 'index.sqlite'), rules_file=rules_file)
+    assert failed == 0
+    assert (files_under(output_dir), files_under(input_dir)) == reference
+    assert not os.path.exists(journal_path_for(str(work), lease.task_id))
+    # The shard indexes were merged and deleted with no connection left open on them
+    assert os.listdir(work / 'shard_indexes') == []
+    if os.path.isdir('/proc/self/fd'):
+        assert open_under(work) == []
+
+
+def test_shard_given_back_by_a_live_worker(tmp_path, corpus, reference):
+    work = tmp_path / 'given_back'
+    input_dir, output_dir = str(work / 'in'), str(work / 'out')
+    shutil.copytree(corpus, input_dir)
+    rules_file = write_rules(str(work))
+    queue_path = str(work / 'queue.sqlite')
+
+    def start_moves(lease, moves):
+        # Journals the shard's moves and makes the first few
+        plan = organize_images(input_dir, output_dir, DEFAULT_NODE_DEFAULTS, workers=1, index_path=None, dry_run=True,
+                               rules_file=rules_file, files=lease.files)
+        journal = MoveJournal(journal_path_for(str(work), lease.task_id))
+        journal.begin(plan.moves)
+        for i, move in enumerate(plan.moves[:moves]):
+            os.makedirs(os.path.dirname(move.dest), exist_ok=True)
+            move_no_clobber(move.source, move.dest)
+            journal.mark_done(i)
+        journal.close()
+
+    # Worker A fails a shard partway through its moves and goes on to the next one, which it
+    # is still organizing while B takes the failed shard. (A takes the next shard before giving
+    # the first back only so that B, not A, is the one to take it again.)
+    queue = WorkQueue(queue_path)
+    lease = queue.claim('a', lease_seconds=60)
+    shards = plan_shards(input_dir, output_dir, load_rules(rules_file), DEFAULT_NODE_DEFAULTS, False, ())
+    assert queue.complete(lease, 'a', shards)
+    failed_shard = queue.claim('a', lease_seconds=60)
+    start_moves(failed_shard, 1)
+    next_shard = queue.claim('a', lease_seconds=60)
+    start_moves(next_shard, 1)
+    queue.fail(failed_shard, 'a', "disk full")
+    next_journal = journal_path_for(str(work), next_shard.task_id)
+    with open(next_journal, 'rb') as f:
+        written = f.read()
+
+    result = {}
+    other = threading.Thread(target=lambda: result.setdefault('failed', organize_sharded(
+        input_dir, output_dir, DEFAULT_NODE_DEFAULTS, queue_path=queue_path, worker_id='b', lease_seconds=60, workers=1,
+        index_path=str(work / 'index.sqlite'), rules_file=rules_file)))
+    other.start()
+    # Once B has organized every shard but A's, the journal A is still writing is untouched
+    deadline = time.monotonic() + 60
+    while queue.counts().get('done', 0) < len(shards):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    with open(next_journal, 'rb') as f:
+        assert f.read() == written
+
+    resume_moves(next_journal)
+    assert queue.complete(next_shard, 'a')
+    queue.close()
+    other.join(timeout=60)
+    assert result == {'failed': 0}
+    assert (files_under(output_dir), files_under(input_dir)) == reference
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGKILL'), reason="needs SIGKILL")
+def test_killed_worker(tmp_path, corpus, reference):
+    work = tmp_path / 'killed'
+    shutil.copytree(corpus, work / 'in')
+    config_file = str(work / 'config.json')
+    with open(config_file, 'w', encoding='utf-8') as f:
+        json.dump({'base_dir': str(work / 'in'), 'output_dir': str(work / 'out'), 'workers': 1}, f)
+    queue_path = str(work / 'queue.sqlite')
+
+    def start(worker_id):
+        return subprocess.Popen([sys.executable, '-m', 'scripts', '--config', config_file, 'organize', '--rules', write_rules(str(work)),
+                                 '--queue', queue_path, '--lease', '1', '--worker-id', worker_id],
+                                cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    workers = [start(f"w{n}") for n in range(3)]
+    wait_for_shard(queue_path, 'w0')
+    workers[0].send_signal(signal.SIGKILL)
+    for worker in workers:
+        worker.wait(timeout=120)
+
+    assert [worker.returncode for worker in workers[1:]] == [0, 0]
+    assert (files_under(work / 'out'), files_under(work / 'in')) == reference
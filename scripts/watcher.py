@@ -0,0 +1,338 @@
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from scripts import metrics, scanner
+from scripts.metadata_index import INDEX_FILE, MetadataIndex
+from scripts.move_plan import WATCH_JOURNAL_FILE, resume_moves
+from scripts.name_allocator import NameAllocator
+from scripts.config import WILDCARDS_DIR
+from scripts.organizer import (CATEGORY_DIRS, apply_results, categorize_batch, close_worker, init_worker, load_rules, skip_dirs_for,
+                               swap_rules)
+from scripts.rules import RULES_FILE, RuleSet, rules_sources
+from scripts.scanner import is_png
+
+# Headless watch mode: organize new PNGs as the generator writes them.
+# Uses inotify on Linux and falls back to polling directory mtimes elsewhere.
+
+# Seconds a file must stay unchanged after its last write before it is organized
+DEFAULT_SETTLE = 0.3
+
+# Polling fallback interval; directories are only re-listed when their mtime changes
+DEFAULT_POLL_INTERVAL = 0.5
+
+# Seconds between checks of the rules file and wildcard files for changes
+RULES_CHECK_INTERVAL = 1.0
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def make_exclusion(output_dir: str, skip_dirs=CATEGORY_DIRS, ignore=()) -> Callable[[str], bool]:
+    # Never watch the organized tree, whether it is a category folder or an output dir
+    # nested inside the watched directory
+    return scanner.make_exclusion((output_dir,), skip_dirs, ignore)
+
+
+class InotifyWatcher:
+    def __init__(self, base_path: str, is_excluded: Callable[[str], bool]):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.is_excluded = is_excluded
+        self.watches: Dict[int, str] = {}
+        self.base_path = base_path
+        self.add_tree(base_path)
+
+    def add_tree(self, dir_path: str) -> List[str]:
+        # Watch dir_path and its subdirectories; returns PNGs already in them, since files can
+        # land in a new directory before its watch is in place
+        found = []
+        for root, dirs, files in os.walk(dir_path):
+            dirs[:] = [d for d in dirs if not self.is_excluded(os.path.join(root, d))]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                logging.warning("Cannot watch " + root + ": " + os.strerror(ctypes.get_errno()))
+                continue
+            self.watches[wd] = root
+            found.extend(os.path.join(root, f) for f in files if is_png(f))
+        return found
+
+    def wait(self, timeout: Optional[float]) -> List[str]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        return list(self._parse_events(data))
+
+    def _parse_events(self, data: bytes) -> Iterator[str]:
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped; pick up whatever is on disk
+                logging.warning("inotify queue overflow, rescanning " + self.base_path)
+                for path in self.rescan():
+                    yield path
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF):
+                self.watches.pop(wd, None)
+                continue
+
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not self.is_excluded(path):
+                    yield from self.add_tree(path)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and is_png(name):
+                yield path
+
+    def rescan(self) -> List[str]:
+        for wd in list(self.watches):
+            self.libc.inotify_rm_watch(self.fd, wd)
+        self.watches.clear()
+        return self.add_tree(self.base_path)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    def __init__(self, base_path: str, is_excluded: Callable[[str], bool], interval: float = DEFAULT_POLL_INTERVAL):
+        self.base_path = base_path
+        self.is_excluded = is_excluded
+        self.interval = interval
+        self.dir_mtimes: Dict[str, int] = {}
+        self.dir_files: Dict[str, Set[str]] = {}
+        self.next_poll = 0.0
+        # Files present at startup are not "new"
+        self._scan()
+
+    def _scan(self) -> List[str]:
+        changed = []
+        for dir_path in list(self.dir_mtimes) or [self.base_path]:
+            self._scan_dir(dir_path, changed)
+        return changed
+
+    def _scan_dir(self, dir_path: str, changed: List[str]):
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+        except FileNotFoundError:
+            self.dir_mtimes.pop(dir_path, None)
+            self.dir_files.pop(dir_path, None)
+            return
+        if self.dir_mtimes.get(dir_path) == mtime:
+            return
+        self.dir_mtimes[dir_path] = mtime
+
+        names = set()
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path not in self.dir_mtimes and not self.is_excluded(entry.path):
+                        self._scan_dir(entry.path, changed)
+                elif is_png(entry.name):
+                    names.add(entry.name)
+        known = self.dir_files.get(dir_path, set())
+        self.dir_files[dir_path] = names
+        if self.next_poll:
+            changed.extend(os.path.join(dir_path, name) for name in names - known)
+
+    def wait(self, timeout: Optional[float]) -> List[str]:
+        delay = max(0.0, self.next_poll - time.monotonic())
+        if timeout is not None:
+            delay = min(delay, timeout)
+        time.sleep(delay)
+        if time.monotonic() < self.next_poll:
+            return []
+        self.next_poll = time.monotonic() + self.interval
+        return self._scan()
+
+    def close(self):
+        pass
+
+
+def create_watcher(base_path: str, is_excluded: Callable[[str], bool], use_polling: bool = False):
+    if not use_polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(base_path, is_excluded)
+        except (OSError, AttributeError) as e:
+            logging.warning("inotify unavailable (" + str(e) + "), falling back to polling")
+    return PollingWatcher(base_path, is_excluded)
+
+
+class Debouncer:
+    # Holds a file until its size and mtime have been stable for `settle` seconds
+    def __init__(self, settle: float = DEFAULT_SETTLE):
+        self.settle = settle
+        self.pending: Dict[str, Tuple[float, int, int]] = {}
+
+    def touch(self, path: str):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.pending.pop(path, None)
+            return
+        self.pending[path] = (time.monotonic() + self.settle, st.st_size, st.st_mtime_ns)
+
+    def next_timeout(self) -> Optional[float]:
+        if not self.pending:
+            return None
+        return max(0.0, min(deadline for deadline, _, _ in self.pending.values()) - time.monotonic())
+
+    def ready(self) -> List[str]:
+        now = time.monotonic()
+        ready = []
+        for path, (deadline, size, mtime_ns) in list(self.pending.items()):
+            if deadline > now:
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                # Still being written
+                self.pending[path] = (now + self.settle, st.st_size, st.st_mtime_ns)
+                continue
+            del self.pending[path]
+            ready.append(path)
+        return ready
+
+
+class RulesReloader:
+    # Notices edits to the rules file or the wildcard files and compiles the new rules on a
+    # background thread, so images keep being organized with the old rules meanwhile. Rules
+    # that fail to load are logged and the old ones kept until the files change again.
+    def __init__(self, rules_file: str, wildcards_dir: str, placement: str, whole_words: bool,
+                 interval: float = RULES_CHECK_INTERVAL, matcher_cache: Optional[str] = None):
+        self.rules_file = rules_file
+        self.wildcards_dir = wildcards_dir
+        self.placement = placement
+        self.whole_words = whole_words
+        self.matcher_cache = matcher_cache
+        self.interval = interval
+        self.next_check = time.monotonic() + interval
+        self.fingerprint = self._fingerprint()
+        self.thread: Optional[threading.Thread] = None
+        self.loaded: Optional[Tuple[List, RuleSet]] = None
+
+    def _fingerprint(self) -> Tuple:
+        stamps = []
+        for path in rules_sources(self.rules_file, self.wildcards_dir):
+            try:
+                st = os.stat(path)
+                stamps.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamps.append((path, None, None))
+        return tuple(stamps)
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            rules = load_rules(self.rules_file, self.wildcards_dir, self.placement, self.matcher_cache)
+            self.loaded = (rules, RuleSet(rules, whole_words=self.whole_words, matcher_cache=self.matcher_cache))
+            logging.info(f"Reloaded rules in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logging.error("Keeping the current rules, cannot load the new ones: " + str(e))
+
+    def poll(self) -> Optional[Tuple[List, RuleSet]]:
+        # The newly compiled (rules, RuleSet), once, after a change has finished compiling
+        if self.thread is not None:
+            if self.thread.is_alive():
+                return None
+            self.thread = None
+            loaded, self.loaded = self.loaded, None
+            if loaded:
+                return loaded
+        now = time.monotonic()
+        if now < self.next_check:
+            return None
+        self.next_check = now + self.interval
+        fingerprint = self._fingerprint()
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            self.thread = threading.Thread(target=self._load, name='rules-reload', daemon=True)
+            self.thread.start()
+        return None
+
+
+def watch_images(base_path, output_dir, node_defaults, index_path=INDEX_FILE, whole_words=False,
+                 settle=DEFAULT_SETTLE, use_polling=False, stop_event: Optional[threading.Event] = None,
+                 journal_path=WATCH_JOURNAL_FILE, rules_file=RULES_FILE, placement='move', metrics_port: Optional[int] = None,
+                 ignore=(), wildcards_dir=WILDCARDS_DIR, matcher_cache: Optional[str] = None):
+    # metrics_port serves the stage timings and counters in Prometheus format on localhost;
+    # ignore is a list of file and folder name globs not to organize. Edits to the rules file
+    # or the wildcard files take effect without a restart.
+    index = MetadataIndex(index_path) if index_path else None
+    if os.path.exists(journal_path):
+        logging.warning("Finishing the moves interrupted in " + journal_path)
+        resume_moves(journal_path, index.move if index else None)
+    # Matching runs in this process; new images arrive one at a time, far below pool throughput
+    rules = load_rules(rules_file, wildcards_dir, placement, matcher_cache)
+    init_worker(rules, node_defaults, index_path, whole_words, matcher_cache=matcher_cache)
+    reloader = RulesReloader(rules_file, wildcards_dir, placement, whole_words, matcher_cache=matcher_cache)
+    watcher = create_watcher(base_path, make_exclusion(output_dir, skip_dirs_for(rules, matcher_cache), ignore), use_polling)
+    is_ignored = scanner.compile_ignore(ignore)
+    debouncer = Debouncer(settle)
+    # Category folders are listed on first use and then tracked in memory across batches
+    allocator = NameAllocator()
+    server = metrics.serve_metrics(metrics_port) if metrics_port else None
+    if server:
+        logging.info(f"Metrics at http://127.0.0.1:{server.server_address[1]}/metrics")
+    logging.info("Watching " + base_path + " (" + type(watcher).__name__ + ")")
+    try:
+        while not (stop_event and stop_event.is_set()):
+            timeout = debouncer.next_timeout()
+            # Wake up at least once a second so stop_event is honoured
+            for path in watcher.wait(1.0 if timeout is None else min(timeout, 1.0)):
+                if is_ignored is None or not is_ignored(os.path.basename(path)):
+                    debouncer.touch(path)
+            reloaded = reloader.poll()
+            if reloaded:
+                rules, rule_set = reloaded
+                swap_rules(rule_set)
+                # Folders the new rules file into are not watched either
+                watcher.is_excluded = make_exclusion(output_dir, skip_dirs_for(rules, matcher_cache), ignore)
+            ready = debouncer.ready()
+            if ready:
+                apply_results(categorize_batch(ready), output_dir, index, journal_path, allocator)
+                if index:
+                    index.commit()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        close_worker()
+        if server:
+            server.shutdown()
+            server.server_close()
+        if index:
+            index.close()
@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import marshal
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+from scripts.config import CONFIG_FILE, data_file_for, resolve_app_path
+from scripts.keyword_matcher import CategoryMatcher
+
+# Wildcard files and their compiled matchers.
+#
+# Every .txt file in the wildcards folder is a category named after the file: characters and
+# locations first, as always, then the others by name. One entry per line; the first spelling
+# is the folder name and any others follow after "|". A line starting with "!" is an exclusion:
+# text inside that phrase never counts as a match for the file. "#" starts a comment line.
+#     Alice Smith | Alice | A. Smith
+#     !Alice Cooper
+# Inline "keywords" lists in rules.json take the same syntax.
+#
+# Compiling the matcher of large files takes seconds, and every worker process needs one. Each
+# process keeps what it compiled, and matchers big enough for an automaton are also saved under
+# data/matcher_cache, keyed by a hash of the keywords, for other processes and later runs to
+# load instead of compiling them again.
+
+# Categories that come before the other wildcard files, in this order
+FIRST_CATEGORIES = ('characters', 'locations')
+
+WILDCARD_EXTENSION = '.txt'
+
+MATCHER_CACHE_NAME = 'matcher_cache'
+
+# Bumped when the compiled layout changes; marshal data is tied to the Python version as well
+CACHE_FORMAT = 1
+
+# Compiled matchers kept in memory and on disk
+MAX_MATCHERS = 4
+MAX_CACHED_FILES = 8
+
+_compiled: 'OrderedDict[str, CategoryMatcher]' = OrderedDict()
+_lock = threading.Lock()
+
+
+def read_wildcard_file(file_path: str) -> List[str]:
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def category_files(wildcards_dir: str) -> List[Tuple[str, str]]:
+    # (category, file) for every wildcard file, in priority order
+    try:
+        names = [name for name in os.listdir(wildcards_dir) if name.lower().endswith(WILDCARD_EXTENSION)]
+    except FileNotFoundError:
+        return []
+    categories = [(os.path.splitext(name)[0], os.path.join(wildcards_dir, name)) for name in names]
+    order = {category: position for position, category in enumerate(FIRST_CATEGORIES)}
+    return sorted(categories, key=lambda item: (order.get(item[0], len(order)), item[0]))
+
+
+def load_wildcards(wildcards_dir: str) -> List[Tuple[str, List[str]]]:
+    return [(category, read_wildcard_file(file_path)) for category, file_path in category_files(resolve_app_path(wildcards_dir))]
+
+
+def matcher_key(categories: Sequence[Tuple[str, List[str]]], whole_words: bool) -> str:
+    data = json.dumps([CACHE_FORMAT, sys.version_info[:2], whole_words, categories], ensure_ascii=False)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:20]
+
+
+def cache_dir_for(config_file: str = CONFIG_FILE) -> str:
+    # Compiled matchers are cached next to the config they were used with
+    return data_file_for(config_file, MATCHER_CACHE_NAME)
+
+
+def _load_cached(path: str):
+    try:
+        # marshal.load on the file itself reads a few bytes at a time, several times slower
+        with open(path, 'rb') as f:
+            matcher = CategoryMatcher.load(marshal.loads(f.read()))
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        logging.warning("Ignoring the cached matcher " + path + ": " + str(e))
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return matcher
+
+
+def _save_cached(path: str, matcher: CategoryMatcher):
+    # Written under a temporary name and renamed, so readers never see half a file
+    directory = os.path.dirname(path)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(temp_path, 'wb') as f:
+            f.write(marshal.dumps(matcher.dump()))
+        os.replace(temp_path, path)
+        cached = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.marshal')),
+                        key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in cached[MAX_CACHED_FILES:]:
+            os.remove(entry.path)
+    except OSError as e:
+        logging.warning("Cannot cache the compiled keywords in " + directory + ": " + str(e))
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+def compile_matcher(categories: Sequence[Tuple[str, List[str]]], whole_words: bool = False,
+                    cache_dir: Optional[str] = None) -> CategoryMatcher:
+    # The CategoryMatcher for these categories, compiled at most once per process and, when it
+    # is big enough to be worth it, once per content on disk in cache_dir (default: next to the
+    # default config)
+    categories = [(name, list(lines)) for name, lines in categories]
+    key = matcher_key(categories, whole_words)
+    with _lock:
+        matcher = _compiled.get(key)
+        if matcher is not None:
+            _compiled.move_to_end(key)
+            return matcher
+
+    # Only matchers with an automaton are saved; small ones compile faster than they load
+    path = os.path.join(cache_dir or cache_dir_for(), key + '.marshal')
+    matcher = _load_cached(path)
+    if matcher is None:
+        matcher = CategoryMatcher(categories, whole_words=whole_words)
+        if matcher.node_matcher.use_automaton:
+            _save_cached(path, matcher)
+
+    with _lock:
+        _compiled[key] = matcher
+        while len(_compiled) > MAX_MATCHERS:
+            _compiled.popitem(last=False)
+    return matcher
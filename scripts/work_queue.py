@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from scripts.config import CONFIG_FILE, data_file_for
+
+# Lease-based work queue in a SQLite file, shared by the workers of a sharded organize run
+# (processes on one machine, or hosts sharing the storage the file is on). Each task is leased
+# to one worker at a time; the worker renews its lease while it works, and a lease left to
+# expire, because its worker died or hung, hands the task to the next worker that asks.
+#
+# A run has three kinds of task, handed out in this order: 'plan' (list the input tree and
+# add a 'files' task per directory shard), 'files' (organize one shard), and 'merge' (merge
+# the workers' metadata indexes into one, once every shard is finished).
+#
+# The file uses SQLite's rollback journal rather than WAL, which needs shared memory and so
+# only works between processes on one host. Lease times are wall clock times, so the hosts'
+# clocks must agree to well within a lease.
+
+QUEUE_FILE = data_file_for(CONFIG_FILE, 'work_queue.sqlite')
+
+DEFAULT_LEASE_SECONDS = 60
+
+# A task that failed this many times is given up on
+MAX_ATTEMPTS = 3
+
+# Seconds to wait for another worker's transaction
+BUSY_TIMEOUT = 60
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+
+@dataclass(slots=True)
+class Lease:
+    task_id: int
+    kind: str
+    directory: str
+    files: List[str]
+    attempt: int
+    # Who held the task until their lease expired, or None if it was given back (see fail)
+    previous_owner: Optional[str] = None
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    def __init__(self, db_path: str = QUEUE_FILE):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # Autocommit; every change is its own BEGIN IMMEDIATE ... COMMIT
+        self.conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.transaction():
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    directory TEXT NOT NULL DEFAULT '',
+                    -- JSON list of the shard's files
+                    files TEXT NOT NULL DEFAULT '[]',
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    owner TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT
+                )
+            """)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            if not self.conn.execute("SELECT 1 FROM tasks LIMIT 1").fetchone():
+                self.conn.execute("INSERT INTO tasks (kind) VALUES ('plan')")
+
+    def transaction(self) -> '_Transaction':
+        return _Transaction(self)
+
+    def check_settings(self, settings: Dict[str, Any]):
+        # Every worker of a run must organize the same folders the same way; the first sets them
+        with self.transaction():
+            for key, value in settings.items():
+                self.conn.execute("INSERT OR IGNORE INTO settings VALUES (?, ?)", (key, json.dumps(value, sort_keys=True)))
+            stored = dict(self.conn.execute("SELECT key, value FROM settings"))
+        for key, value in settings.items():
+            if stored.get(key) != json.dumps(value, sort_keys=True):
+                raise ValueError(f"The queue {self.db_path} belongs to a run with another {key}: {stored.get(key)}")
+
+    def claim(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> Optional[Lease]:
+        # The next task for worker, or None if there is none to hand out right now
+        now = time.time()
+        with self.transaction():
+            row = self.conn.execute(
+                "SELECT id, kind, directory, files, attempts, owner FROM tasks "
+                "WHERE state = ? OR (state = ? AND lease_until < ?) ORDER BY id LIMIT 1",
+                (PENDING, LEASED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            task_id, kind, directory, files, attempts, previous_owner = row
+            if kind == 'merge' and self.conn.execute(
+                    "SELECT 1 FROM tasks WHERE kind != 'merge' AND state IN (?, ?) LIMIT 1", (PENDING, LEASED)).fetchone():
+                # Shards still being organized elsewhere
+                return None
+            self.conn.execute("UPDATE tasks SET state = ?, owner = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                              (LEASED, worker, now + lease_seconds, task_id))
+        if attempts:
+            logging.warning(f"Taking over {kind} task {task_id} {directory} (attempt {attempts + 1})")
+        return Lease(task_id, kind, directory, json.loads(files), attempts + 1, previous_owner)
+
+    def renew(self, lease: Lease, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        # False once the lease has been lost to another worker
+        with self.transaction():
+            return self.conn.execute("UPDATE tasks SET lease_until = ? WHERE id = ? AND owner = ? AND state = ?",
+                                     (time.time() + lease_seconds, lease.task_id, worker, LEASED)).rowcount == 1
+
+    def complete(self, lease: Lease, worker: str, shards: Sequence[Tuple[str, List[str]]] = ()) -> bool:
+        # Finishes the task; a plan task adds its shards and the merge task in the same transaction
+        with self.transaction():
+            if self.conn.execute("UPDATE tasks SET state = ?, lease_until = NULL WHERE id = ? AND owner = ? AND state = ?",
+                                 (DONE, lease.task_id, worker, LEASED)).rowcount != 1:
+                return False
+            if lease.kind == 'plan':
+                self.conn.executemany("INSERT INTO tasks (kind, directory, files) VALUES ('files', ?, ?)",
+                                      [(directory, json.dumps(files)) for directory, files in shards])
+                self.conn.execute("INSERT INTO tasks (kind) VALUES ('merge')")
+        return True
+
+    def fail(self, lease: Lease, worker: str, error: str):
+        # Back in the queue for another try, unless it has failed too often. The worker is
+        # still alive, so whoever takes the task next has no previous owner to clean up after.
+        state = FAILED if lease.attempt >= MAX_ATTEMPTS else PENDING
+        with self.transaction():
+            self.conn.execute("UPDATE tasks SET state = ?, owner = NULL, lease_until = NULL, error = ? "
+                              "WHERE id = ? AND owner = ? AND state = ?",
+                              (state, error, lease.task_id, worker, LEASED))
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state"))
+
+    def finished(self) -> bool:
+        # Nothing pending or leased: every task is done or given up on
+        counts = self.counts()
+        return not counts.get(PENDING) and not counts.get(LEASED)
+
+    def failures(self) -> List[Tuple[str, str, str]]:
+        with self.lock:
+            return self.conn.execute("SELECT kind, directory, error FROM tasks WHERE state = ?", (FAILED,)).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim the same task
+    def __init__(self, queue: WorkQueue):
+        self.queue = queue
+
+    def __enter__(self):
+        self.queue.lock.acquire()
+        try:
+            self.queue.conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.queue.lock.release()
+            raise
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.queue.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.queue.lock.release()
+        return False
+
+
+class LeaseKeeper:
+    # Renews a lease in the background while its task runs. `lost` is set once the lease has
+    # gone unrenewed for two thirds of its time, so the task stops before another worker can
+    # take it over, or once another worker already has.
+    def __init__(self, queue: WorkQueue, lease: Lease, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.queue = queue
+        self.lease = lease
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='lease-keeper', daemon=True)
+
+    def _run(self):
+        expires = time.monotonic() + self.lease_seconds
+        while not self.stopped.wait(self.lease_seconds / 3):
+            try:
+                if not self.queue.renew(self.lease, self.worker, self.lease_seconds):
+                    break
+                expires = time.monotonic() + self.lease_seconds
+            except sqlite3.Error as e:
+                logging.warning("Cannot renew the lease on task " + str(self.lease.task_id) + ": " + str(e))
+                if time.monotonic() < expires - self.lease_seconds / 3:
+                    continue
+                break
+        else:
+            return
+        logging.error(f"Lost the lease on {self.lease.kind} task {self.lease.task_id}; stopping it")
+        self.lost.set()
+
+    def __enter__(self) -> 'LeaseKeeper':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        return False
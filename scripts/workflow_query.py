@@ -0,0 +1,132 @@
+import json
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# One pass over a generation's parameters answers every field lookup. Replaces one
+# find_value_in_dict walk per field, plus separate scans of the workflow nodes.
+
+# Node inputs read for every ImageRecord
+RECORD_KEYS = ('seed', 'steps', 'cfg', 'sampler_name', 'scheduler', 'denoise', 'clip', 'vae_name', 'ckpt_name', 'lora_name')
+
+NodeDefaults = Union[Dict[str, str], Sequence[Dict[str, str]]]
+
+
+@dataclass(frozen=True, slots=True)
+class NodeFilter:
+    # Selects UI workflow nodes by type and, optionally, by one of their properties
+    # (config['node_defaults'] picks the ShowText|pysssss nodes this way)
+    node_type: str
+    node_key: Optional[str] = None
+    node_name: Optional[str] = None
+
+    def matches(self, node: Dict[str, Any]) -> bool:
+        if node.get("type") != self.node_type:
+            return False
+        return self.node_key is None or node.get("properties", {}).get(self.node_key) == self.node_name
+
+
+def compile_node_filters(node_defaults: NodeDefaults) -> Tuple[NodeFilter, ...]:
+    # config['node_defaults'] is a single filter, or a list of them to collect text from
+    # several node types
+    if isinstance(node_defaults, dict):
+        node_defaults = [node_defaults]
+    return tuple(NodeFilter(f['node_type'], f.get('node_key'), f.get('node_name')) for f in node_defaults)
+
+
+def iter_workflow_nodes(metadata: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    # UI workflow nodes from {"prompt": parameters, "workflow": prompt_info.metadata}, in the
+    # places get_workflow_node_data has always looked
+    for section in metadata.values():
+        if isinstance(section, dict):
+            workflow = section.get('workflow')
+            if isinstance(workflow, dict):
+                nodes = workflow.get("nodes")
+                if isinstance(nodes, list):
+                    yield from nodes
+
+
+def node_texts(nodes: Iterable[Dict[str, Any]], filters: Sequence[NodeFilter]) -> List[str]:
+    # Text shown by the matching nodes, i.e. the first item of each list widget value
+    texts = []
+    for node in nodes:
+        if isinstance(node, dict) and any(f.matches(node) for f in filters):
+            for widget in node.get("widgets_values", []):
+                if isinstance(widget, list):
+                    texts.append(widget[0])
+    return texts
+
+
+class WorkflowIndex:
+    __slots__ = ('values', 'nodes_by_type', 'texts')
+
+    def __init__(self):
+        # Query key -> every value stored under it, in find_values_in_dict order
+        self.values: Dict[str, List[Any]] = defaultdict(list)
+        # API graph class_type -> nodes
+        self.nodes_by_type: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        # Text of the UI nodes selected by the node filters
+        self.texts: List[str] = []
+
+    def first(self, key: str, default: Any = None) -> Any:
+        # Same answer as find_value_in_dict: the first value found that isn't None
+        for value in self.values.get(key, ()):
+            if value is not None:
+                return value
+        return default
+
+    def all(self, key: str) -> List[Any]:
+        return self.values.get(key, [])
+
+    def nodes(self, class_type: str) -> List[Dict[str, Any]]:
+        return self.nodes_by_type.get(class_type, [])
+
+
+class WorkflowQuery:
+    # Compiled once per set of keys and node filters, then run against every image
+    def __init__(self, keys: Iterable[str] = RECORD_KEYS, node_filters: Sequence[NodeFilter] = ()):
+        self.keys = frozenset(keys)
+        self.node_filters = tuple(node_filters)
+
+    def run(self, parameters: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None) -> WorkflowIndex:
+        index = WorkflowIndex()
+        # For ComfyUI only the API graph holds node inputs; the (much larger) UI workflow is
+        # only visited for its node list
+        graph = parameters.get('prompt') if isinstance(parameters.get('prompt'), dict) else parameters
+        self._collect(graph, index)
+        if self.node_filters:
+            index.texts = node_texts(iter_workflow_nodes({"prompt": parameters, "workflow": metadata or {}}), self.node_filters)
+        return index
+
+    def _collect(self, graph: Dict[str, Any], index: WorkflowIndex):
+        keys, values = self.keys, index.values
+        for node in graph.values():
+            if isinstance(node, dict) and 'class_type' in node:
+                index.nodes_by_type[node['class_type']].append(node)
+
+        # Iterative pre-order walk. Lists are enumerated, so their integer "keys" never match.
+        # Like find_values_in_dict, a matched value is not searched further.
+        stack = [iter(graph.items())]
+        while stack:
+            for key, value in stack[-1]:
+                if key in keys:
+                    values[key].append(value)
+                elif isinstance(value, dict):
+                    stack.append(iter(value.items()))
+                    break
+                elif isinstance(value, list):
+                    stack.append(enumerate(value))
+                    break
+            else:
+                stack.pop()
+
+
+@lru_cache(maxsize=16)
+def _compiled_query(node_defaults_key: str) -> WorkflowQuery:
+    return WorkflowQuery(RECORD_KEYS, compile_node_filters(json.loads(node_defaults_key)))
+
+
+def compile_query(node_defaults: NodeDefaults) -> WorkflowQuery:
+    # Cached, so building a record for each image doesn't recompile the filters
+    return _compiled_query(json.dumps(node_defaults, sort_keys=True))
@@ -0,0 +1,162 @@
+import re
+import json
+from functools import lru_cache
+from json.decoder import scanstring
+from typing import Any, Dict, List, Optional, Pattern, Sequence, Tuple
+from scripts.workflow_query import NodeFilter
+
+# Reads a ComfyUI UI workflow ("workflow" text chunk) without building the whole object graph.
+# The result is what json.loads would return, except that "nodes" only holds the nodes matching
+# the node filters: those are the only nodes an ImageRecord needs, and they are a handful out of
+# hundreds, or tens of thousands in a 5 MB workflow.
+#
+# The nodes are found by searching the text for their "type" instead of decoding every node, and
+# only the matching nodes are decoded. The search is bounded to the top-level "nodes" array,
+# which ends where the top-level "links" array starts: a candidate `], "links":` counts once the
+# rest of the text parses as the remaining members of the top-level object. Where it doesn't
+# (unusual key order, hand-edited files), the nodes are decoded one at a time instead, so only
+# one node is in memory at once. A node of a matching type nested inside another node's data
+# would be picked up by the search too; ComfyUI doesn't store nodes that way. Nodes that are
+# searched over are not validated, so a workflow damaged only inside those still reads.
+
+_decoder = json.JSONDecoder()
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+NODES_END = re.compile(r'\][ \t\n\r]*,[ \t\n\r]*(?="links"[ \t\n\r]*:)')
+
+
+def _skip(text: str, pos: int) -> int:
+    return WHITESPACE.match(text, pos).end()
+
+
+def _escaped(text: str, pos: int) -> bool:
+    # Whether the character at pos follows an odd number of backslashes
+    start = pos
+    while pos > 0 and text[pos - 1] == '\\':
+        pos -= 1
+    return (start - pos) % 2 == 1
+
+
+@lru_cache(maxsize=16)
+def type_marker(node_filters: Tuple[NodeFilter, ...]) -> Pattern:
+    # "type": "<node type>" as JSON.stringify and json.dumps write it
+    spellings = set()
+    for node_filter in node_filters:
+        for ensure_ascii in (True, False):
+            spelling = json.dumps(node_filter.node_type, ensure_ascii=ensure_ascii)
+            spellings.update((spelling, spelling.replace('/', '\\/')))
+    return re.compile(r'"type"[ \t\n\r]*:[ \t\n\r]*(?:' + '|'.join(map(re.escape, sorted(spellings))) + ')')
+
+
+def _object_start(text: str, pos: int) -> Optional[int]:
+    # Opening brace of the object holding the key that starts at pos, scanning back over the
+    # keys before it (usually just "id")
+    depth = 0
+    pos -= 1
+    while pos >= 0:
+        char = text[pos]
+        if char == '"':
+            # End of a string: back to its opening quote
+            pos = text.rfind('"', 0, pos)
+            while pos > 0 and _escaped(text, pos):
+                pos = text.rfind('"', 0, pos)
+            if pos < 0:
+                return None
+        elif char in '}]':
+            depth += 1
+        elif char in '{[':
+            if depth == 0:
+                return pos if char == '{' else None
+            depth -= 1
+        pos -= 1
+    return None
+
+
+def _matches(node: Any, node_filters: Sequence[NodeFilter]) -> bool:
+    return isinstance(node, dict) and any(f.matches(node) for f in node_filters)
+
+
+def _search_nodes(text: str, start: int, end: int, node_filters: Tuple[NodeFilter, ...]) -> List[Dict[str, Any]]:
+    nodes = []
+    decoded_to = start
+    for match in type_marker(node_filters).finditer(text, start, end):
+        # Inside a node already decoded, or a key inside a string
+        if match.start() < decoded_to or _escaped(text, match.start()):
+            continue
+        node_start = _object_start(text, match.start())
+        if node_start is None or node_start < start:
+            continue
+        node, decoded_to = _decoder.raw_decode(text, node_start)
+        if _matches(node, node_filters):
+            nodes.append(node)
+    return nodes
+
+
+def _decode_nodes(text: str, pos: int, node_filters: Sequence[NodeFilter]) -> Tuple[List[Dict[str, Any]], int]:
+    # The nodes array one element at a time; returns the matching nodes and the position after it
+    nodes = []
+    pos = _skip(text, pos + 1)
+    if text.startswith(']', pos):
+        return nodes, pos + 1
+    while True:
+        node, pos = _decoder.raw_decode(text, pos)
+        if _matches(node, node_filters):
+            nodes.append(node)
+        pos = _skip(text, pos)
+        if text.startswith(',', pos):
+            pos = _skip(text, pos + 1)
+        elif text.startswith(']', pos):
+            return nodes, pos + 1
+        else:
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, pos)
+
+
+def _read_members(text: str, pos: int, members: Dict[str, Any], node_filters: Optional[Tuple[NodeFilter, ...]]) -> bool:
+    # "key": value pairs up to the closing brace of the top-level object, which must end the
+    # text. Returns False where the text doesn't continue that way.
+    while True:
+        if not text.startswith('"', pos):
+            return False
+        key, pos = scanstring(text, pos + 1)
+        pos = _skip(text, pos)
+        if not text.startswith(':', pos):
+            return False
+        pos = _skip(text, pos + 1)
+        if key == 'nodes' and node_filters is not None and text.startswith('[', pos):
+            for candidate in NODES_END.finditer(text, pos):
+                rest = {}
+                try:
+                    found = _read_members(text, candidate.end(), rest, None)
+                except ValueError:
+                    found = False
+                if found:
+                    members[key] = _search_nodes(text, pos + 1, candidate.start(), node_filters)
+                    members.update(rest)
+                    return True
+            members[key], pos = _decode_nodes(text, pos, node_filters)
+        else:
+            members[key], pos = _decoder.raw_decode(text, pos)
+        pos = _skip(text, pos)
+        if text.startswith(',', pos):
+            pos = _skip(text, pos + 1)
+        elif text.startswith('}', pos):
+            return _skip(text, pos + 1) == len(text)
+        else:
+            return False
+
+
+def read_workflow(text: str, node_filters: Sequence[NodeFilter]) -> Any:
+    # Raises json.JSONDecodeError for invalid JSON, like json.loads
+    node_filters = tuple(node_filters)
+    pos = _skip(text, 0)
+    if text.startswith('{', pos):
+        workflow = {}
+        pos = _skip(text, pos + 1)
+        try:
+            if _read_members(text, pos, workflow, node_filters):
+                return workflow
+        except ValueError:
+            pass
+    # Not an object, or not valid JSON: json.loads gives the same result or error as before
+    return json.loads(text)